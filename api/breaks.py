@@ -0,0 +1,605 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from columnar import (Chunk, Dataset, DatasetWriter, concat_chunks, convert_column, empty_chunk, read_chunk_file,
+                      write_chunk_file)
+from combine import key_hashes
+from config_loader import RULE_ROW_SETS
+from expressions import compile_program
+
+logger = logging.getLogger(__name__)
+
+# Runs kept as delta files before they are folded into the store's base file
+BREAK_COMPACT_RUNS = int(os.environ.get("BREAK_COMPACT_RUNS", "8"))
+BREAK_STORE_INDEX = "index.json"
+HASH_COLUMN = "break_hash"
+ROW_SET_COLUMN = "row_set"
+STATUS_COLUMN = "break_status"
+OPENED_COLUMN = "break_opened"
+CLOSED_COLUMN = "break_closed"
+AGE_COLUMN = "break_age_days"
+
+# Runs between snapshots of the open breaks; bounds how many batches a point-in-time query replays
+BREAK_HISTORY_SNAPSHOT_RUNS = int(os.environ.get("BREAK_HISTORY_SNAPSHOT_RUNS", "20"))
+HISTORY_DIR = "history"
+HISTORY_INDEX = "history.json"
+EVENTS_FILE = "events.bin"
+# One fixed-width record per event; days are counted from 1970-01-01
+EVENT_DTYPE = np.dtype([("day", "<i4"), ("event", "u1"), ("hash", "<u8"), ("opened", "<i4")])
+EVENT_OPENED, EVENT_AGED, EVENT_CLOSED = 1, 2, 3
+EVENT_NAMES = {EVENT_OPENED: "opened", EVENT_AGED: "aged", EVENT_CLOSED: "closed"}
+
+_store_locks: Dict[str, threading.Lock] = {}
+_store_locks_guard = threading.Lock()
+
+
+def break_store_path(root: str, control: str) -> str:
+    """Break store directory of one control under ``root``."""
+    return os.path.join(root, "breaks", re.sub(r"[^A-Za-z0-9_.-]", "_", control))
+
+
+def _store_lock(path: str) -> threading.Lock:
+    with _store_locks_guard:
+        return _store_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def break_hashes(chunk: Chunk, keys: List[str], row_set: str) -> np.ndarray:
+    """Identity of every row's break: a 64-bit hash of its row set and key values."""
+    return key_hashes(chunk, keys, RULE_ROW_SETS.index(row_set) + 1)
+
+
+def key_value_hashes(key_schema: Dict[str, str], values: Dict[str, List[Any]],
+                     row_sets: Optional[List[str]] = None) -> np.ndarray:
+    """Break hashes of key values given as one list per key, in every one of ``row_sets`` (default all)."""
+    missing = [key for key in key_schema if key not in values]
+    if missing:
+        raise ValueError(f"break queries need values for every break key, missing {missing}")
+    if len({len(column) for column in values.values()}) > 1:
+        raise ValueError("break query key value lists must have the same length")
+    columns = {}
+    for key, column_type in key_schema.items():
+        converted, nulls, invalid = convert_column(np.asarray([str(value) for value in values[key]]), column_type)
+        if nulls.any() or invalid.any():
+            raise ValueError(f"break query values of '{key}' must be non-null {column_type} values")
+        columns[key] = converted
+    chunk = Chunk(columns)
+    return np.concatenate([break_hashes(chunk, list(key_schema), row_set) for row_set in row_sets or RULE_ROW_SETS])
+
+
+def _in_sorted(sorted_values: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Whether each value is in ``sorted_values`` and its position there (clipped when absent)."""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool), np.zeros(len(values), dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values, positions
+
+
+class OpenBreaks:
+    """The open breaks as of one run, sorted by hash.
+
+    Only hashes and open dates are held; ``source`` and ``row`` locate each
+    break's full record in the store's files for when it is needed.
+    """
+
+    def __init__(self, files: List[str], hashes: np.ndarray, opened: np.ndarray, source: np.ndarray, row: np.ndarray):
+        self.files = files
+        self.hashes = hashes
+        self.opened = opened
+        self.source = source
+        self.row = row
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def apply(self, closed: np.ndarray, hashes: np.ndarray, opened: np.ndarray, source: int, row: np.ndarray) -> None:
+        """Drop the ``closed`` hashes and insert newly opened breaks, keeping the arrays sorted."""
+        self.hashes, (self.opened, self.source, self.row) = _replace_sorted(
+            self.hashes, [self.opened, self.source, self.row], closed,
+            hashes, [opened, np.full(len(hashes), source, dtype=self.source.dtype), row])
+
+
+def _replace_sorted(hashes: np.ndarray, values: List[np.ndarray], removed: np.ndarray, added: np.ndarray,
+                    added_values: List[np.ndarray]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Remove hashes from sorted ``hashes`` and insert others, with an array of values alongside for each.
+
+    Both are located by binary search, so the cost beyond copying the
+    arrays grows with the number of changes, not with their length.
+    """
+    if len(removed):
+        found, positions = _in_sorted(hashes, removed)
+        positions = positions[found]
+        hashes, values = np.delete(hashes, positions), [np.delete(column, positions) for column in values]
+    if len(added):
+        order = np.argsort(added, kind="stable")
+        positions = np.searchsorted(hashes, added[order])
+        hashes = np.insert(hashes, positions, added[order])
+        values = [np.insert(column, positions, new[order]) for column, new in zip(values, added_values)]
+    return hashes, values
+
+
+class BreakStore:
+    """Open breaks of one control, persisted as a base file plus one delta file per run.
+
+    A delta holds the breaks a run opened and closed, so rolling a day
+    writes only what changed. Every ``BREAK_COMPACT_RUNS`` runs the deltas
+    but the latest are folded into a new base; the latest run date can
+    always be rerun, which replaces its delta.
+    """
+
+    def __init__(self, path: str, key_schema: Dict[str, str]):
+        self.path = path
+        self.keys = list(key_schema)
+        self.key_schema = key_schema
+        self.base: Optional[Dict[str, Any]] = None
+        self.deltas: List[Dict[str, Any]] = []
+        index_path = os.path.join(path, BREAK_STORE_INDEX)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index["keys"] == self.keys:
+                self.base, self.deltas = index["base"], index["deltas"]
+            else:
+                logger.warning(f"⚠️ Break keys changed from {index['keys']} to {self.keys}; every break opens afresh")
+
+    @property
+    def columns(self) -> List[str]:
+        return [HASH_COLUMN, ROW_SET_COLUMN, *self.keys, OPENED_COLUMN]
+
+    def read(self, state: OpenBreaks, index: np.ndarray) -> Chunk:
+        """Full records of the breaks at ``index`` of ``state``, in hash order, read only from the files holding them."""
+        parts = [empty_chunk({ROW_SET_COLUMN: "str", **self.key_schema, OPENED_COLUMN: "date"})]
+        parts[0].columns = {HASH_COLUMN: np.zeros(0, dtype=np.uint64), **parts[0].columns}
+        for source in np.unique(state.source[index]).tolist():
+            rows = state.row[index[state.source[index] == source]]
+            parts.append(read_chunk_file(state.files[source], 0, self.columns).take(rows))
+        chunk = concat_chunks(parts)
+        return chunk.take(np.argsort(chunk.columns[HASH_COLUMN], kind="stable"))
+
+    def _file(self, entry: Dict[str, Any]) -> str:
+        return os.path.join(self.path, entry["file"])
+
+    def check_rollable(self, run_date: date) -> None:
+        """Only a date after the latest run, or the latest run itself, can be rolled; earlier runs are final."""
+        if self.base and date.fromisoformat(self.base["run_date"]) >= run_date:
+            raise ValueError(f"breaks are already rolled to {self.base['run_date']}; cannot roll {run_date}")
+        if self.deltas and date.fromisoformat(self.deltas[-1]["run_date"]) > run_date:
+            raise ValueError(f"breaks are already rolled to {self.deltas[-1]['run_date']}; only that date can be "
+                             f"rerun, cannot roll {run_date}")
+
+    def open_breaks(self, run_date: date) -> OpenBreaks:
+        """The breaks open before ``run_date``; a delta of that date (a rerun of the latest run) is left out."""
+        self.check_rollable(run_date)
+        files = [self._file(self.base) if self.base else ""]
+        state = OpenBreaks(files, np.zeros(0, dtype=np.uint64), np.zeros(0, dtype="datetime64[D]"),
+                           np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int64))
+        if self.base:
+            chunk = read_chunk_file(files[0], 0, [HASH_COLUMN, OPENED_COLUMN])
+            state.hashes, state.opened = chunk.columns[HASH_COLUMN], chunk.columns[OPENED_COLUMN]
+            state.source = np.zeros(chunk.num_rows, dtype=np.int16)
+            state.row = np.arange(chunk.num_rows, dtype=np.int64)
+        for delta in self.deltas:
+            if date.fromisoformat(delta["run_date"]) >= run_date:
+                break
+            files.append(self._file(delta))
+            chunk = read_chunk_file(files[-1], 0, [HASH_COLUMN, OPENED_COLUMN, CLOSED_COLUMN])
+            closed = ~chunk.null_mask(CLOSED_COLUMN)
+            rows = np.flatnonzero(~closed)
+            state.apply(np.sort(chunk.columns[HASH_COLUMN][closed]), chunk.columns[HASH_COLUMN][rows],
+                        chunk.columns[OPENED_COLUMN][rows], len(files) - 1, rows)
+        return state
+
+    def last_run_date(self, before: date) -> Optional[str]:
+        dates = [entry["run_date"] for entry in [self.base, *self.deltas]
+                 if entry and date.fromisoformat(entry["run_date"]) < before]
+        return dates[-1] if dates else None
+
+    def append(self, run_date: date, delta: Chunk) -> bool:
+        """Record a run's delta, replacing that of a rerun; returns whether the store was compacted."""
+        self.check_rollable(run_date)
+        os.makedirs(self.path, exist_ok=True)
+        stale = [entry for entry in self.deltas if date.fromisoformat(entry["run_date"]) == run_date]
+        self.deltas = [entry for entry in self.deltas if entry not in stale]
+        entry = {"run_date": run_date.isoformat(), "file": f"delta_{run_date:%Y%m%d}_{uuid.uuid4().hex[:8]}.npz",
+                 "rows": delta.num_rows}
+        write_chunk_file(self._file(entry), delta)
+        self.deltas.append(entry)
+        compacted = len(self.deltas) > max(1, BREAK_COMPACT_RUNS)
+        if compacted:
+            stale += self._compact()
+        self._write_index()
+        for entry in stale:
+            os.remove(self._file(entry))
+        return compacted
+
+    def _compact(self) -> List[Dict[str, Any]]:
+        """Fold all deltas but the latest into a new base; returns the files it replaces."""
+        latest = self.deltas[-1]
+        # The base becomes the state before the latest run, so that run stays rerunnable
+        before = self.open_breaks(date.fromisoformat(latest["run_date"]))
+        records = self.read(before, np.arange(len(before)))
+        base = {"run_date": self.deltas[-2]["run_date"],
+                "file": f"base_{self.deltas[-2]['run_date'].replace('-', '')}_{uuid.uuid4().hex[:8]}.npz",
+                "rows": records.num_rows}
+        write_chunk_file(self._file(base), records)
+        replaced = [entry for entry in [self.base, *self.deltas[:-1]] if entry]
+        self.base, self.deltas = base, [latest]
+        return replaced
+
+    def _write_index(self) -> None:
+        index_path = os.path.join(self.path, BREAK_STORE_INDEX)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"keys": self.keys, "base": self.base, "deltas": self.deltas}, f, indent=1)
+        os.replace(tmp_path, index_path)
+
+
+def _day(value: date) -> int:
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+
+def _last_events(records: np.ndarray) -> np.ndarray:
+    """The last opened or closed record of every break among ``records``, sorted by hash."""
+    records = records[records["event"] != EVENT_AGED]
+    # A stable sort keeps each break's records in log order
+    records = records[np.argsort(records["hash"], kind="stable")]
+    last = np.append(records["hash"][1:] != records["hash"][:-1], True) if len(records) else np.zeros(0, dtype=bool)
+    return records[last]
+
+
+def _oldest(opened: np.ndarray, limit: int) -> np.ndarray:
+    """Positions of the ``limit`` breaks opened first, oldest first.
+
+    Open days span a short range, so a count per day finds the cutoff day
+    in linear time where a partition would sort millions of equal days.
+    """
+    if not len(opened):
+        return np.zeros(0, dtype=np.int64)
+    first_day = opened.min()
+    cutoff = first_day + int(np.searchsorted(np.cumsum(np.bincount(opened - first_day)), limit))
+    older = np.flatnonzero(opened < cutoff)
+    rows = np.concatenate([older, np.flatnonzero(opened == cutoff)[:max(limit - len(older), 0)]])
+    return rows[np.argsort(opened[rows], kind="stable")]
+
+
+class BreakHistory:
+    """Append-only log of the break lifecycle of one control, next to its break store.
+
+    Every run appends one batch of fixed-width ``EVENT_DTYPE`` records to
+    ``events.bin`` (breaks closed, opened and aged past one of the
+    configured ages) and writes the key values of the breaks it opened,
+    sorted by hash. Every ``BREAK_HISTORY_SNAPSHOT_RUNS`` runs, or sooner
+    when more events than open breaks were logged since the last one, the
+    open breaks' hashes and open dates are snapshotted, so the state on any
+    date is a snapshot plus a bounded number of batches. Each batch's byte
+    range in the log is indexed by run date, so date ranges are read
+    without scanning. A rerun truncates the log back to before its date.
+    """
+
+    def __init__(self, store_path: str, key_schema: Optional[Dict[str, str]] = None):
+        """Open the history of a store; without ``key_schema`` (for queries) the recorded one is used."""
+        self.path = os.path.join(store_path, HISTORY_DIR)
+        self.key_schema = key_schema or {}
+        self.batches: List[Dict[str, Any]] = []
+        self.snapshots: List[Dict[str, Any]] = []
+        index_path = os.path.join(self.path, HISTORY_INDEX)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if key_schema is None:
+                self.key_schema = index["key_schema"]
+            if index["key_schema"] == self.key_schema:
+                self.batches, self.snapshots = index["batches"], index["snapshots"]
+            else:
+                replaced = f"{self.path}-{uuid.uuid4().hex[:8]}"
+                logger.warning(f"⚠️ Break keys changed from {index['key_schema']} to {self.key_schema}; "
+                               f"history moved to {replaced} and started afresh")
+                os.replace(self.path, replaced)
+        elif key_schema is None:
+            raise ValueError(f"no break history under {store_path}")
+        self.keys = list(self.key_schema)
+
+    @property
+    def events_path(self) -> str:
+        return os.path.join(self.path, EVENTS_FILE)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def check_rollable(self, run_date: date) -> None:
+        """Events can be recorded for a date after the latest batch, or again for the latest batch's date."""
+        if self.batches and self.batches[-1]["day"] > _day(run_date):
+            latest = np.datetime64(self.batches[-1]["day"], "D")
+            raise ValueError(f"break history already records {latest}; only that date can be rerun, "
+                             f"cannot record {run_date}")
+
+    def record(self, run_date: date, previous_run_date: Optional[str], closed: Chunk, opened: Chunk,
+               carried_hashes: np.ndarray, carried_opened: np.ndarray, age_events: List[int],
+               baseline: Callable[[], Chunk]) -> Dict[str, int]:
+        """Append one run's events; ``opened`` and ``closed`` hold break records, ``carried_*`` the breaks kept open.
+
+        ``baseline`` gives the full records of the breaks open before the run;
+        it is only called when the history starts on a store that already
+        has open breaks, so their key values are known. Callers hold the
+        break store's lock.
+        """
+        self.check_rollable(run_date)
+        day = _day(run_date)
+        os.makedirs(self.path, exist_ok=True)
+        stale = [batch for batch in self.batches if batch["day"] == day]
+        stale_snapshots = [snapshot for snapshot in self.snapshots if snapshot["day"] >= day]
+        self.batches = [batch for batch in self.batches if batch not in stale]
+        self.snapshots = [snapshot for snapshot in self.snapshots if snapshot not in stale_snapshots]
+        if not self.batches and not self.snapshots and len(carried_hashes) + closed.num_rows:
+            self.snapshots.append(self._write_baseline(baseline(), previous_run_date or run_date.isoformat()))
+
+        if previous_run_date:
+            buckets = np.asarray(sorted(age_events), dtype=np.int64)
+            ages = day - carried_opened.astype(np.int64)
+            previous_ages = _day(date.fromisoformat(previous_run_date)) - carried_opened.astype(np.int64)
+            aged = np.searchsorted(buckets, ages, "right") > np.searchsorted(buckets, previous_ages, "right")
+        else:
+            aged = np.zeros(len(carried_hashes), dtype=bool)
+        records = np.zeros(closed.num_rows + opened.num_rows + int(np.count_nonzero(aged)), dtype=EVENT_DTYPE)
+        records["day"] = day
+        parts = [(EVENT_CLOSED, closed.columns[HASH_COLUMN], closed.columns[OPENED_COLUMN]),
+                 (EVENT_OPENED, opened.columns[HASH_COLUMN], opened.columns[OPENED_COLUMN]),
+                 (EVENT_AGED, carried_hashes[aged], carried_opened[aged])]
+        start = 0
+        for event, hashes, opened_days in parts:
+            stop = start + len(hashes)
+            records["event"][start:stop] = event
+            records["hash"][start:stop] = hashes
+            records["opened"][start:stop] = opened_days.astype(np.int64)
+            start = stop
+
+        # Anything past the last indexed batch is a stale rerun or an interrupted append
+        offset = self.batches[-1]["offset"] + self.batches[-1]["count"] if self.batches else 0
+        with open(self.events_path, "ab") as f:
+            f.truncate(offset * EVENT_DTYPE.itemsize)
+            f.write(records.tobytes())
+        batch = {"run_date": run_date.isoformat(), "day": day, "offset": offset, "count": len(records),
+                 "keys_file": None}
+        if opened.num_rows:
+            batch["keys_file"] = f"opened_{run_date:%Y%m%d}_{uuid.uuid4().hex[:8]}.npz"
+            write_chunk_file(self._file(batch["keys_file"]), opened.select([HASH_COLUMN, ROW_SET_COLUMN, *self.keys]))
+        self.batches.append(batch)
+
+        since = self.snapshots[-1]["batches"] if self.snapshots else 0
+        replayed = self.batches[-1]["offset"] + len(records) - self.batches[since]["offset"]
+        # Also snapshot once replaying the log would read as many records as the snapshot holds
+        snapshot_due = (len(self.batches) - since >= max(1, BREAK_HISTORY_SNAPSHOT_RUNS)
+                        or replayed >= len(carried_hashes) + opened.num_rows)
+        if snapshot_due:
+            hashes = np.concatenate([carried_hashes, opened.columns[HASH_COLUMN]])
+            opened_days = np.concatenate([carried_opened, opened.columns[OPENED_COLUMN]])
+            order = np.argsort(hashes, kind="stable")
+            snapshot = {"run_date": run_date.isoformat(), "day": day, "batches": len(self.batches),
+                        "file": f"snapshot_{run_date:%Y%m%d}_{uuid.uuid4().hex[:8]}.npz"}
+            write_chunk_file(self._file(snapshot["file"]),
+                             Chunk({HASH_COLUMN: hashes[order], OPENED_COLUMN: opened_days[order]}))
+            self.snapshots.append(snapshot)
+        self._write_index()
+        for name in [batch["keys_file"] for batch in stale] + [snapshot["file"] for snapshot in stale_snapshots]:
+            if name and os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        return {"events": len(records), "opened": opened.num_rows, "closed": closed.num_rows,
+                "aged": int(np.count_nonzero(aged)), "snapshot": snapshot_due}
+
+    def _write_baseline(self, records: Chunk, run_date: str) -> Dict[str, Any]:
+        """Snapshot of the breaks open when the history starts, with their key values."""
+        snapshot = {"run_date": run_date, "day": _day(date.fromisoformat(run_date)), "batches": 0,
+                    "file": f"baseline_{run_date.replace('-', '')}_{uuid.uuid4().hex[:8]}.npz", "keys": True}
+        write_chunk_file(self._file(snapshot["file"]), records.select([HASH_COLUMN, ROW_SET_COLUMN, *self.keys,
+                                                                        OPENED_COLUMN]))
+        return snapshot
+
+    def _write_index(self) -> None:
+        index_path = self._file(HISTORY_INDEX)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key_schema": self.key_schema, "batches": self.batches, "snapshots": self.snapshots}, f, indent=1)
+        os.replace(tmp_path, index_path)
+
+    def _read_events(self, first: int, last: int) -> np.ndarray:
+        """Records of batches ``first`` to ``last`` (exclusive), one contiguous read."""
+        if first >= last:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        offset = self.batches[first]["offset"]
+        count = self.batches[last - 1]["offset"] + self.batches[last - 1]["count"] - offset
+        return np.fromfile(self.events_path, dtype=EVENT_DTYPE, count=count, offset=offset * EVENT_DTYPE.itemsize)
+
+    def _batch_range(self, start: date, end: date) -> Tuple[int, int]:
+        days = np.asarray([batch["day"] for batch in self.batches], dtype=np.int64)
+        return int(np.searchsorted(days, _day(start), "left")), int(np.searchsorted(days, _day(end), "right"))
+
+    def open_on(self, on: date) -> Tuple[np.ndarray, np.ndarray]:
+        """Hashes and open days of the breaks open after the last run on or before ``on``, sorted by hash.
+
+        Starts from the latest snapshot at or before ``on`` and applies the
+        last opened or closed event of every break logged after it.
+        """
+        day = _day(on)
+        snapshots = [snapshot for snapshot in self.snapshots if snapshot["day"] <= day]
+        hashes, opened = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+        first = 0
+        if snapshots:
+            chunk = read_chunk_file(self._file(snapshots[-1]["file"]), 0, [HASH_COLUMN, OPENED_COLUMN])
+            hashes, opened = chunk.columns[HASH_COLUMN], chunk.columns[OPENED_COLUMN].astype(np.int64)
+            first = snapshots[-1]["batches"]
+        last = self._batch_range(on, on)[1]
+        changes = _last_events(self._read_events(first, last))
+        reopened = changes[changes["event"] == EVENT_OPENED]
+        hashes, (opened,) = _replace_sorted(hashes, [opened], changes["hash"], reopened["hash"],
+                                            [reopened["opened"].astype(np.int64)])
+        return hashes, opened
+
+    def events(self, start: date, end: date, hashes: Optional[np.ndarray] = None) -> np.ndarray:
+        """Records logged by runs from ``start`` to ``end`` inclusive, optionally only for the given break hashes."""
+        records = self._read_events(*self._batch_range(start, end))
+        if hashes is not None:
+            records = records[np.isin(records["hash"], hashes)]
+        return records
+
+    def key_values(self, hashes: np.ndarray, opened: np.ndarray) -> Dict[int, List[Any]]:
+        """Row set and key values of breaks by hash, from the key file of the run that opened each one.
+
+        Breaks opened before the history started are found in its baseline;
+        breaks found nowhere are left out.
+        """
+        by_day = {batch["day"]: batch["keys_file"] for batch in self.batches if batch["keys_file"]}
+        baselines = [snapshot["file"] for snapshot in self.snapshots if snapshot.get("keys")]
+        hashes, opened = np.asarray(hashes, dtype=np.uint64), np.asarray(opened, dtype=np.int64)
+        found: Dict[int, List[Any]] = {}
+        for opened_day in np.unique(opened).tolist():
+            wanted = hashes[opened == opened_day]
+            for name in ([by_day[opened_day]] if opened_day in by_day else []) + baselines:
+                chunk = read_chunk_file(self._file(name), 0, [HASH_COLUMN, ROW_SET_COLUMN, *self.keys])
+                # Key files are sorted by hash
+                hit, positions = _in_sorted(chunk.columns[HASH_COLUMN], wanted)
+                rows = chunk.take(positions[hit]).select([ROW_SET_COLUMN, *self.keys]).to_rows()
+                found.update(zip(wanted[hit].tolist(), rows))
+                wanted = wanted[~hit]
+                if not len(wanted):
+                    break
+        return found
+
+    def _rows(self, hashes: np.ndarray, opened: np.ndarray, day: int) -> List[Dict[str, Any]]:
+        values = self.key_values(hashes, opened)
+        rows = []
+        for break_hash, opened_day in zip(hashes.tolist(), opened.astype(np.int64).tolist()):
+            row_set, *key_values = values.get(break_hash, [None] * (len(self.keys) + 1))
+            rows.append({ROW_SET_COLUMN: row_set, **dict(zip(self.keys, key_values)),
+                         OPENED_COLUMN: str(np.datetime64(opened_day, "D")), AGE_COLUMN: day - opened_day})
+        return rows
+
+    def open_rows(self, on: date, limit: int) -> Dict[str, Any]:
+        """The breaks open on a date: their number and the oldest ``limit`` of them with their keys."""
+        hashes, opened = self.open_on(on)
+        oldest = _oldest(opened, limit)
+        return {"date": on.isoformat(), "open": len(hashes), "rows": self._rows(hashes[oldest], opened[oldest], _day(on))}
+
+    def event_rows(self, start: date, end: date, hashes: Optional[np.ndarray], limit: int) -> Dict[str, Any]:
+        """Events of a date range, optionally for some breaks only: counts per kind and the first ``limit``."""
+        records = self.events(start, end, hashes)
+        counts = np.bincount(records["event"], minlength=max(EVENT_NAMES) + 1)
+        rows = self._rows(records["hash"][:limit], records["opened"][:limit], 0)
+        for row, record in zip(rows, records[:limit].tolist()):
+            row.pop(AGE_COLUMN)
+            row.update({"run_date": str(np.datetime64(record[0], "D")), "event": EVENT_NAMES[record[1]],
+                        AGE_COLUMN: record[0] - record[3]})
+        return {"start": start.isoformat(), "end": end.isoformat(), "events": len(records),
+                **{name: int(counts[event]) for event, name in EVENT_NAMES.items()}, "rows": rows}
+
+
+def roll_breaks(datasets: Dict[str, Dataset], conditions: Dict[str, Optional[str]], keys: List[str],
+                variables: Dict[str, Any], store_path: str, run_date: date, output_path: str,
+                age_events: List[int]) -> Tuple[Dict[str, Dataset], Dict[str, Any]]:
+    """Merge a run's breaks into the break store and return the open breaks per row set plus the closed ones.
+
+    A break is a row its row set's condition selects, identified by its row
+    set and key values. Each row is looked up in the store's sorted hash
+    index: known breaks keep their open date and age, others open today;
+    stored breaks not seen today close. Only the opened and closed breaks
+    are written back, and the changes are appended to the store's history
+    with an ``aged`` event for breaks reaching one of ``age_events`` days.
+    Rows with a null key part cannot be tracked and are reported as new
+    every run.
+    """
+    started = time.perf_counter()
+    for row_set in conditions:
+        missing = [key for key in keys if key not in datasets[row_set].schema]
+        if missing:
+            raise ValueError(f"break keys {missing} are not in the {row_set} rows")
+    key_schema = {key: datasets[next(iter(conditions))].schema[key] for key in keys}
+    day = np.datetime64(run_date, "D")
+    with _store_lock(store_path):
+        store = BreakStore(store_path, key_schema)
+        state = store.open_breaks(run_date)
+        # Checked before anything is written, so a rejected date leaves both the store and the history alone
+        break_history = BreakHistory(store_path, key_schema)
+        break_history.check_rollable(run_date)
+        previous_run_date = store.last_run_date(run_date)
+        results: Dict[str, Dataset] = {}
+        seen, opened_parts = [], []
+        stats: Dict[str, Any] = {"keys": keys, "run_date": run_date.isoformat(), "previous_run_date": previous_run_date,
+                                 "previously_open": len(state), "row_sets": {}}
+        for row_set, condition in conditions.items():
+            dataset = datasets[row_set]
+            program = compile_program([], [condition] if condition else [], dataset.schema, variables)
+            writer = DatasetWriter(os.path.join(output_path, row_set),
+                                   {**dataset.schema, STATUS_COLUMN: "str", OPENED_COLUMN: "date", AGE_COLUMN: "int"})
+            row_stats = {"rows": 0, "new": 0, "carried": 0, "untracked": 0}
+            for chunk in dataset.iter_chunks():
+                chunk = program.apply(chunk)
+                hashes = break_hashes(chunk, keys, row_set)
+                tracked = np.ones(chunk.num_rows, dtype=bool)
+                for key in keys:
+                    tracked &= ~chunk.null_mask(key)
+                found, positions = _in_sorted(state.hashes, hashes)
+                found &= tracked
+                opened = np.where(found, state.opened[positions] if len(state) else day, day)
+                chunk.columns[STATUS_COLUMN] = np.where(found, "carried", "new")
+                chunk.columns[OPENED_COLUMN] = opened
+                chunk.columns[AGE_COLUMN] = (day - opened).astype(np.int64)
+                writer.write(chunk)
+                new = np.flatnonzero(tracked & ~found)
+                if len(new):
+                    part = chunk.select(keys).take(new)
+                    part.columns = {HASH_COLUMN: hashes[new], ROW_SET_COLUMN: np.full(len(new), row_set),
+                                    **part.columns, OPENED_COLUMN: opened[new]}
+                    opened_parts.append(part)
+                seen.append(hashes[tracked])
+                row_stats["rows"] += chunk.num_rows
+                row_stats["carried"] += int(np.count_nonzero(found))
+                row_stats["new"] += int(chunk.num_rows - np.count_nonzero(found))
+                row_stats["untracked"] += int(chunk.num_rows - np.count_nonzero(tracked))
+            results[row_set] = writer.close({"source": dataset.path, "run_date": run_date.isoformat()})
+            stats["row_sets"][row_set] = row_stats
+
+        seen_hashes = np.sort(np.concatenate(seen)) if seen else np.zeros(0, dtype=np.uint64)
+        still_open = _in_sorted(seen_hashes, state.hashes)[0]
+        closed = store.read(state, np.flatnonzero(~still_open))
+        closed.columns[CLOSED_COLUMN] = np.full(closed.num_rows, day)
+        closed.columns[AGE_COLUMN] = (day - closed.columns[OPENED_COLUMN]).astype(np.int64)
+        # A break on several rows today opens once
+        opened = concat_chunks([store.read(state, np.zeros(0, dtype=np.int64)), *opened_parts])
+        opened = opened.take(np.unique(opened.columns[HASH_COLUMN], return_index=True)[1])
+        opened.columns[CLOSED_COLUMN] = np.full(opened.num_rows, day)
+        opened.nulls[CLOSED_COLUMN] = np.ones(opened.num_rows, dtype=bool)
+        delta = concat_chunks([closed.select([*store.columns, CLOSED_COLUMN]), opened])
+        compacted = False
+        if delta.num_rows or store.base or store.deltas:
+            compacted = store.append(run_date, delta)
+        carried_hashes, carried_opened = state.hashes[still_open], state.opened[still_open]
+        history = break_history.record(
+            run_date, previous_run_date, closed, opened, carried_hashes, carried_opened, age_events,
+            lambda: store.read(state, np.arange(len(state))))
+
+    closed_writer = DatasetWriter(os.path.join(output_path, "closed"),
+                                  {ROW_SET_COLUMN: "str", **key_schema, OPENED_COLUMN: "date", CLOSED_COLUMN: "date",
+                                   AGE_COLUMN: "int"})
+    closed_writer.write(closed.select([ROW_SET_COLUMN, *keys, OPENED_COLUMN, CLOSED_COLUMN, AGE_COLUMN]))
+    results["closed"] = closed_writer.close({"run_date": run_date.isoformat()})
+    stats.update({
+        "opened": opened.num_rows,
+        "closed": closed.num_rows,
+        "open": len(carried_hashes) + opened.num_rows,
+        "oldest_opened": str(carried_opened.min()) if len(carried_hashes) else (str(day) if opened.num_rows else None),
+        "aged": history["aged"],
+        "store": {"path": store_path, "base_rows": store.base["rows"] if store.base else 0,
+                  "delta_runs": len(store.deltas), "delta_rows": delta.num_rows, "compacted": compacted,
+                  "history_events": history["events"], "history_snapshot": history["snapshot"]},
+        "seconds": round(time.perf_counter() - started, 3),
+    })
+    logger.info(f"📅 Rolled breaks to {run_date}: {opened.num_rows} opened, {closed.num_rows} closed, "
+                f"{stats['open']} open in {stats['seconds']:.2f} s")
+    return results, stats
@@ -0,0 +1,515 @@
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from workers import check_cancelled
+
+DATASET_MANIFEST = "dataset.json"
+
+# Text columns with at most this many distinct values (and at most this share of distinct values
+# per row) are stored as integer codes into a dictionary
+DICTIONARY_MAX_CARDINALITY = int(os.environ.get("DICTIONARY_MAX_CARDINALITY", "65536"))
+DICTIONARY_MAX_RATIO = float(os.environ.get("DICTIONARY_MAX_RATIO", "0.5"))
+_DICTIONARY_SAMPLE_ROWS = 4096
+
+_EMPTY_DTYPES = {"int": np.int64, "float": np.float64, "bool": np.bool_, "date": "datetime64[D]"}
+_TRUE_VALUES = np.array(["1", "true", "t", "y", "yes"])
+_FALSE_VALUES = np.array(["0", "false", "f", "n", "no"])
+
+
+class DictionaryArray:
+    """A text column stored as integer codes into a sorted array of its distinct values.
+
+    Behaves like a 1-d unicode array for indexing, ``len``, ``tolist`` and
+    ``np.asarray``, so code that does not know about it still works on the
+    decoded values. Equality, membership, grouping and joins should use
+    ``equals``/``isin``/``factorize``/``unify_dictionaries``, which only touch
+    the codes. Because the dictionary is sorted, code order is value order.
+    """
+
+    __slots__ = ("codes", "dictionary")
+    __hash__ = None
+
+    def __init__(self, codes: np.ndarray, dictionary: np.ndarray):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    @classmethod
+    def encode(cls, values: np.ndarray) -> "DictionaryArray":
+        dictionary, codes = np.unique(values, return_inverse=True)
+        return cls(codes.reshape(-1).astype(code_dtype(len(dictionary))), dictionary)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.dictionary.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.dictionary.nbytes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.dictionary[self.codes[index]]
+        return DictionaryArray(self.codes[index], self.dictionary)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        values = self.decode()
+        return values if dtype is None else values.astype(dtype)
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return self.equals(other)
+        return np.asarray(self) == other
+
+    def __ne__(self, other):
+        return ~self.__eq__(other)
+
+    def decode(self) -> np.ndarray:
+        return self.dictionary[self.codes]
+
+    def tolist(self) -> List[str]:
+        words = self.dictionary.tolist()
+        return [words[code] for code in self.codes.tolist()]
+
+    def lookup(self, value: str) -> int:
+        """Code of ``value``, or -1 when it is not in the dictionary."""
+        position = int(np.searchsorted(self.dictionary, value))
+        if position < len(self.dictionary) and self.dictionary[position] == value:
+            return position
+        return -1
+
+    def equals(self, value: str) -> np.ndarray:
+        code = self.lookup(value)
+        if code < 0:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+    def isin(self, values) -> np.ndarray:
+        return np.isin(self.dictionary, np.asarray(values, dtype=str))[self.codes]
+
+    def factorize(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Group ids per row and the value of each group, e.g. for ``np.bincount`` aggregations."""
+        return self.codes, self.dictionary
+
+
+def code_dtype(cardinality: int) -> np.dtype:
+    if cardinality <= 1 << 8:
+        return np.dtype(np.uint8)
+    if cardinality <= 1 << 16:
+        return np.dtype(np.uint16)
+    return np.dtype(np.int32)
+
+
+def maybe_dictionary_encode(values: np.ndarray):
+    """Dictionary-encode a text column when its cardinality is low, otherwise return it unchanged."""
+    if isinstance(values, DictionaryArray) or values.dtype.kind not in "US" or len(values) == 0:
+        return values
+    # A sample rules out identifier-like columns without sorting the whole chunk
+    sample = values[:_DICTIONARY_SAMPLE_ROWS]
+    if len(sample) >= 64 and len(np.unique(sample)) > len(sample) * DICTIONARY_MAX_RATIO:
+        return values
+    encoded = DictionaryArray.encode(values)
+    if len(encoded.dictionary) > DICTIONARY_MAX_CARDINALITY:
+        return values
+    return encoded
+
+
+def map_text(values, function: Callable[[np.ndarray], np.ndarray]):
+    """Apply a vectorized text function; on a dictionary column it only touches the dictionary."""
+    if isinstance(values, DictionaryArray):
+        dictionary, inverse = np.unique(function(values.dictionary), return_inverse=True)
+        return DictionaryArray(inverse.reshape(-1).astype(code_dtype(len(dictionary)))[values.codes], dictionary)
+    return function(np.asarray(values))
+
+
+def unify_dictionaries(columns: List[Any]) -> List[DictionaryArray]:
+    """Re-code text columns onto one shared dictionary so their codes are directly comparable."""
+    encoded = [column if isinstance(column, DictionaryArray) else DictionaryArray.encode(np.asarray(column))
+               for column in columns]
+    if all(column.dictionary is encoded[0].dictionary for column in encoded):
+        return encoded
+    dictionary = np.unique(np.concatenate([column.dictionary for column in encoded]))
+    dtype = code_dtype(len(dictionary))
+    return [DictionaryArray(np.searchsorted(dictionary, column.dictionary).astype(dtype)[column.codes], dictionary)
+            for column in encoded]
+
+
+def concat_columns(columns: List[Any]):
+    if any(isinstance(column, DictionaryArray) for column in columns):
+        if all(isinstance(column, DictionaryArray) for column in columns):
+            unified = unify_dictionaries(columns)
+            return DictionaryArray(np.concatenate([column.codes for column in unified]), unified[0].dictionary)
+        columns = [np.asarray(column) for column in columns]
+    return np.concatenate(columns)
+
+
+class Chunk:
+    """A window of rows stored column-wise as typed numpy arrays.
+
+    ``nulls`` and ``invalid`` hold boolean masks for columns that have
+    missing values or values that could not be converted to the column type.
+    ``row_offset`` is the position of the first row within its dataset.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], row_offset: int = 0,
+                 nulls: Optional[Dict[str, np.ndarray]] = None, invalid: Optional[Dict[str, np.ndarray]] = None):
+        self.columns = columns
+        self.row_offset = row_offset
+        self.nulls = nulls or {}
+        self.invalid = invalid or {}
+
+    @property
+    def num_rows(self) -> int:
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.columns)
+
+    def null_mask(self, name: str) -> np.ndarray:
+        mask = self.nulls.get(name)
+        return mask if mask is not None else np.zeros(self.num_rows, dtype=bool)
+
+    def invalid_mask(self, name: str) -> np.ndarray:
+        mask = self.invalid.get(name)
+        return mask if mask is not None else np.zeros(self.num_rows, dtype=bool)
+
+    def row_ids(self) -> np.ndarray:
+        return np.arange(self.row_offset, self.row_offset + self.num_rows, dtype=np.int64)
+
+    def select(self, names: List[str]) -> "Chunk":
+        return Chunk({name: self.columns[name] for name in names}, self.row_offset,
+                     {name: mask for name, mask in self.nulls.items() if name in names},
+                     {name: mask for name, mask in self.invalid.items() if name in names})
+
+    def take(self, index: np.ndarray) -> "Chunk":
+        """Rows selected by a boolean mask or an integer index array."""
+        return Chunk({name: values[index] for name, values in self.columns.items()}, self.row_offset,
+                     {name: mask[index] for name, mask in self.nulls.items()},
+                     {name: mask[index] for name, mask in self.invalid.items()})
+
+    def head(self, n: int) -> "Chunk":
+        return self.take(slice(0, n))
+
+    def to_rows(self, limit: Optional[int] = None) -> List[List[Any]]:
+        """Plain Python rows, used for the table preview shown in the dashboard."""
+        preview = self.head(limit) if limit is not None else self
+        columns = []
+        for name, values in preview.columns.items():
+            cells = to_python_list(values)
+            mask = preview.nulls.get(name)
+            if mask is not None and mask.any():
+                cells = [None if is_null else cell for cell, is_null in zip(cells, mask.tolist())]
+            columns.append(cells)
+        return [list(row) for row in zip(*columns)]
+
+
+def to_python_list(values: np.ndarray) -> List[Any]:
+    if values.dtype.kind == "M":
+        return [None if np.isnat(v) else str(v) for v in values]
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+
+def empty_chunk(schema: Dict[str, str]) -> Chunk:
+    """A chunk with no rows but the typed columns of ``schema``."""
+    return Chunk({name: np.zeros(0, dtype=_EMPTY_DTYPES.get(column_type, str)) for name, column_type in schema.items()})
+
+
+def concat_chunks(chunks: List[Chunk]) -> Chunk:
+    if not chunks:
+        return Chunk({})
+    if len(chunks) == 1:
+        return chunks[0]
+    names = chunks[0].column_names
+    columns = {name: concat_columns([chunk.columns[name] for chunk in chunks]) for name in names}
+
+    def merged_masks(attr: str) -> Dict[str, np.ndarray]:
+        used = {name for chunk in chunks for name in getattr(chunk, attr)}
+        merged = {}
+        for name in used:
+            merged[name] = np.concatenate([
+                getattr(chunk, attr).get(name, np.zeros(chunk.num_rows, dtype=bool)) for chunk in chunks
+            ])
+        return merged
+
+    return Chunk(columns, chunks[0].row_offset, merged_masks("nulls"), merged_masks("invalid"))
+
+
+# ---------------------------------------------------------------------------
+# Type conversion
+# ---------------------------------------------------------------------------
+
+def convert_column(raw: np.ndarray, column_type: str, fmt: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Convert a column of raw strings into ``column_type``.
+
+    Returns ``(values, null_mask, invalid_mask)``. Conversion is attempted on
+    the whole array first; only when that fails are the distinct values
+    converted one by one, so per-value Python work is bounded by cardinality.
+    """
+    raw = np.asarray(raw)
+    if raw.dtype.kind != "U":
+        raw = raw.astype(str)
+    stripped = np.char.strip(raw)
+    nulls = stripped == ""
+    invalid = np.zeros(len(raw), dtype=bool)
+
+    if column_type == "str":
+        return maybe_dictionary_encode(raw), nulls, invalid
+    if column_type == "int":
+        values, invalid = _convert_numeric(stripped, nulls, np.int64, int, 0)
+    elif column_type == "float":
+        values, invalid = _convert_numeric(stripped, nulls, np.float64, float, np.nan)
+    elif column_type == "bool":
+        lowered = np.char.lower(stripped)
+        values = np.isin(lowered, _TRUE_VALUES)
+        invalid = ~nulls & ~values & ~np.isin(lowered, _FALSE_VALUES)
+    elif column_type == "date":
+        values, invalid = _convert_date(stripped, nulls, fmt)
+    else:
+        raise ValueError(f"Unsupported column type {column_type}")
+    return values, nulls | invalid, invalid
+
+
+def _convert_numeric(stripped: np.ndarray, nulls: np.ndarray, dtype, parse, fill) -> Tuple[np.ndarray, np.ndarray]:
+    filled = np.where(nulls, "0", stripped)
+    try:
+        values = filled.astype(dtype)
+        if nulls.any():
+            values[nulls] = fill
+        return values, np.zeros(len(stripped), dtype=bool)
+    except (ValueError, OverflowError):
+        pass
+    uniques, inverse = np.unique(filled, return_inverse=True)
+    converted = np.empty(len(uniques), dtype=dtype)
+    ok = np.ones(len(uniques), dtype=bool)
+    for i, text in enumerate(uniques.tolist()):
+        try:
+            converted[i] = parse(text)
+        except (ValueError, OverflowError):
+            converted[i] = fill
+            ok[i] = False
+    inverse = inverse.reshape(-1)
+    values = converted[inverse]
+    invalid = ~ok[inverse] & ~nulls
+    values[nulls | invalid] = fill
+    return values, invalid
+
+
+def _convert_date(stripped: np.ndarray, nulls: np.ndarray, fmt: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    if fmt in (None, "%Y-%m-%d"):
+        try:
+            values = np.where(nulls, "NaT", stripped).astype("datetime64[D]")
+            return values, np.zeros(len(stripped), dtype=bool)
+        except ValueError:
+            pass
+    fmt = fmt or "%Y-%m-%d"
+    uniques, inverse = np.unique(stripped, return_inverse=True)
+    converted = np.empty(len(uniques), dtype="datetime64[D]")
+    ok = np.ones(len(uniques), dtype=bool)
+    for i, text in enumerate(uniques.tolist()):
+        if text == "":
+            converted[i] = np.datetime64("NaT")
+            continue
+        try:
+            converted[i] = np.datetime64(datetime.strptime(text, fmt).date())
+        except ValueError:
+            converted[i] = np.datetime64("NaT")
+            ok[i] = False
+    inverse = inverse.reshape(-1)
+    return converted[inverse], ~ok[inverse] & ~nulls
+
+
+def infer_column_type(raw: np.ndarray) -> str:
+    """Pick the narrowest of int, float, date and str that every non-empty value fits."""
+    stripped = np.char.strip(np.asarray(raw).astype(str))
+    sample = stripped[stripped != ""]
+    if len(sample) == 0:
+        return "str"
+    for column_type, dtype in (("int", np.int64), ("float", np.float64), ("date", "datetime64[D]")):
+        try:
+            sample.astype(dtype)
+            return column_type
+        except (ValueError, OverflowError):
+            continue
+    return "str"
+
+
+# ---------------------------------------------------------------------------
+# On-disk datasets
+# ---------------------------------------------------------------------------
+
+def _chunk_arrays(chunk: Chunk) -> Dict[str, np.ndarray]:
+    arrays = {}
+    for name, values in chunk.columns.items():
+        if isinstance(values, DictionaryArray):
+            arrays[f"c:{name}"] = values.codes
+            arrays[f"d:{name}"] = values.dictionary
+        else:
+            arrays[f"c:{name}"] = values
+    arrays.update({f"n:{name}": mask for name, mask in chunk.nulls.items() if mask.any()})
+    arrays.update({f"i:{name}": mask for name, mask in chunk.invalid.items() if mask.any()})
+    return arrays
+
+
+def write_chunk_file(path: str, chunk: Chunk) -> None:
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **_chunk_arrays(chunk))
+    os.replace(tmp_path, path)
+
+
+def chunk_file_bytes(chunk: Chunk) -> bytes:
+    """The ``.npz`` encoding of a chunk as ``write_chunk_file`` stores it, for writers that hash what they write."""
+    buffer = io.BytesIO()
+    np.savez(buffer, **_chunk_arrays(chunk))
+    return buffer.getvalue()
+
+
+def read_chunk_file(path: str, row_offset: int = 0, columns: Optional[List[str]] = None) -> Chunk:
+    values: Dict[str, np.ndarray] = {}
+    nulls: Dict[str, np.ndarray] = {}
+    invalid: Dict[str, np.ndarray] = {}
+    dictionaries: Dict[str, np.ndarray] = {}
+    with np.load(path, allow_pickle=False) as data:
+        for key in data.files:
+            kind, name = key.split(":", 1)
+            if columns is not None and name not in columns:
+                continue
+            target = {"c": values, "n": nulls, "i": invalid, "d": dictionaries}[kind]
+            target[name] = data[key]
+    for name, dictionary in dictionaries.items():
+        values[name] = DictionaryArray(values[name], dictionary)
+    if columns is not None:
+        values = {name: values[name] for name in columns if name in values}
+    return Chunk(values, row_offset, nulls, invalid)
+
+
+class DatasetWriter:
+    """Writes chunks to ``path`` as numbered ``.npz`` files plus a JSON manifest."""
+
+    def __init__(self, path: str, schema: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.schema = dict(schema or {})
+        self.chunks: List[Dict[str, Any]] = []
+        self.num_rows = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, chunk: Chunk) -> None:
+        check_cancelled()
+        if chunk.num_rows == 0:
+            return
+        for name, values in chunk.columns.items():
+            self.schema.setdefault(name, dtype_to_column_type(values))
+        file_name = f"chunk_{len(self.chunks):06d}.npz"
+        write_chunk_file(os.path.join(self.path, file_name), chunk)
+        self.add_chunk_file(file_name, chunk.num_rows)
+
+    def add_chunk_file(self, file_path: str, num_rows: int) -> None:
+        """Register an already written chunk file (relative to the dataset, or absolute)."""
+        check_cancelled()
+        self.chunks.append({"file": file_path, "rows": num_rows, "row_offset": self.num_rows})
+        self.num_rows += num_rows
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None) -> "Dataset":
+        manifest = {
+            "schema": self.schema,
+            "num_rows": self.num_rows,
+            "chunks": self.chunks,
+            "metadata": metadata or {},
+        }
+        tmp_path = os.path.join(self.path, f"{DATASET_MANIFEST}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, DATASET_MANIFEST))
+        return Dataset(self.path, manifest)
+
+
+class Dataset:
+    """A chunked, column-typed table on disk that stages consume chunk by chunk."""
+
+    def __init__(self, path: str, manifest: Dict[str, Any]):
+        self.path = path
+        self.schema: Dict[str, str] = manifest["schema"]
+        self.num_rows: int = manifest["num_rows"]
+        self.chunks: List[Dict[str, Any]] = manifest["chunks"]
+        self.metadata: Dict[str, Any] = manifest.get("metadata", {})
+
+    @classmethod
+    def open(cls, path: str) -> "Dataset":
+        with open(os.path.join(path, DATASET_MANIFEST)) as f:
+            return cls(path, json.load(f))
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.schema)
+
+    @property
+    def file_bytes(self) -> int:
+        """Size of the chunk files; chunks are stored uncompressed, so this is close to the size in memory."""
+        return sum(os.path.getsize(os.path.join(self.path, entry["file"])) for entry in self.chunks)
+
+    def iter_chunks(self, columns: Optional[List[str]] = None) -> Iterator[Chunk]:
+        for entry in self.chunks:
+            check_cancelled()
+            yield read_chunk_file(os.path.join(self.path, entry["file"]), entry["row_offset"], columns)
+
+    def read_all(self, columns: Optional[List[str]] = None) -> Chunk:
+        if not self.chunks:
+            return empty_chunk({name: self.schema[name] for name in (columns or self.column_names)})
+        return concat_chunks(list(self.iter_chunks(columns)))
+
+    def read_rows(self, start: int, stop: int, columns: Optional[List[str]] = None) -> Chunk:
+        """Rows ``start:stop`` of the dataset, reading only the chunks that overlap them."""
+        parts = []
+        for entry in self.chunks:
+            first, last = entry["row_offset"], entry["row_offset"] + entry["rows"]
+            if last <= start or first >= stop:
+                continue
+            chunk = read_chunk_file(os.path.join(self.path, entry["file"]), first, columns)
+            parts.append(chunk.take(slice(max(start - first, 0), min(stop, last) - first)))
+        if not parts:
+            return empty_chunk({name: self.schema[name] for name in (columns or self.column_names)})
+        chunk = concat_chunks(parts)
+        chunk.row_offset = start
+        return chunk
+
+    def preview(self, limit: int) -> Tuple[List[str], List[List[Any]]]:
+        if not self.chunks:
+            return self.column_names, []
+        rows: List[List[Any]] = []
+        for chunk in self.iter_chunks():
+            rows.extend(chunk.to_rows(limit - len(rows)))
+            if len(rows) >= limit:
+                break
+        return self.column_names, rows
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "num_rows": self.num_rows,
+            "num_chunks": len(self.chunks),
+            "schema": self.schema,
+        }
+
+
+def dtype_to_column_type(values: np.ndarray) -> str:
+    kind = values.dtype.kind
+    if kind in "iu":
+        return "int"
+    if kind == "f":
+        return "float"
+    if kind == "b":
+        return "bool"
+    if kind == "M":
+        return "date"
+    return "str"
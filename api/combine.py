@@ -0,0 +1,601 @@
+import logging
+import math
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from columnar import (Chunk, Dataset, DatasetWriter, DictionaryArray, concat_chunks, empty_chunk, read_chunk_file,
+                      write_chunk_file)
+from config_loader import CombineSpec
+from enrichment import key_codes
+from matching import match_residues
+from workers import WORKER_PROCESSES, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Smaller reconciliations are joined in-process rather than across the process pool
+COMBINE_PARALLEL_MIN_ROWS = int(os.environ.get("COMBINE_PARALLEL_MIN_ROWS", "2000000"))
+# Number of hash partitions (or key ranges, for sorted inputs) joined independently
+COMBINE_PARTITIONS = int(os.environ.get("COMBINE_PARTITIONS", str(max(WORKER_PROCESSES * 2, 1))))
+
+# Memory one process may use for a join; inputs needing more are joined out of core with partition files
+COMBINE_MEMORY_BUDGET_MB = int(os.environ.get("COMBINE_MEMORY_BUDGET_MB", "2048"))
+# Peak memory of an in-memory join relative to the size of its inputs (keys, sort order, gathered output)
+COMBINE_MEMORY_FACTOR = float(os.environ.get("COMBINE_MEMORY_FACTOR", "3"))
+# How often an oversized spilled partition is split again before it is joined regardless
+COMBINE_MAX_SPILL_DEPTH = int(os.environ.get("COMBINE_MAX_SPILL_DEPTH", "3"))
+
+ROW_SETS = ("matched", "src_only", "tgt_only")
+# Composite key code carried by partition files
+KEY_COLUMN = "__key"
+# Column of ``matched`` naming the rule that paired each row, when match rules are configured
+MATCH_RULE_COLUMN = "match_rule"
+NUMERIC_TYPES = {"int", "float", "date"}
+
+
+class CombineLayout:
+    """Output columns of the three row sets.
+
+    Key columns keep their names; every other column is prefixed with its
+    side, so ``src_only`` rows have the same columns as the SRC half of
+    ``matched`` rows. With match rules, rows can pair on different keys, so
+    ``matched`` also carries the TGT keys (prefixed) and the rule that
+    paired each row, ``key`` for the key join.
+    """
+
+    def __init__(self, keys: List[str], src_schema: Dict[str, str], tgt_schema: Dict[str, str], spec: CombineSpec):
+        for side, schema in (("src", src_schema), ("tgt", tgt_schema)):
+            missing = [key for key in keys if key not in schema]
+            if missing:
+                raise ValueError(f"combine keys {missing} are not in the {side} dataset")
+        mismatched = [key for key in keys if src_schema[key] != tgt_schema[key]]
+        if mismatched:
+            raise ValueError(f"combine keys {mismatched} have different types in the src and tgt datasets")
+        self.keys = keys
+        self.src_schema = src_schema
+        self.tgt_schema = tgt_schema
+        self.src_names = {name: name if name in keys else f"{spec.src_prefix}{name}" for name in src_schema}
+        self.tgt_names = {name: name if name in keys else f"{spec.tgt_prefix}{name}" for name in tgt_schema}
+        src_only = {self.src_names[name]: column_type for name, column_type in src_schema.items()}
+        tgt_only = {self.tgt_names[name]: column_type for name, column_type in tgt_schema.items()}
+        clashes = sorted(set(src_only) & set(tgt_only) - set(keys))
+        if clashes:
+            raise ValueError(f"combine output columns {clashes} appear on both sides; change the prefixes")
+        self.match_rules = spec.match_rules
+        for rule in spec.match_rules:
+            for field in rule.fields:
+                for side, schema in (("src", src_schema), ("tgt", tgt_schema)):
+                    if field.column not in schema:
+                        raise ValueError(f"match rule '{rule.name}' column '{field.column}' is not in the {side} dataset")
+                if field.tolerance is not None and {src_schema[field.column], tgt_schema[field.column]} - NUMERIC_TYPES:
+                    raise ValueError(f"match rule '{rule.name}' tolerance needs a numeric or date column, "
+                                     f"not '{field.column}'")
+        matched = {**src_only, **tgt_only}
+        self.tgt_key_names = {}
+        if spec.match_rules:
+            self.tgt_key_names = {key: f"{spec.tgt_prefix}{key}" for key in keys}
+            extra = {**{name: tgt_schema[key] for key, name in self.tgt_key_names.items()}, MATCH_RULE_COLUMN: "str"}
+            clashes = sorted(set(matched) & set(extra))
+            if clashes:
+                raise ValueError(f"combine output columns {clashes} appear twice; change the prefixes")
+            matched.update(extra)
+        self.schemas = {"matched": matched, "src_only": src_only, "tgt_only": tgt_only}
+
+    def matched_chunk(self, src: Chunk, tgt: Chunk, rule: str) -> Chunk:
+        """``matched`` rows from SRC rows and the TGT rows paired with them, both in input column names."""
+        src_half = _rename(src, self.src_names)
+        tgt_names = {name: renamed for name, renamed in self.tgt_names.items() if name not in self.keys}
+        tgt_half = _rename(tgt, {**tgt_names, **self.tgt_key_names})
+        chunk = Chunk({**src_half.columns, **tgt_half.columns}, 0, {**src_half.nulls, **tgt_half.nulls},
+                      {**src_half.invalid, **tgt_half.invalid})
+        if self.match_rules:
+            chunk.columns[MATCH_RULE_COLUMN] = DictionaryArray(np.zeros(src.num_rows, dtype=np.uint8), np.array([rule]))
+        return chunk
+
+
+def join_key_codes(src: Chunk, tgt: Chunk, keys: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Composite key of every SRC and TGT row as int64 codes comparable across both sides.
+
+    Each key column is coded against the sorted distinct values of both
+    sides, so code order is key order; rows with a null key get -1.
+    """
+    src_codes, tgt_codes, sizes = [], [], []
+    for name in keys:
+        src_values, tgt_values = src.columns[name], tgt.columns[name]
+        distinct = [values.dictionary if isinstance(values, DictionaryArray) else np.asarray(values)
+                    for values in (src_values, tgt_values)]
+        uniques = np.unique(np.concatenate(distinct))
+        src_codes.append(key_codes(src_values, src.null_mask(name), uniques))
+        tgt_codes.append(key_codes(tgt_values, tgt.null_mask(name), uniques))
+        sizes.append(max(len(uniques), 1))
+    codes = [np.concatenate([s, t]) for s, t in zip(src_codes, tgt_codes)]
+    valid = np.ones(src.num_rows + tgt.num_rows, dtype=bool)
+    for column_codes in codes:
+        valid &= column_codes >= 0
+    if int(np.prod(sizes, dtype=object)) < 2 ** 63:
+        combined = np.zeros(len(valid), dtype=np.int64)
+        for column_codes, size in zip(codes, sizes):
+            combined = combined * size + np.maximum(column_codes, 0)
+    else:
+        # Too many combinations for one mixed-radix number: rank the distinct key tuples instead
+        _, combined = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        combined = combined.reshape(-1).astype(np.int64)
+    combined[~valid] = -1
+    return combined[:src.num_rows], combined[src.num_rows:]
+
+
+def keys_sorted(keys: np.ndarray) -> bool:
+    """Whether a side is already in key order with no null keys, so it can be merged without sorting."""
+    return bool(np.all(keys >= 0) and np.all(keys[1:] >= keys[:-1]))
+
+
+def _key_order(keys: np.ndarray, presorted: bool) -> np.ndarray:
+    rows = np.flatnonzero(keys >= 0)
+    return rows if presorted else rows[np.argsort(keys[rows], kind="stable")]
+
+
+def _occurrence_rank(sorted_keys: np.ndarray) -> np.ndarray:
+    """Position of every row within its run of equal keys."""
+    positions = np.arange(len(sorted_keys))
+    starts = np.ones(len(sorted_keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    return positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+
+def pair_keys(src_keys: np.ndarray, tgt_keys: np.ndarray, presorted: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """SRC and TGT row positions of the matched pairs.
+
+    The n-th SRC row of a key pairs with the n-th TGT row of that key, so
+    duplicates on one side that the other cannot pair stay unmatched; null
+    keys never match. Both sides are sorted by key (unless ``presorted``)
+    and merged with ``searchsorted``.
+    """
+    src_order, tgt_order = _key_order(src_keys, presorted), _key_order(tgt_keys, presorted)
+    src_sorted, tgt_sorted = src_keys[src_order], tgt_keys[tgt_order]
+    rank = _occurrence_rank(src_sorted)
+    first = np.searchsorted(tgt_sorted, src_sorted, "left")
+    count = np.searchsorted(tgt_sorted, src_sorted, "right") - first
+    hit = rank < count
+    return src_order[hit], tgt_order[first[hit] + rank[hit]]
+
+
+def _rename(chunk: Chunk, names: Dict[str, str]) -> Chunk:
+    return Chunk({names[name]: values for name, values in chunk.columns.items() if name in names}, chunk.row_offset,
+                 {names[name]: mask for name, mask in chunk.nulls.items() if name in names},
+                 {names[name]: mask for name, mask in chunk.invalid.items() if name in names})
+
+
+def join_chunks(src: Chunk, tgt: Chunk, src_keys: np.ndarray, tgt_keys: np.ndarray, layout: CombineLayout,
+                presorted: bool = False) -> Dict[str, Chunk]:
+    """Full outer join of two chunks on their key codes, split into the three row sets."""
+    src_rows, tgt_rows = pair_keys(src_keys, tgt_keys, presorted)
+    src_unmatched = np.ones(src.num_rows, dtype=bool)
+    src_unmatched[src_rows] = False
+    tgt_unmatched = np.ones(tgt.num_rows, dtype=bool)
+    tgt_unmatched[tgt_rows] = False
+    return {"matched": layout.matched_chunk(src.take(src_rows), tgt.take(tgt_rows), "key"), "src_only": _rename(src.take(src_unmatched), layout.src_names),
+            "tgt_only": _rename(tgt.take(tgt_unmatched), layout.tgt_names)}
+
+
+def _write_row_sets(parts: Dict[str, Chunk], output_paths: Dict[str, str]) -> Dict[str, int]:
+    counts = {}
+    for name, chunk in parts.items():
+        if chunk.num_rows:
+            write_chunk_file(output_paths[name], chunk)
+        counts[name] = chunk.num_rows
+    return counts
+
+
+def _partition_file(work_dir: str, side: str, partition: int, index: int) -> str:
+    return os.path.join(work_dir, side, f"part_{partition:05d}_{index:06d}.npz")
+
+
+def _write_partitions(chunk: Chunk, partitions: np.ndarray, num_partitions: int, path_of,
+                      keys: Optional[np.ndarray] = None) -> List[int]:
+    """Write the rows of every non-empty partition to ``path_of(partition)``; returns the partitions written."""
+    order = np.argsort(partitions, kind="stable")
+    bounds = np.searchsorted(partitions[order], np.arange(num_partitions + 1))
+    written = []
+    for partition in range(num_partitions):
+        rows = order[bounds[partition]:bounds[partition + 1]]
+        if len(rows) == 0:
+            continue
+        part = chunk.take(rows)
+        if keys is not None:
+            part.columns[KEY_COLUMN] = keys[rows]
+        write_chunk_file(path_of(partition), part)
+        written.append(partition)
+    return written
+
+
+def scatter_chunk_file(path: str, row_offset: int, keys: np.ndarray, num_partitions: int, work_dir: str, side: str,
+                       index: int) -> List[int]:
+    """Pool entry point: split one chunk file into partition files by key; returns the partitions written.
+
+    Key codes are dense ranks of the key values, so taking them modulo the
+    partition count spreads keys evenly and sends equal keys of both sides
+    to the same partition.
+    """
+    chunk = read_chunk_file(path, row_offset)
+    return _write_partitions(chunk, keys % num_partitions, num_partitions,
+                             lambda partition: _partition_file(work_dir, side, partition, index), keys)
+
+
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser: spreads every input bit over the whole 64-bit hash."""
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def value_hashes(values) -> np.ndarray:
+    """64-bit hash of every value that depends only on the value, never on the chunk or array it came from."""
+    if isinstance(values, DictionaryArray):
+        return value_hashes(values.dictionary)[values.codes]
+    values = np.asarray(values)
+    if values.dtype.kind == "U":
+        points = np.ascontiguousarray(values).view(np.uint32).reshape(len(values), -1).astype(np.uint64)
+        hashes = np.zeros(len(values), dtype=np.uint64)
+        for column in points.T:
+            # Padding code points are zero, so the hash does not depend on the array's string width
+            hashes = np.where(column != 0, _mix(hashes * _HASH_MULTIPLIER + column), hashes)
+        return hashes
+    if values.dtype.kind == "M":
+        bits = values.astype("datetime64[D]").view(np.int64)
+    elif values.dtype.kind == "f":
+        # Adding zero turns -0.0 into 0.0
+        bits = (values.astype(np.float64) + 0.0).view(np.int64)
+    else:
+        bits = values.astype(np.int64)
+    return _mix(bits.view(np.uint64))
+
+
+def key_hashes(chunk: Chunk, keys: List[str], seed: int = 0) -> np.ndarray:
+    """64-bit hash of every row's key values; equal keys hash equally on both sides and in every chunk."""
+    hashes = np.full(chunk.num_rows, seed, dtype=np.uint64)
+    for name in keys:
+        hashes = _mix(hashes * _HASH_MULTIPLIER + value_hashes(chunk.columns[name]))
+    return hashes
+
+
+def hash_partitions(chunk: Chunk, keys: List[str], num_partitions: int, seed: int = 0) -> np.ndarray:
+    """Partition of every row from a hash of its key values; a different ``seed`` gives an independent split."""
+    return (key_hashes(chunk, keys, seed) % np.uint64(num_partitions)).astype(np.int64)
+
+
+def spill_chunk_file(path: str, row_offset: int, keys: List[str], num_partitions: int, work_dir: str, side: str,
+                     index: int) -> List[int]:
+    """Pool entry point: split one chunk file into grace-hash partition files; returns the partitions written.
+
+    Unlike ``scatter_chunk_file`` this needs no key codes computed over the
+    whole dataset, so nothing but the chunk itself is held in memory.
+    """
+    chunk = read_chunk_file(path, row_offset)
+    return _write_partitions(chunk, hash_partitions(chunk, keys, num_partitions), num_partitions,
+                             lambda partition: _partition_file(work_dir, side, partition, index))
+
+
+def join_spilled_partition(src_files: List[str], tgt_files: List[str], layout: CombineLayout, output_path: str,
+                           name: str, budget_bytes: int, depth: int, work_dir: str) -> Dict[str, List[Tuple[str, int]]]:
+    """Pool entry point: join one grace-hash partition; returns the chunk files written per row set.
+
+    A partition that would still not fit ``budget_bytes`` is split again
+    with a fresh hash seed, up to ``COMBINE_MAX_SPILL_DEPTH`` times. A split
+    that cannot spread the rows (one very frequent key) is joined as is.
+    """
+    size = sum(os.path.getsize(path) for path in src_files + tgt_files)
+    if size * COMBINE_MEMORY_FACTOR > budget_bytes and depth < COMBINE_MAX_SPILL_DEPTH:
+        num_partitions = max(2, math.ceil(size * COMBINE_MEMORY_FACTOR / budget_bytes))
+        split_dir = os.path.join(work_dir, f"split_{name}")
+        sides = []
+        for side, files in (("src", src_files), ("tgt", tgt_files)):
+            os.makedirs(os.path.join(split_dir, side), exist_ok=True)
+            parts: List[List[str]] = [[] for _ in range(num_partitions)]
+            for index, path in enumerate(files):
+                chunk = read_chunk_file(path)
+                for partition in _write_partitions(chunk, hash_partitions(chunk, layout.keys, num_partitions, depth + 1),
+                                                   num_partitions,
+                                                   lambda partition: _partition_file(split_dir, side, partition, index)):
+                    parts[partition].append(_partition_file(split_dir, side, partition, index))
+                os.remove(path)
+            sides.append(parts)
+        non_empty = [partition for partition in range(num_partitions) if sides[0][partition] or sides[1][partition]]
+        next_depth = depth + 1 if len(non_empty) > 1 else COMBINE_MAX_SPILL_DEPTH
+        files: Dict[str, List[Tuple[str, int]]] = {row_set: [] for row_set in ROW_SETS}
+        for partition in non_empty:
+            written = join_spilled_partition(sides[0][partition], sides[1][partition], layout, output_path,
+                                             f"{name}_{partition:03d}", budget_bytes, next_depth, split_dir)
+            for row_set, entries in written.items():
+                files[row_set].extend(entries)
+        shutil.rmtree(split_dir, ignore_errors=True)
+        return files
+    if size * COMBINE_MEMORY_FACTOR > budget_bytes:
+        logger.warning(f"⚠️ Combine partition {name} needs about {size * COMBINE_MEMORY_FACTOR / 2 ** 20:.0f} MB, "
+                       f"over the {budget_bytes / 2 ** 20:.0f} MB budget, and is joined without further splits")
+    src = concat_chunks([read_chunk_file(path) for path in src_files]) if src_files else empty_chunk(layout.src_schema)
+    tgt = concat_chunks([read_chunk_file(path) for path in tgt_files]) if tgt_files else empty_chunk(layout.tgt_schema)
+    src_keys, tgt_keys = join_key_codes(src, tgt, layout.keys)
+    file_name = f"chunk_{name}.npz"
+    counts = _write_row_sets(join_chunks(src, tgt, src_keys, tgt_keys, layout),
+                             {row_set: os.path.join(output_path, row_set, file_name) for row_set in ROW_SETS})
+    return {row_set: [(file_name, num_rows)] for row_set, num_rows in counts.items() if num_rows}
+
+
+def dataset_keys_sorted(dataset: Dataset, keys: List[str]) -> bool:
+    """Whether a dataset is in key order with no null keys, reading one chunk of key columns at a time."""
+    previous = None
+    for chunk in dataset.iter_chunks(keys):
+        if chunk.num_rows == 0:
+            continue
+        window = chunk if previous is None else concat_chunks([previous, chunk])
+        codes, _ = join_key_codes(window, window.head(0), keys)
+        if not keys_sorted(codes):
+            return False
+        previous = chunk.take(slice(chunk.num_rows - 1, None))
+    return True
+
+
+def merge_sorted_datasets(src: Dataset, tgt: Dataset, layout: CombineLayout, writers: Dict[str, DatasetWriter]) -> None:
+    """Stream-merge two key-sorted datasets, holding about one chunk of each side in memory.
+
+    Rows with keys below the smaller of the two sides' last buffered keys
+    can no longer meet a partner in a later chunk, so they are joined and
+    written; the rest is carried over while the limiting side reads on.
+    """
+    streams: List[Iterator[Chunk]] = [src.iter_chunks(), tgt.iter_chunks()]
+    buffers = [empty_chunk(src.schema), empty_chunk(tgt.schema)]
+    done = [False, False]
+    pull = [True, True]
+
+    def fetch(side: int) -> None:
+        chunk = next(streams[side], None)
+        if chunk is None:
+            done[side] = True
+        else:
+            buffers[side] = concat_chunks([buffers[side], chunk]) if buffers[side].num_rows else chunk
+
+    while True:
+        for side in (0, 1):
+            if pull[side] and not done[side]:
+                fetch(side)
+            while buffers[side].num_rows == 0 and not done[side]:
+                fetch(side)
+        src_codes, tgt_codes = join_key_codes(buffers[0], buffers[1], layout.keys)
+        open_sides = [side for side in (0, 1) if not done[side]]
+        if not open_sides:
+            parts = join_chunks(buffers[0], buffers[1], src_codes, tgt_codes, layout, presorted=True)
+            for row_set, chunk in parts.items():
+                writers[row_set].write(chunk)
+            return
+        codes = (src_codes, tgt_codes)
+        boundary = min(codes[side][-1] for side in open_sides)
+        src_cut = int(np.searchsorted(src_codes, boundary, "left"))
+        tgt_cut = int(np.searchsorted(tgt_codes, boundary, "left"))
+        parts = join_chunks(buffers[0].head(src_cut), buffers[1].head(tgt_cut), src_codes[:src_cut], tgt_codes[:tgt_cut],
+                            layout, presorted=True)
+        for row_set, chunk in parts.items():
+            writers[row_set].write(chunk)
+        buffers = [buffers[0].take(slice(src_cut, None)), buffers[1].take(slice(tgt_cut, None))]
+        pull = [side in open_sides and codes[side][-1] == boundary for side in (0, 1)]
+
+
+def _null_key_rows(dataset: Dataset, keys: List[str]) -> int:
+    count = 0
+    for chunk in dataset.iter_chunks(keys):
+        missing = np.zeros(chunk.num_rows, dtype=bool)
+        for name in keys:
+            missing |= chunk.null_mask(name)
+        count += int(np.count_nonzero(missing))
+    return count
+
+
+def _read_partition(files: List[str], schema: Dict[str, str]) -> Tuple[Chunk, np.ndarray]:
+    chunk = concat_chunks([read_chunk_file(path) for path in files]) if files else empty_chunk(schema)
+    keys = chunk.columns.pop(KEY_COLUMN, np.zeros(0, dtype=np.int64))
+    return chunk, keys
+
+
+def join_partition_files(src_files: List[str], tgt_files: List[str], layout: CombineLayout,
+                         output_paths: Dict[str, str]) -> Dict[str, int]:
+    """Pool entry point: join the SRC and TGT files of one hash partition; returns rows per row set."""
+    src, src_keys = _read_partition(src_files, layout.src_schema)
+    tgt, tgt_keys = _read_partition(tgt_files, layout.tgt_schema)
+    return _write_row_sets(join_chunks(src, tgt, src_keys, tgt_keys, layout), output_paths)
+
+
+def join_row_ranges(src: Dataset, src_range: Tuple[int, int], src_keys: np.ndarray, tgt: Dataset,
+                    tgt_range: Tuple[int, int], tgt_keys: np.ndarray, layout: CombineLayout,
+                    output_paths: Dict[str, str]) -> Dict[str, int]:
+    """Pool entry point: merge one key range of two key-sorted datasets; returns rows per row set."""
+    src_chunk = src.read_rows(*src_range)
+    tgt_chunk = tgt.read_rows(*tgt_range)
+    return _write_row_sets(join_chunks(src_chunk, tgt_chunk, src_keys, tgt_keys, layout, presorted=True), output_paths)
+
+
+def _key_ranges(src_keys: np.ndarray, tgt_keys: np.ndarray, num_ranges: int) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """Row ranges of both sorted sides cut at shared key boundaries, so no key spans two ranges."""
+    samples = [keys[np.linspace(0, len(keys) - 1, num_ranges + 1)[1:-1].astype(np.int64)]
+               for keys in (src_keys, tgt_keys) if len(keys)]
+    bounds = np.unique(np.concatenate(samples)) if samples else np.zeros(0, dtype=np.int64)
+    src_cuts = [0, *np.searchsorted(src_keys, bounds, "left").tolist(), len(src_keys)]
+    tgt_cuts = [0, *np.searchsorted(tgt_keys, bounds, "left").tolist(), len(tgt_keys)]
+    return [((src_cuts[i], src_cuts[i + 1]), (tgt_cuts[i], tgt_cuts[i + 1])) for i in range(len(src_cuts) - 1)
+            if src_cuts[i + 1] > src_cuts[i] or tgt_cuts[i + 1] > tgt_cuts[i]]
+
+
+def combine_datasets(src: Dataset, tgt: Dataset, spec: CombineSpec, keys: List[str], output_path: str,
+                     max_workers: int = WORKER_PROCESSES) -> Tuple[Dict[str, Dataset], Dict[str, Any]]:
+    """Reconcile ``src`` with ``tgt`` on ``keys`` into matched, src-only and tgt-only datasets.
+
+    Key-sorted inputs are merged by key range without sorting; otherwise
+    both sides are hash-partitioned by key and the partitions are joined in
+    parallel. Small inputs are joined in-process. Inputs too large for the
+    memory budget are joined out of core: sorted inputs by a streaming
+    merge, others by a grace hash join over partition files. The rows left
+    unmatched are then paired by ``spec.match_rules``, if any. Returns the
+    datasets under ``output_path/<row set>`` and join statistics.
+    """
+    started = time.perf_counter()
+    if not keys:
+        raise ValueError("combine needs join keys; set the control's keys or combine.keys")
+    layout = CombineLayout(keys, src.schema, tgt.schema, spec)
+    writers = {name: DatasetWriter(os.path.join(output_path, name), layout.schemas[name]) for name in ROW_SETS}
+    budget_bytes = (spec.memory_budget_mb or COMBINE_MEMORY_BUDGET_MB) * 1024 * 1024
+    required_bytes = (src.file_bytes + tgt.file_bytes) * COMBINE_MEMORY_FACTOR
+    spilled = required_bytes > budget_bytes
+
+    if spilled:
+        # Not even the key columns of both sides are loaded whole
+        null_key_rows = _null_key_rows(src, keys) + _null_key_rows(tgt, keys)
+        if dataset_keys_sorted(src, keys) and dataset_keys_sorted(tgt, keys):
+            strategy, num_partitions = "streaming_merge", 1
+            merge_sorted_datasets(src, tgt, layout, writers)
+        else:
+            strategy = "grace_hash"
+            num_partitions = max(COMBINE_PARTITIONS, math.ceil(required_bytes / budget_bytes))
+            work_dir = os.path.join(output_path, "_spill")
+            try:
+                partition_files = _scatter(src, None, tgt, None, num_partitions, work_dir, keys)
+                pool = get_process_pool()
+                futures = []
+                for partition, (src_files, tgt_files) in enumerate(partition_files):
+                    if src_files or tgt_files:
+                        futures.append(pool.submit(join_spilled_partition, src_files, tgt_files, layout, output_path,
+                                                   f"{partition:06d}", budget_bytes, 0, work_dir))
+                for future in futures:
+                    for row_set, entries in future.result().items():
+                        for file_name, num_rows in entries:
+                            writers[row_set].add_chunk_file(file_name, num_rows)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        src_keys, tgt_keys = join_key_codes(src.read_all(keys), tgt.read_all(keys), keys)
+        null_key_rows = int(np.count_nonzero(src_keys < 0) + np.count_nonzero(tgt_keys < 0))
+        presorted = keys_sorted(src_keys) and keys_sorted(tgt_keys)
+        parallel = max_workers > 1 and src.num_rows + tgt.num_rows >= COMBINE_PARALLEL_MIN_ROWS
+        if not parallel:
+            strategy, num_partitions = ("sort_merge" if presorted else "hash"), 1
+            parts = join_chunks(src.read_all(), tgt.read_all(), src_keys, tgt_keys, layout, presorted)
+            for name, chunk in parts.items():
+                writers[name].write(chunk)
+        elif presorted:
+            strategy = "sort_merge"
+            pool = get_process_pool()
+            ranges = _key_ranges(src_keys, tgt_keys, COMBINE_PARTITIONS)
+            num_partitions = len(ranges)
+            futures = []
+            for index, ((src_start, src_stop), (tgt_start, tgt_stop)) in enumerate(ranges):
+                paths = {name: os.path.join(output_path, name, f"chunk_{index:06d}.npz") for name in ROW_SETS}
+                futures.append((index, pool.submit(join_row_ranges, src, (src_start, src_stop),
+                                                   src_keys[src_start:src_stop], tgt, (tgt_start, tgt_stop),
+                                                   tgt_keys[tgt_start:tgt_stop], layout, paths)))
+            _collect(futures, writers)
+        else:
+            strategy, num_partitions = "hash", COMBINE_PARTITIONS
+            work_dir = os.path.join(output_path, "_partitions")
+            try:
+                partition_files = _scatter(src, src_keys, tgt, tgt_keys, num_partitions, work_dir)
+                pool = get_process_pool()
+                futures = []
+                for partition, (src_files, tgt_files) in enumerate(partition_files):
+                    if not src_files and not tgt_files:
+                        continue
+                    paths = {name: os.path.join(output_path, name, f"chunk_{partition:06d}.npz") for name in ROW_SETS}
+                    futures.append((partition, pool.submit(join_partition_files, src_files, tgt_files, layout, paths)))
+                _collect(futures, writers)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    metadata = {"src": src.path, "tgt": tgt.path, "keys": keys}
+    match_stats = _match_residues(writers, layout, output_path, metadata) if spec.match_rules else {}
+    datasets = {name: writer.close({**metadata, "row_set": name}) for name, writer in writers.items()}
+    stats = {"strategy": strategy, "partitions": num_partitions, "spilled": spilled,
+             "memory_budget_mb": budget_bytes // (1024 * 1024), "src_rows": src.num_rows, "tgt_rows": tgt.num_rows,
+             **{f"{name}_rows": dataset.num_rows for name, dataset in datasets.items()}, "null_key_rows": null_key_rows,
+             "match_rules": match_stats}
+    logger.info(f"🤝 Combined {src.num_rows} src and {tgt.num_rows} tgt rows ({strategy}, {num_partitions} partitions): "
+                f"{stats['matched_rows']} matched, {stats['src_only_rows']} src only, {stats['tgt_only_rows']} tgt only "
+                f"in {(time.perf_counter() - started):.2f} s")
+    return datasets, stats
+
+
+def _match_residues(writers: Dict[str, DatasetWriter], layout: CombineLayout, output_path: str,
+                    metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Pair the src-only and tgt-only rows of the key join by the match rules; returns per-rule statistics.
+
+    The residues are moved aside, read whole (they are expected to be a
+    small fraction of the inputs) and rewritten without the rows a rule
+    paired; the pairs are appended to ``matched``.
+    """
+    residue_path = os.path.join(output_path, "_residue")
+    os.makedirs(residue_path, exist_ok=True)
+    try:
+        residues = {}
+        for name in ("src_only", "tgt_only"):
+            writers[name].close(metadata)
+            os.replace(os.path.join(output_path, name), os.path.join(residue_path, name))
+            residues[name] = Dataset.open(os.path.join(residue_path, name)).read_all()
+        columns = sorted({field.column for rule in layout.match_rules for field in rule.fields})
+        src = _rename(residues["src_only"], {layout.src_names[name]: name for name in columns})
+        tgt = _rename(residues["tgt_only"], {layout.tgt_names[name]: name for name in columns})
+        matches, stats = match_residues(src, tgt, layout.match_rules)
+        src_left = np.ones(src.num_rows, dtype=bool)
+        tgt_left = np.ones(tgt.num_rows, dtype=bool)
+        inputs = {"src": {name: original for original, name in layout.src_names.items()},
+                  "tgt": {name: original for original, name in layout.tgt_names.items()}}
+        for index, (rule, src_rows, tgt_rows) in enumerate(matches):
+            if not len(src_rows):
+                continue
+            src_left[src_rows] = False
+            tgt_left[tgt_rows] = False
+            chunk = layout.matched_chunk(_rename(residues["src_only"].take(src_rows), inputs["src"]),
+                                         _rename(residues["tgt_only"].take(tgt_rows), inputs["tgt"]), rule)
+            file_name = f"match_{index:06d}.npz"
+            write_chunk_file(os.path.join(output_path, "matched", file_name), chunk)
+            writers["matched"].add_chunk_file(file_name, chunk.num_rows)
+        for name, left in (("src_only", src_left), ("tgt_only", tgt_left)):
+            writers[name] = DatasetWriter(os.path.join(output_path, name), layout.schemas[name])
+            writers[name].write(residues[name].take(left))
+        return stats
+    finally:
+        shutil.rmtree(residue_path, ignore_errors=True)
+
+
+def _scatter(src: Dataset, src_keys: Optional[np.ndarray], tgt: Dataset, tgt_keys: Optional[np.ndarray],
+             num_partitions: int, work_dir: str, keys: Optional[List[str]] = None) -> List[Tuple[List[str], List[str]]]:
+    """Partition every chunk of both sides across the pool; returns the SRC and TGT files of each partition.
+
+    Rows are partitioned by their key codes when given, otherwise by a hash
+    of the ``keys`` values computed chunk by chunk.
+    """
+    pool = get_process_pool()
+    futures = []
+    for side, dataset, codes in (("src", src, src_keys), ("tgt", tgt, tgt_keys)):
+        os.makedirs(os.path.join(work_dir, side), exist_ok=True)
+        for index, entry in enumerate(dataset.chunks):
+            path = os.path.join(dataset.path, entry["file"])
+            start, stop = entry["row_offset"], entry["row_offset"] + entry["rows"]
+            if codes is None:
+                future = pool.submit(spill_chunk_file, path, start, keys, num_partitions, work_dir, side, index)
+            else:
+                future = pool.submit(scatter_chunk_file, path, start, codes[start:stop], num_partitions, work_dir, side,
+                                     index)
+            futures.append((side, index, future))
+    partition_files: List[Tuple[List[str], List[str]]] = [([], []) for _ in range(num_partitions)]
+    for side, index, future in futures:
+        for partition in future.result():
+            partition_files[partition][0 if side == "src" else 1].append(_partition_file(work_dir, side, partition, index))
+    return partition_files
+
+
+def _collect(futures: List[Tuple[int, Any]], writers: Dict[str, DatasetWriter]) -> None:
+    for index, future in futures:
+        for name, num_rows in future.result().items():
+            if num_rows:
+                writers[name].add_chunk_file(f"chunk_{index:06d}.npz", num_rows)
@@ -0,0 +1,182 @@
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from columnar import Dataset
+from combine import _mix, key_hashes
+
+logger = logging.getLogger(__name__)
+
+# Written next to a dataset's manifest by the stage that produced it
+KEY_SET_FILE = "key_set.npz"
+# Bloom filter size per distinct key; 10 bits with 7 probes gives about 1% false positives
+COMPLETENESS_BLOOM_BITS = int(os.environ.get("COMPLETENESS_BLOOM_BITS", "10"))
+# Missing keys listed per side in a completeness result
+COMPLETENESS_SAMPLE_KEYS = int(os.environ.get("COMPLETENESS_SAMPLE_KEYS", "100"))
+
+_SECOND_HASH_SEED = np.uint64(0x632BE59BD9B4E019)
+
+
+class KeySet:
+    """The distinct business keys of one side as sorted 64-bit hashes, with a Bloom filter over them.
+
+    Rows with a null key part are only counted; they never match, as in
+    the combine. ``counts`` holds the number of rows of every hash.
+    """
+
+    def __init__(self, keys: List[str], hashes: np.ndarray, counts: np.ndarray, null_rows: int,
+                 bloom: Optional[np.ndarray] = None):
+        self.keys = keys
+        self.hashes = hashes
+        self.counts = counts
+        self.null_rows = null_rows
+        self.bloom = bloom if bloom is not None else self._build_bloom(hashes)
+
+    @classmethod
+    def build(cls, dataset: Dataset, keys: List[str]) -> "KeySet":
+        """Hash the key columns chunk by chunk; only the distinct hashes of each chunk are kept."""
+        parts, part_counts, null_rows = [], [], 0
+        for chunk in dataset.iter_chunks(keys):
+            valid = np.ones(chunk.num_rows, dtype=bool)
+            for name in keys:
+                valid &= ~chunk.null_mask(name)
+            null_rows += int(chunk.num_rows - np.count_nonzero(valid))
+            hashes, counts = np.unique(key_hashes(chunk.take(valid), keys), return_counts=True)
+            parts.append(hashes)
+            part_counts.append(counts)
+        if not parts:
+            return cls(keys, np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64), null_rows)
+        hashes, inverse = np.unique(np.concatenate(parts), return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=np.concatenate(part_counts), minlength=len(hashes))
+        return cls(keys, hashes, counts.astype(np.int64), null_rows)
+
+    @classmethod
+    def load(cls, path: str) -> "KeySet":
+        with np.load(path) as data:
+            return cls(data["keys"].tolist(), data["hashes"], data["counts"], int(data["null_rows"]), data["bloom"])
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, keys=np.array(self.keys), hashes=self.hashes, counts=self.counts,
+                 null_rows=np.int64(self.null_rows), bloom=self.bloom)
+        os.replace(tmp_path, path)
+
+    @property
+    def num_rows(self) -> int:
+        return int(self.counts.sum()) + self.null_rows
+
+    @staticmethod
+    def _probes(hashes: np.ndarray, num_bits: int) -> List[np.ndarray]:
+        """Bit positions of every hash: double hashing with ``_num_probes`` probes over a power-of-two table."""
+        second = _second_hash(hashes)
+        mask = np.uint64(num_bits - 1)
+        return [(hashes + np.uint64(probe) * second) & mask for probe in range(_num_probes())]
+
+    def _build_bloom(self, hashes: np.ndarray) -> np.ndarray:
+        num_bits = 1 << max(6, math.ceil(math.log2(max(len(hashes), 1) * COMPLETENESS_BLOOM_BITS)))
+        bloom = np.zeros(num_bits // 64, dtype=np.uint64)
+        for bits in self._probes(hashes, num_bits):
+            np.bitwise_or.at(bloom, (bits >> np.uint64(6)).astype(np.int64), np.uint64(1) << (bits & np.uint64(63)))
+        return bloom
+
+    def might_contain(self, hashes: np.ndarray) -> np.ndarray:
+        """False for hashes certainly not in the set; true ones still need ``contains``."""
+        result = np.ones(len(hashes), dtype=bool)
+        for bits in self._probes(hashes, len(self.bloom) * 64):
+            words = self.bloom[(bits >> np.uint64(6)).astype(np.int64)]
+            result &= (words >> (bits & np.uint64(63))) & np.uint64(1) != 0
+        return result
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Exact membership: the Bloom filter rejects most absent hashes, a binary search settles the rest."""
+        result = self.might_contain(hashes)
+        candidates = np.flatnonzero(result)
+        positions = np.minimum(np.searchsorted(self.hashes, hashes[candidates]), max(len(self.hashes) - 1, 0))
+        result[candidates] = self.hashes[positions] == hashes[candidates] if len(self.hashes) else False
+        return result
+
+
+def _num_probes() -> int:
+    return max(1, round(COMPLETENESS_BLOOM_BITS * math.log(2)))
+
+
+def _second_hash(hashes: np.ndarray) -> np.ndarray:
+    return _mix(hashes ^ _SECOND_HASH_SEED) | np.uint64(1)
+
+
+def write_key_set(dataset: Dataset, keys: List[str]) -> KeySet:
+    """Build the key set of a dataset a stage just wrote and store it next to the manifest."""
+    key_set = KeySet.build(dataset, keys)
+    key_set.save(os.path.join(dataset.path, KEY_SET_FILE))
+    return key_set
+
+
+def open_key_set(dataset: Dataset, keys: List[str]) -> KeySet:
+    """The stored key set of a dataset, or a freshly built one when it is missing or for other keys."""
+    path = os.path.join(dataset.path, KEY_SET_FILE)
+    if os.path.exists(path):
+        key_set = KeySet.load(path)
+        if key_set.keys == keys:
+            return key_set
+    return write_key_set(dataset, keys)
+
+
+def _missing_key_values(dataset: Dataset, keys: List[str], missing: np.ndarray, limit: int) -> List[List[Any]]:
+    """Key values of up to ``limit`` of the ``missing`` hashes, reading chunks only until enough are found."""
+    found: Dict[int, List[Any]] = {}
+    if not len(missing):
+        return []
+    for chunk in dataset.iter_chunks(keys):
+        if len(found) >= limit:
+            break
+        hashes = key_hashes(chunk, keys)
+        positions = np.minimum(np.searchsorted(missing, hashes), len(missing) - 1)
+        hit = missing[positions] == hashes
+        for name in keys:
+            hit &= ~chunk.null_mask(name)
+        hit = np.flatnonzero(hit)
+        rows = chunk.select(keys).take(hit).to_rows()
+        for key_hash, row in zip(hashes[hit].tolist(), rows):
+            if key_hash not in found and len(found) < limit:
+                found[key_hash] = row
+    return list(found.values())
+
+
+def check_completeness(src: Dataset, tgt: Dataset, keys: List[str],
+                       sample: int = COMPLETENESS_SAMPLE_KEYS) -> Dict[str, Any]:
+    """Which SRC keys are missing from TGT and which TGT keys from SRC, without joining the datasets.
+
+    Works on the key sets stored by the transform stage (built here when
+    absent): each side's distinct key hashes are probed against the other
+    side's Bloom filter and the survivors confirmed against its sorted
+    hashes. Listed keys are certainly missing; a missing key could only go
+    unreported by a 64-bit hash collision. Null keys are counted apart.
+    """
+    started = time.perf_counter()
+    for side, dataset in (("src", src), ("tgt", tgt)):
+        missing = [key for key in keys if key not in dataset.schema]
+        if missing:
+            raise ValueError(f"completeness keys {missing} are not in the {side} dataset")
+    mismatched = [key for key in keys if src.schema[key] != tgt.schema[key]]
+    if mismatched:
+        raise ValueError(f"completeness keys {mismatched} have different types in the src and tgt datasets")
+    sets = {"src": open_key_set(src, keys), "tgt": open_key_set(tgt, keys)}
+    datasets = {"src": src, "tgt": tgt}
+    result: Dict[str, Any] = {"keys": keys}
+    for side, other in (("src", "tgt"), ("tgt", "src")):
+        key_set = sets[side]
+        absent = ~sets[other].contains(key_set.hashes)
+        result[f"{side}_keys"] = len(key_set.hashes)
+        result[f"{side}_missing_keys"] = int(np.count_nonzero(absent))
+        result[f"{side}_missing_rows"] = int(key_set.counts[absent].sum())
+        result[f"{side}_null_key_rows"] = key_set.null_rows
+        result[f"{side}_missing_sample"] = _missing_key_values(datasets[side], keys, key_set.hashes[absent], sample)
+    result["complete"] = result["src_missing_keys"] == 0 and result["tgt_missing_keys"] == 0
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"🔎 Completeness on {', '.join(keys)}: {result['src_missing_keys']} SRC keys missing from TGT, "
+                f"{result['tgt_missing_keys']} TGT keys missing from SRC in {result['seconds']:.2f} s")
+    return result
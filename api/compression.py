@@ -0,0 +1,259 @@
+import bz2
+import gzip
+import io
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # .zst extracts need the optional zstandard package
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DECOMPRESS_WORKERS = int(os.environ.get("DECOMPRESS_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Below this size a file is decompressed on a single stream even if it has several members
+PARALLEL_DECOMPRESS_MIN_BYTES = int(os.environ.get("PARALLEL_DECOMPRESS_MIN_BYTES", str(16 * 1024 * 1024)))
+
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_BZ2_MAGIC = b"BZh"
+_FEED_BYTES = 1024 * 1024
+# Speculative member decompression gives up beyond this much output and the member is streamed instead
+MAX_MEMBER_BYTES = int(os.environ.get("DECOMPRESS_MAX_MEMBER_BYTES", str(32 * 1024 * 1024)))
+_TOO_LARGE = "too_large"
+
+
+def detect_compression(path: str) -> Optional[str]:
+    """Return ``gzip``, ``zstd``, ``bz2`` or None, from the file's magic bytes."""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(_GZIP_MAGIC[:2]):
+        return "gzip"
+    if magic == _ZSTD_MAGIC:
+        return "zstd"
+    if magic.startswith(_BZ2_MAGIC):
+        return "bz2"
+    return None
+
+
+class BlockStream(io.RawIOBase):
+    """Read-only raw stream over an iterator of byte blocks."""
+
+    def __init__(self, blocks: Iterator[bytes], on_close: Optional[Callable[[], None]] = None):
+        self._blocks = blocks
+        self._current = memoryview(b"")
+        self._on_close = on_close
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._current:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._current = memoryview(block)
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed and self._on_close is not None:
+            self._on_close()
+        super().close()
+
+
+def _decompress_gzip_member(mm, start: int):
+    """Decompress the gzip member at ``start``.
+
+    Returns (end offset, data), None if no valid member starts there, or
+    ``_TOO_LARGE`` when the member would not fit the speculative output cap.
+    """
+    decompressor = zlib.decompressobj(wbits=31)
+    output = []
+    produced = 0
+    position = start
+    try:
+        while not decompressor.eof and position < len(mm):
+            piece = mm[position:position + _FEED_BYTES]
+            position += len(piece)
+            output.append(decompressor.decompress(piece))
+            produced += len(output[-1])
+            if produced > MAX_MEMBER_BYTES and not decompressor.eof:
+                return _TOO_LARGE
+    except zlib.error:
+        return None
+    if not decompressor.eof:
+        return None
+    return position - len(decompressor.unused_data), b"".join(output)
+
+
+def _stream_gzip_member(mm, start: int, on_end: Callable[[int], None]) -> Iterator[bytes]:
+    """Decompress one member sequentially, piece by piece, reporting its end offset."""
+    decompressor = zlib.decompressobj(wbits=31)
+    position = start
+    while not decompressor.eof:
+        if position >= len(mm):
+            raise OSError(f"Truncated gzip member at offset {start}")
+        piece = mm[position:position + _FEED_BYTES]
+        position += len(piece)
+        data = decompressor.decompress(piece)
+        if data:
+            yield data
+    on_end(position - len(decompressor.unused_data))
+
+
+def _gzip_candidates(mm) -> List[int]:
+    """Offsets that look like the start of a gzip member (magic plus sane flags)."""
+    candidates = []
+    position = mm.find(_GZIP_MAGIC)
+    while position >= 0:
+        if position + 3 < len(mm) and mm[position + 3] & 0xE0 == 0:
+            candidates.append(position)
+        position = mm.find(_GZIP_MAGIC, position + 1)
+    return candidates
+
+
+def _iter_gzip_parallel(mm, candidates: List[int], pool: ThreadPoolExecutor, window: int) -> Iterator[bytes]:
+    """Speculatively decompress every candidate member and keep those that chain from offset 0.
+
+    A real member always starts exactly where the previous one ended, so a
+    candidate that merely happens to contain the magic bytes inside compressed
+    data is simply discarded. zlib releases the GIL, so members decompress
+    concurrently; ``window`` bounds how many are held in memory.
+    """
+    expected = 0
+    pending = deque()
+    next_candidate = 0
+    while next_candidate < len(candidates) or pending:
+        while next_candidate < len(candidates) and candidates[next_candidate] < expected:
+            next_candidate += 1
+        while next_candidate < len(candidates) and len(pending) < window:
+            start = candidates[next_candidate]
+            pending.append((start, pool.submit(_decompress_gzip_member, mm, start)))
+            next_candidate += 1
+        start, future = pending.popleft()
+        if start != expected:
+            # Inside a member that was already consumed: a false candidate
+            future.cancel()
+            continue
+        result = future.result()
+        if result is None:
+            continue
+        if result is _TOO_LARGE:
+            ends = []
+            yield from _stream_gzip_member(mm, start, ends.append)
+            expected = ends[0]
+            continue
+        expected, data = result
+        yield data
+    if expected < len(mm) and mm[expected:].strip(b"\0"):
+        raise OSError(f"Trailing data after last gzip member at offset {expected}")
+
+
+def zstd_frame_ranges(mm) -> List[Tuple[int, int]]:
+    """Byte ranges of the zstd frames in ``mm``, found by walking frame and block headers only."""
+    frames = []
+    position = 0
+    size = len(mm)
+    while position < size:
+        magic = struct.unpack_from("<I", mm, position)[0]
+        if 0x184D2A50 <= magic <= 0x184D2A5F:
+            # Skippable frame: magic, 4-byte length, user data
+            position += 8 + struct.unpack_from("<I", mm, position + 4)[0]
+            continue
+        if magic != 0xFD2FB528:
+            raise OSError(f"Invalid zstd frame at offset {position}")
+        start = position
+        descriptor = mm[position + 4]
+        fcs_flag = descriptor >> 6
+        single_segment = (descriptor >> 5) & 1
+        has_checksum = (descriptor >> 2) & 1
+        dict_id_size = (0, 1, 2, 4)[descriptor & 3]
+        fcs_size = (1 if single_segment else 0, 2, 4, 8)[fcs_flag]
+        position += 5 + (0 if single_segment else 1) + dict_id_size + fcs_size
+        while True:
+            header = mm[position] | (mm[position + 1] << 8) | (mm[position + 2] << 16)
+            last_block = header & 1
+            block_type = (header >> 1) & 3
+            block_size = header >> 3
+            position += 3 + (1 if block_type == 1 else block_size)
+            if last_block:
+                break
+        position += 4 if has_checksum else 0
+        frames.append((start, position))
+    return frames
+
+
+def _decompress_zstd_frame(mm, start: int, end: int) -> bytes:
+    return zstandard.ZstdDecompressor().decompressobj().decompress(mm[start:end])
+
+
+def _iter_ordered(pool: ThreadPoolExecutor, calls: List[Tuple], window: int) -> Iterator[bytes]:
+    pending = deque()
+    for call in calls:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(*call))
+    while pending:
+        yield pending.popleft().result()
+
+
+def open_decompressed(path: str, parallel: bool = True, workers: int = DECOMPRESS_WORKERS) -> BinaryIO:
+    """Open ``path`` as a binary stream of its decompressed contents.
+
+    Data is decompressed on the fly, never to a temporary file. Multi-member
+    gzip files and multi-frame zstd files above PARALLEL_DECOMPRESS_MIN_BYTES
+    are decompressed by several threads, in order, with a bounded read-ahead.
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, "rb")
+    if compression == "bz2":
+        return bz2.open(path, "rb")
+    if compression == "zstd" and zstandard is None:
+        raise OSError(f"{path} is zstd-compressed but the zstandard package is not installed")
+
+    size = os.path.getsize(path)
+    if not parallel or workers <= 1 or size < PARALLEL_DECOMPRESS_MIN_BYTES:
+        if compression == "gzip":
+            return gzip.open(path, "rb")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+
+    f = open(path, "rb")
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if compression == "gzip":
+        candidates = _gzip_candidates(mm)
+        parallelizable = len(candidates) > 1
+    else:
+        frames = zstd_frame_ranges(mm)
+        # Each frame is decompressed whole, so very large frames are streamed instead
+        parallelizable = len(frames) > 1 and max(end - start for start, end in frames) <= MAX_MEMBER_BYTES
+    if not parallelizable:
+        mm.close()
+        f.close()
+        return open_decompressed(path, parallel=False)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def close() -> None:
+        pool.shutdown(wait=True, cancel_futures=True)
+        mm.close()
+        f.close()
+
+    window = workers + 2
+    if compression == "gzip":
+        logger.info(f"🗜️ {path}: {len(candidates)} candidate gzip members, decompressing with {workers} threads")
+        blocks = _iter_gzip_parallel(mm, candidates, pool, window)
+    else:
+        logger.info(f"🗜️ {path}: {len(frames)} zstd frames, decompressing with {workers} threads")
+        blocks = _iter_ordered(pool, [(_decompress_zstd_frame, mm, start, end) for start, end in frames], window)
+    return io.BufferedReader(BlockStream(blocks, close), 1024 * 1024)
@@ -0,0 +1,629 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
+
+try:
+    import yaml
+    PARSE_ERRORS: Tuple[type, ...] = (ValueError, TypeError, yaml.YAMLError)
+except ImportError:  # YAML configs are optional
+    yaml = None
+    PARSE_ERRORS = (ValueError, TypeError)
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_COLUMN_TYPES = {"str", "int", "float", "date", "bool"}
+SUPPORTED_FILE_FORMATS = {"csv", "delimited", "fixed_width"}
+
+
+class ConfigError(ValueError):
+    """Raised when control config files cannot be found, parsed or validated."""
+
+
+class StrictModel(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class ColumnSpec(StrictModel):
+    name: str
+    type: str = "str"
+    nullable: bool = True
+    format: Optional[str] = None
+    # Fixed-width layout: byte offset and width of the field within a record
+    start: Optional[int] = None
+    length: Optional[int] = None
+    # Implied decimal places of numeric fields (e.g. 12345 with scale 2 is 123.45)
+    scale: int = 0
+    # Regular expression every non-empty value of a str column must fully match (data-quality check)
+    pattern: Optional[str] = None
+
+    @field_validator("type")
+    @classmethod
+    def check_type(cls, value: str) -> str:
+        if value not in SUPPORTED_COLUMN_TYPES:
+            raise ValueError(f"unsupported column type '{value}', expected one of {sorted(SUPPORTED_COLUMN_TYPES)}")
+        return value
+
+    @model_validator(mode="after")
+    def check_pattern(self) -> "ColumnSpec":
+        if self.pattern is None:
+            return self
+        if self.type != "str":
+            raise ValueError(f"column '{self.name}': pattern is only supported on str columns")
+        try:
+            re.compile(self.pattern)
+        except re.error as e:
+            raise ValueError(f"column '{self.name}': invalid pattern: {e}")
+        return self
+
+
+class SourceSpec(StrictModel):
+    """Where and how one side (SRC or TGT) of a control is read."""
+    file_pattern: str = "*"
+    file_format: str = "csv"
+    delimiter: str = ","
+    has_header: bool = True
+    encoding: str = "utf-8"
+    # Large files are parsed in parallel byte ranges; disable for files with quoted newlines
+    split_large_files: bool = True
+    # Fixed-width record length in bytes including the line terminator; detected from the first line if unset
+    record_length: Optional[int] = None
+    columns: List[ColumnSpec] = []
+
+    @field_validator("file_format")
+    @classmethod
+    def check_format(cls, value: str) -> str:
+        if value not in SUPPORTED_FILE_FORMATS:
+            raise ValueError(f"unsupported file format '{value}', expected one of {sorted(SUPPORTED_FILE_FORMATS)}")
+        return value
+
+    @field_validator("columns")
+    @classmethod
+    def check_unique_columns(cls, columns: List[ColumnSpec]) -> List[ColumnSpec]:
+        names = [column.name for column in columns]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"duplicate column names {duplicates}")
+        return columns
+
+    @model_validator(mode="after")
+    def check_fixed_width_layout(self) -> "SourceSpec":
+        if self.file_format != "fixed_width":
+            return self
+        if not self.columns:
+            raise ValueError("fixed_width sources must declare columns with start and length")
+        for column in self.columns:
+            if column.start is None or column.length is None or column.start < 0 or column.length <= 0:
+                raise ValueError(f"fixed_width column '{column.name}' needs a non-negative start and a positive length")
+            if self.record_length and column.start + column.length > self.record_length:
+                raise ValueError(f"fixed_width column '{column.name}' extends past record_length {self.record_length}")
+        return self
+
+    def column_names(self) -> List[str]:
+        return [column.name for column in self.columns]
+
+
+class ColumnMapping(StrictModel):
+    """How one harmonised column is produced from an input column.
+
+    Steps apply in a fixed order: trim, case folding, code translation, cast.
+    """
+    source: str
+    # Output name; defaults to the source name
+    name: Optional[str] = None
+    # Cast target; text is parsed with ``format`` when casting to date
+    type: Optional[str] = None
+    format: Optional[str] = None
+    trim: bool = False
+    case: Optional[str] = None
+    # Code translation, e.g. {"US Dollar": "USD"}; values not listed become ``default`` if it is set
+    translate: Dict[str, str] = {}
+    default: Optional[str] = None
+
+    @field_validator("type")
+    @classmethod
+    def check_type(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and value not in SUPPORTED_COLUMN_TYPES:
+            raise ValueError(f"unsupported column type '{value}', expected one of {sorted(SUPPORTED_COLUMN_TYPES)}")
+        return value
+
+    @field_validator("case")
+    @classmethod
+    def check_case(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and value not in ("upper", "lower"):
+            raise ValueError(f"unsupported case '{value}', expected 'upper' or 'lower'")
+        return value
+
+    def output_name(self) -> str:
+        return self.name or self.source
+
+
+class DerivedColumn(StrictModel):
+    """A column computed from harmonised columns: exactly one of concat, coalesce or value."""
+    name: str
+    # Columns joined as text with ``separator``
+    concat: List[str] = []
+    separator: str = ""
+    # First non-null value among these columns
+    coalesce: List[str] = []
+    # Constant text value
+    value: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_single_operation(self) -> "DerivedColumn":
+        operations = [bool(self.concat), bool(self.coalesce), self.value is not None]
+        if sum(operations) != 1:
+            raise ValueError(f"derived column '{self.name}' needs exactly one of concat, coalesce or value")
+        return self
+
+
+class HarmonisationSpec(StrictModel):
+    """Mapping from one side's read columns onto the harmonised schema."""
+    columns: List[ColumnMapping] = []
+    derived: List[DerivedColumn] = []
+    # Pass input columns that no mapping uses through unchanged
+    keep_unmapped: bool = True
+
+    def output_names(self, input_names: List[str]) -> List[str]:
+        sources = {mapping.source for mapping in self.columns}
+        names = [mapping.output_name() for mapping in self.columns]
+        if self.keep_unmapped:
+            names += [name for name in input_names if name not in sources and name not in names]
+        return names + [derived.name for derived in self.derived]
+
+
+class HarmonisationConfig(StrictModel):
+    src: HarmonisationSpec = Field(default_factory=HarmonisationSpec)
+    tgt: HarmonisationSpec = Field(default_factory=HarmonisationSpec)
+
+
+class LookupSpec(SourceSpec):
+    """A reference or lookup file joined onto one side's rows during enrichment.
+
+    The reading options are those of a source; ``file_pattern`` is relative
+    to rootFileDir and may use the same date tokens.
+    """
+    name: str
+    file_pattern: str
+    # Dataset columns matched, in order, against ``lookup_keys`` (which default to the same names)
+    keys: List[str]
+    lookup_keys: List[str] = []
+    # Lookup columns added to each row, named ``prefix + field``
+    fields: List[str]
+    prefix: str = ""
+    # A required lookup with no matching file fails the enrichment file search
+    required: bool = True
+
+    @model_validator(mode="after")
+    def check_lookup_keys(self) -> "LookupSpec":
+        if not self.keys:
+            raise ValueError(f"lookup '{self.name}' needs at least one key")
+        if self.lookup_keys and len(self.lookup_keys) != len(self.keys):
+            raise ValueError(f"lookup '{self.name}': lookup_keys must pair up with keys")
+        return self
+
+    def index_keys(self) -> List[str]:
+        return self.lookup_keys or self.keys
+
+    def output_names(self) -> List[str]:
+        return [f"{self.prefix}{field}" for field in self.fields]
+
+
+class EnrichmentSpec(StrictModel):
+    lookups: List[LookupSpec] = []
+
+    @field_validator("lookups")
+    @classmethod
+    def check_unique_lookups(cls, lookups: List[LookupSpec]) -> List[LookupSpec]:
+        names = [lookup.name for lookup in lookups]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"duplicate lookup names {duplicates}")
+        return lookups
+
+
+class EnrichmentConfig(StrictModel):
+    src: EnrichmentSpec = Field(default_factory=EnrichmentSpec)
+    tgt: EnrichmentSpec = Field(default_factory=EnrichmentSpec)
+
+
+class TransformColumn(StrictModel):
+    """A column computed by an expression, e.g. ``amount * fx_rate`` or ``upper(trim(ccy))``."""
+    name: str
+    expression: str
+
+
+class TransformSpec(StrictModel):
+    """Derived columns and row filters of one side's data transform stage.
+
+    Columns are evaluated in order and may refer to the columns derived
+    before them; only rows for which every filter is true are kept.
+    """
+    columns: List[TransformColumn] = []
+    filters: List[str] = []
+    # Constants referenced as ``$name``; ``$run_date`` and ``$run_env`` are always defined
+    variables: Dict[str, Any] = {}
+
+    @field_validator("columns")
+    @classmethod
+    def check_unique_columns(cls, columns: List[TransformColumn]) -> List[TransformColumn]:
+        names = [column.name for column in columns]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"duplicate transform columns {duplicates}")
+        return columns
+
+
+class TransformConfig(StrictModel):
+    src: TransformSpec = Field(default_factory=TransformSpec)
+    tgt: TransformSpec = Field(default_factory=TransformSpec)
+
+
+class MatchField(StrictModel):
+    """One column compared by a match rule: equal, within ``tolerance``, or at least ``similarity`` alike."""
+    column: str
+    # Largest absolute difference accepted for numeric columns (in days for dates)
+    tolerance: Optional[float] = Field(default=None, ge=0)
+    # Smallest trigram (Jaccard) similarity accepted for text columns, between 0 and 1
+    similarity: Optional[float] = Field(default=None, gt=0, le=1)
+
+    @model_validator(mode="after")
+    def check_single_comparison(self) -> "MatchField":
+        if self.tolerance is not None and self.similarity is not None:
+            raise ValueError(f"match field '{self.column}' takes a tolerance or a similarity, not both")
+        return self
+
+
+class MatchRule(StrictModel):
+    """Pairs SRC and TGT rows left unmatched by the key join when every field agrees."""
+    name: str
+    fields: List[MatchField]
+
+    @field_validator("fields")
+    @classmethod
+    def check_fields(cls, fields: List[MatchField]) -> List[MatchField]:
+        if not fields:
+            raise ValueError("a match rule needs at least one field")
+        return fields
+
+
+class CombineSpec(StrictModel):
+    """How the SRC and TGT datasets are reconciled in combine_data_comp.
+
+    Rows are joined on business keys into matched, src-only and tgt-only
+    row sets; non-key columns are prefixed with their side.
+    """
+    # Join keys; default to the control's keys
+    keys: List[str] = []
+    src_prefix: str = "src_"
+    tgt_prefix: str = "tgt_"
+    # Memory a join may use per process; larger inputs are joined out of core. Defaults to COMBINE_MEMORY_BUDGET_MB
+    memory_budget_mb: Optional[int] = Field(default=None, gt=0)
+    # Tolerance and fuzzy rules applied in order to the rows the key join left unmatched
+    match_rules: List[MatchRule] = []
+
+    @model_validator(mode="after")
+    def check_names(self) -> "CombineSpec":
+        if self.src_prefix == self.tgt_prefix:
+            raise ValueError("combine src_prefix and tgt_prefix must differ")
+        names = [rule.name for rule in self.match_rules]
+        duplicates = sorted({name for name in names if names.count(name) > 1 or name == "key"})
+        if duplicates:
+            raise ValueError(f"duplicate or reserved match rule names {duplicates}")
+        return self
+
+
+RULE_ROW_SETS = ("matched", "src_only", "tgt_only")
+# Columns apply_rules_comp adds to every row
+RULE_OUTPUT_COLUMNS = ("rule", "rule_hits")
+
+
+class RuleSpec(StrictModel):
+    """A break rule: rows of ``row_set`` for which ``condition`` is true hit it.
+
+    Conditions use the transform expression language, e.g.
+    ``abs(src_amount - tgt_amount) > 0.01``, and may refer to earlier rules
+    of the same row set by name, e.g. ``amount_break and not fx_break``.
+    """
+    name: str
+    condition: str
+    row_set: str = "matched"
+
+    @field_validator("row_set")
+    @classmethod
+    def check_row_set(cls, value: str) -> str:
+        if value not in RULE_ROW_SETS:
+            raise ValueError(f"unsupported row set '{value}', expected one of {list(RULE_ROW_SETS)}")
+        return value
+
+
+class RulesConfig(StrictModel):
+    """The rule pack of apply_rules_comp.
+
+    Every rule is evaluated on its row set; a row's ``rule`` is the first
+    rule it hits in pack order and ``rule_hits`` the number it hits. With
+    ``short_circuit`` a row stops being evaluated once its first rule is
+    known, and rules run in the order run statistics say is cheapest;
+    ``rule_hits`` and the rule columns are then not produced.
+    """
+    rules: List[RuleSpec] = []
+    # Constants referenced as ``$name``; ``$run_date`` and ``$run_env`` are always defined
+    variables: Dict[str, Any] = {}
+    # Also add one boolean column per rule with its hits
+    rule_columns: bool = False
+    short_circuit: bool = False
+
+    @field_validator("rules")
+    @classmethod
+    def check_unique_rules(cls, rules: List[RuleSpec]) -> List[RuleSpec]:
+        names = [rule.name for rule in rules]
+        duplicates = sorted({name for name in names if names.count(name) > 1 or name in RULE_OUTPUT_COLUMNS})
+        if duplicates:
+            raise ValueError(f"duplicate or reserved rule names {duplicates}")
+        return rules
+
+    @model_validator(mode="after")
+    def check_outputs(self) -> "RulesConfig":
+        if self.short_circuit and self.rule_columns:
+            raise ValueError("rule_columns need every rule evaluated on every row; disable short_circuit")
+        return self
+
+    def row_set_rules(self, row_set: str) -> List[RuleSpec]:
+        return [rule for rule in self.rules if rule.row_set == row_set]
+
+
+OUTPUT_FORMATS = ("csv.gz", "npz")
+
+
+class OutputSpec(StrictModel):
+    """Where and how output_rules_comp writes the classified rows.
+
+    Each row set is split into one directory per distinct value of the
+    ``partition_by`` columns, e.g. ``matched/rule=amount_break/``.
+    """
+    # Relative paths are under rootFileDir; defaults to tempFilePath/output
+    directory: Optional[str] = None
+    partition_by: List[str] = ["rule"]
+    formats: List[str] = list(OUTPUT_FORMATS)
+    row_sets: List[str] = list(RULE_ROW_SETS)
+
+    @field_validator("formats")
+    @classmethod
+    def check_formats(cls, formats: List[str]) -> List[str]:
+        unsupported = sorted(set(formats) - set(OUTPUT_FORMATS))
+        if unsupported or not formats:
+            raise ValueError(f"unsupported output formats {unsupported}, expected some of {list(OUTPUT_FORMATS)}")
+        return formats
+
+    @field_validator("row_sets")
+    @classmethod
+    def check_row_sets(cls, row_sets: List[str]) -> List[str]:
+        unsupported = sorted(set(row_sets) - set(RULE_ROW_SETS))
+        if unsupported:
+            raise ValueError(f"unsupported row sets {unsupported}, expected some of {list(RULE_ROW_SETS)}")
+        return row_sets
+
+
+class BreakSpec(StrictModel):
+    """Which classified rows are breaks and how break_rolling_comp tracks them across run dates.
+
+    A break is identified by its row set and key values; it stays open on
+    every run that reports it and closes on the first run that does not.
+    """
+    # Breaks are tracked by these keys; default to the combine keys
+    keys: List[str] = []
+    # Condition selecting the break rows of each row set; without one every row of the row set is a break
+    conditions: Dict[str, Optional[str]] = {"matched": "rule is not null", "src_only": None, "tgt_only": None}
+    # Ages in days at which the break history logs an "aged" event
+    age_events: List[int] = [7, 30, 90]
+
+    @field_validator("conditions")
+    @classmethod
+    def check_row_sets(cls, conditions: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+        unsupported = sorted(set(conditions) - set(RULE_ROW_SETS))
+        if unsupported or not conditions:
+            raise ValueError(f"unsupported break row sets {unsupported}, expected some of {list(RULE_ROW_SETS)}")
+        return conditions
+
+    @field_validator("age_events")
+    @classmethod
+    def check_age_events(cls, age_events: List[int]) -> List[int]:
+        if any(age <= 0 for age in age_events):
+            raise ValueError(f"break age_events must be positive numbers of days, got {age_events}")
+        return sorted(set(age_events))
+
+
+class ControlConfig(StrictModel):
+    """Schema of a control's configuration, assembled from the files under inputConfigFilePath."""
+    name: str
+    version: str = "1"
+    keys: List[str] = []
+    src: SourceSpec = Field(default_factory=SourceSpec)
+    tgt: SourceSpec = Field(default_factory=SourceSpec)
+    harmonisation: HarmonisationConfig = Field(default_factory=HarmonisationConfig)
+    enrichment: EnrichmentConfig = Field(default_factory=EnrichmentConfig)
+    transform: TransformConfig = Field(default_factory=TransformConfig)
+    combine: CombineSpec = Field(default_factory=CombineSpec)
+    rules: RulesConfig = Field(default_factory=RulesConfig)
+    output: OutputSpec = Field(default_factory=OutputSpec)
+    breaks: BreakSpec = Field(default_factory=BreakSpec)
+
+    @model_validator(mode="after")
+    def check_keys_declared(self) -> "ControlConfig":
+        for flow_type in ("src", "tgt"):
+            spec = self.side(flow_type)
+            # Keys name harmonised columns, which may be renamed or derived from the read columns
+            harmonised = self.harmonisation_spec(flow_type).output_names(spec.column_names())
+            missing = [key for key in self.keys if spec.columns and key not in harmonised]
+            if missing:
+                raise ValueError(f"{flow_type}: key columns {missing} are not declared in columns")
+        return self
+
+    def side(self, flow_type: str) -> SourceSpec:
+        return self.src if flow_type == "src" else self.tgt
+
+    def harmonisation_spec(self, flow_type: str) -> HarmonisationSpec:
+        return self.harmonisation.src if flow_type == "src" else self.harmonisation.tgt
+
+    def enrichment_spec(self, flow_type: str) -> EnrichmentSpec:
+        return self.enrichment.src if flow_type == "src" else self.enrichment.tgt
+
+    def transform_spec(self, flow_type: str) -> TransformSpec:
+        return self.transform.src if flow_type == "src" else self.transform.tgt
+
+    def combine_keys(self) -> List[str]:
+        return self.combine.keys or self.keys
+
+    def break_keys(self) -> List[str]:
+        return self.breaks.keys or self.combine_keys()
+
+
+class CompiledConfig:
+    """A validated control config together with the fingerprints of the files it came from."""
+
+    def __init__(self, config: ControlConfig, files: List[Tuple[str, int, int]]):
+        self.config = config
+        self.files = files
+        self.fingerprint = hashlib.sha1(repr(files).encode("utf-8")).hexdigest()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.config.name,
+            "version": self.config.version,
+            "fingerprint": self.fingerprint,
+            "files": [{"path": path, "mtime_ns": mtime_ns, "size": size} for path, mtime_ns, size in self.files],
+        }
+
+
+class LRUCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# (directory, pattern, directory mtime) -> matching file names
+_listing_cache = LRUCache(256)
+# (path, mtime_ns, size) -> parsed document
+_document_cache = LRUCache(512)
+# tuple of file fingerprints -> CompiledConfig
+_compiled_cache = LRUCache(128)
+
+
+def discover_config_files(config_path: str, pattern: str) -> List[str]:
+    """List config files under ``config_path`` whose names match the glob ``pattern``."""
+    if os.path.isfile(config_path):
+        return [config_path]
+    if not os.path.isdir(config_path):
+        raise ConfigError(f"Config path {config_path} does not exist")
+    dir_mtime = os.stat(config_path).st_mtime_ns
+    cache_key = (config_path, pattern, dir_mtime)
+    names = _listing_cache.get(cache_key)
+    if names is None:
+        with os.scandir(config_path) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file() and fnmatch.fnmatch(entry.name, pattern))
+        _listing_cache.put(cache_key, names)
+    return [os.path.join(config_path, name) for name in names]
+
+
+def parse_config_document(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ConfigError(f"{path}: PyYAML is required to read YAML configs")
+            document = yaml.safe_load(raw)
+        else:
+            document = json.loads(raw)
+    except ConfigError:
+        raise
+    except PARSE_ERRORS as e:
+        raise ConfigError(f"{path}: could not be parsed: {e}")
+    if not isinstance(document, dict):
+        raise ConfigError(f"{path}: top level must be an object")
+    return document
+
+
+def merge_documents(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """Deep-merge ``override`` into ``base``; later config files refine earlier ones."""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_documents(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def format_validation_error(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()]
+
+
+def load_control_config(config_path: str, pattern: str) -> CompiledConfig:
+    """Discover, parse, validate and compile a control config.
+
+    Each file is fingerprinted by path, mtime and size; when none of them
+    changed the previously compiled config is returned without re-parsing.
+    """
+    paths = discover_config_files(config_path, pattern)
+    if not paths:
+        raise ConfigError(f"No config files in {config_path} match pattern {pattern}")
+
+    fingerprints = []
+    for path in paths:
+        st = os.stat(path)
+        fingerprints.append((path, st.st_mtime_ns, st.st_size))
+    cache_key = tuple(fingerprints)
+    compiled = _compiled_cache.get(cache_key)
+    if compiled is not None:
+        return compiled
+
+    started = time.perf_counter()
+    document: Dict[str, Any] = {}
+    for fingerprint in fingerprints:
+        parsed = _document_cache.get(fingerprint)
+        if parsed is None:
+            parsed = parse_config_document(fingerprint[0])
+            _document_cache.put(fingerprint, parsed)
+        document = merge_documents(document, parsed)
+    try:
+        config = ControlConfig(**document)
+    except ValidationError as e:
+        raise ConfigError("Invalid control config: " + "; ".join(format_validation_error(e)))
+    compiled = CompiledConfig(config, fingerprints)
+    _compiled_cache.put(cache_key, compiled)
+    logger.info(f"📚 Compiled control config '{config.name}' from {len(paths)} file(s) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return compiled
+
+
+def clear_config_cache() -> None:
+    _listing_cache.clear()
+    _document_cache.clear()
+    _compiled_cache.clear()
@@ -0,0 +1,320 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from columnar import (Chunk, Dataset, DatasetWriter, DictionaryArray, concat_chunks, dtype_to_column_type,
+                      read_chunk_file, write_chunk_file)
+from config_loader import EnrichmentSpec, LookupSpec
+from file_discovery import FoundFile
+from readers import infer_spec, read_file
+from shared_index import SharedIndexRegistry
+from workers import WORKER_PROCESSES, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Smaller datasets are enriched inline rather than across the process pool
+ENRICHMENT_PARALLEL_MIN_ROWS = int(os.environ.get("ENRICHMENT_PARALLEL_MIN_ROWS", "2000000"))
+INDEX_META = "index.json"
+
+# Unused cached indexes are removed by retention after this long
+ENRICHMENT_CACHE_MAX_AGE_SECONDS = float(os.environ.get("ENRICHMENT_CACHE_MAX_AGE_DAYS", "7")) * 86400
+
+
+def lookup_fingerprint(lookup: LookupSpec, files: List[FoundFile]) -> str:
+    """Identity of a lookup index: the files it was built from and everything that shapes it."""
+    document = {
+        "files": sorted((file.path, file.size, file.mtime_ns) for file in files),
+        "spec": lookup.model_dump(mode="json", exclude={"name", "prefix", "required"}),
+    }
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+
+def key_codes(values, nulls: np.ndarray, uniques: np.ndarray) -> np.ndarray:
+    """Position of every value within the sorted ``uniques``, or -1 where absent or null."""
+    if len(uniques) == 0:
+        return np.full(len(nulls), -1, dtype=np.int64)
+    if isinstance(values, DictionaryArray):
+        # Only the dictionary is searched; rows pick their result up through the codes
+        return np.where(nulls, -1, key_codes(values.dictionary, np.zeros(len(values.dictionary), dtype=bool), uniques)[values.codes])
+    positions = np.minimum(np.searchsorted(uniques, values), len(uniques) - 1)
+    return np.where((uniques[positions] == values) & ~nulls, positions, -1).astype(np.int64)
+
+
+class LookupIndex:
+    """Sorted-key index over a lookup table, with the payload columns enrichment adds.
+
+    Each key column is reduced to codes into its sorted distinct values and
+    the codes of a composite key are combined into one int64; probing a
+    chunk is then a handful of ``searchsorted`` calls over whole columns
+    (over the dictionary only, for dictionary-encoded keys).
+    """
+
+    def __init__(self, key_types: List[str], key_uniques: List[np.ndarray], index_keys: np.ndarray,
+                 payload: Dict[str, Any], payload_nulls: Dict[str, np.ndarray], payload_types: Dict[str, str],
+                 stats: Dict[str, Any]):
+        self.key_types = key_types
+        self.key_uniques = key_uniques
+        self.index_keys = index_keys
+        self.payload = payload
+        self.payload_nulls = payload_nulls
+        self.payload_types = payload_types
+        self.stats = stats
+
+    @classmethod
+    def build(cls, table: Chunk, key_names: List[str], fields: List[str], schema: Dict[str, str]) -> "LookupIndex":
+        missing = [name for name in key_names + fields if name not in table.columns]
+        if table.num_rows and missing:
+            raise ValueError(f"lookup columns {missing} are not in the lookup file")
+        key_values = [table.columns.get(name, np.zeros(0, dtype=str)) for name in key_names]
+        key_uniques = [values.dictionary if isinstance(values, DictionaryArray) else np.unique(np.asarray(values))
+                       for values in key_values]
+        if int(np.prod([max(len(uniques), 1) for uniques in key_uniques], dtype=object)) >= 2 ** 63:
+            raise ValueError(f"composite lookup key {key_names} has too many distinct combinations")
+        combined = np.zeros(table.num_rows, dtype=np.int64)
+        valid = np.ones(table.num_rows, dtype=bool)
+        for name, values, uniques in zip(key_names, key_values, key_uniques):
+            codes = key_codes(values, table.null_mask(name), uniques)
+            valid &= codes >= 0
+            combined = combined * max(len(uniques), 1) + np.maximum(codes, 0)
+        rows = np.flatnonzero(valid)
+        order = rows[np.argsort(combined[rows], kind="stable")]
+        sorted_keys = combined[order]
+        first = np.ones(len(sorted_keys), dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        index_rows = order[first]
+
+        payload = {name: table.columns[name][index_rows] for name in fields if name in table.columns}
+        payload_nulls = {name: table.null_mask(name)[index_rows] for name in payload}
+        stats = {"rows": table.num_rows, "keys": int(first.sum()), "duplicate_keys": int((~first).sum()),
+                 "null_keys": int(table.num_rows - len(rows))}
+        key_types = [schema.get(name, "str") for name in key_names]
+        payload_types = {name: schema.get(name, "str") for name in fields}
+        return cls(key_types, key_uniques, sorted_keys[first], payload, payload_nulls, payload_types, stats)
+
+    def probe(self, columns: List[Any], nulls: List[np.ndarray]) -> np.ndarray:
+        """Payload position for every row, or -1 where the key is not in the lookup."""
+        num_rows = len(nulls[0])
+        if len(self.index_keys) == 0:
+            return np.full(num_rows, -1, dtype=np.int64)
+        combined = np.zeros(num_rows, dtype=np.int64)
+        found = np.ones(num_rows, dtype=bool)
+        for values, null_mask, uniques in zip(columns, nulls, self.key_uniques):
+            codes = key_codes(values, null_mask, uniques)
+            found &= codes >= 0
+            combined = combined * max(len(uniques), 1) + np.maximum(codes, 0)
+        positions = np.minimum(np.searchsorted(self.index_keys, combined), len(self.index_keys) - 1)
+        found &= self.index_keys[positions] == combined
+        return np.where(found, positions, -1)
+
+    def take(self, field: str, positions: np.ndarray) -> Tuple[Any, np.ndarray]:
+        """Payload values at ``positions`` with a null mask covering misses."""
+        missed = positions < 0
+        column_type = self.payload_types[field]
+        if len(self.index_keys) == 0 or field not in self.payload:
+            empty = {"str": "", "int": 0, "float": np.nan, "date": np.datetime64("NaT"), "bool": False}[column_type]
+            return np.full(len(positions), empty), np.ones(len(positions), dtype=bool)
+        safe = np.where(missed, 0, positions)
+        values = self.payload[field][safe]
+        if column_type == "float":
+            values[missed] = np.nan
+        elif column_type == "date":
+            values[missed] = np.datetime64("NaT")
+        return values, missed | self.payload_nulls[field][safe]
+
+    def save(self, path: str) -> None:
+        """Write the index as plain ``.npy`` arrays plus a JSON description, atomically."""
+        tmp_path = f"{path}.tmp_{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        arrays = {"index_keys": self.index_keys}
+        arrays.update({f"key_{i}": uniques for i, uniques in enumerate(self.key_uniques)})
+        fields = []
+        for i, (name, values) in enumerate(self.payload.items()):
+            if isinstance(values, DictionaryArray):
+                arrays[f"payload_{i}"] = values.codes
+                arrays[f"payload_{i}_dictionary"] = values.dictionary
+            else:
+                arrays[f"payload_{i}"] = values
+            arrays[f"payload_{i}_nulls"] = self.payload_nulls[name]
+            fields.append({"name": name, "dictionary": isinstance(values, DictionaryArray)})
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array, allow_pickle=False)
+        meta = {"key_types": self.key_types, "fields": fields, "payload_types": self.payload_types, "stats": self.stats}
+        with open(os.path.join(tmp_path, INDEX_META), "w") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker or instance published the same index first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> "LookupIndex":
+        """Open a saved index with every array memory-mapped read-only."""
+        with open(os.path.join(path, INDEX_META)) as f:
+            meta = json.load(f)
+
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+
+        payload: Dict[str, Any] = {}
+        payload_nulls: Dict[str, np.ndarray] = {}
+        for i, field in enumerate(meta["fields"]):
+            values = array(f"payload_{i}")
+            if field["dictionary"]:
+                values = DictionaryArray(values, array(f"payload_{i}_dictionary"))
+            payload[field["name"]] = values
+            payload_nulls[field["name"]] = array(f"payload_{i}_nulls")
+        key_uniques = [array(f"key_{i}") for i in range(len(meta["key_types"]))]
+        return cls(meta["key_types"], key_uniques, array("index_keys"), payload, payload_nulls,
+                   meta["payload_types"], meta["stats"])
+
+
+def read_lookup_table(lookup: LookupSpec, files: List[FoundFile]) -> Tuple[Chunk, Dict[str, str]]:
+    needed = lookup.index_keys() + lookup.fields
+    spec = infer_spec(files[0].path, lookup) if files else lookup
+    chunks = []
+    for file in files:
+        _, file_chunks = read_file(file.path, spec)
+        chunks.extend(chunk.select([name for name in needed if name in chunk.columns]) for chunk in file_chunks)
+    table = concat_chunks(chunks)
+    schema = {column.name: column.type for column in spec.columns}
+    schema.update({name: dtype_to_column_type(values) for name, values in table.columns.items() if name not in schema})
+    return table, schema
+
+
+# Indexes attached by this process (the API process or a pool worker)
+index_registry = SharedIndexRegistry(LookupIndex.load)
+
+
+def get_lookup_index(lookup: LookupSpec, files: List[FoundFile], cache_dir: str) -> Tuple[LookupIndex, str, str]:
+    """Attach the index for ``lookup`` over ``files``, building and publishing it first if needed.
+
+    Indexes live under ``cache_dir`` keyed by the lookup's fingerprint, so
+    every run, instance and pool worker using the same reference files
+    shares one build, mapped read-only from the same files. Returns the
+    index, where it came from and its path; release the path with
+    ``index_registry.release`` when done.
+    """
+    path = os.path.join(cache_dir, lookup_fingerprint(lookup, files))
+    if os.path.exists(os.path.join(path, INDEX_META)):
+        source = "shared" if index_registry.is_attached(path) else "disk"
+        return index_registry.acquire(path), source, path
+    started = time.perf_counter()
+    table, schema = read_lookup_table(lookup, files)
+    index = LookupIndex.build(table, lookup.index_keys(), lookup.fields, schema)
+    os.makedirs(cache_dir, exist_ok=True)
+    index.save(path)
+    logger.info(f"🗂️ Built lookup index '{lookup.name}' over {index.stats['rows']} rows "
+                f"({index.stats['keys']} keys) in {(time.perf_counter() - started):.2f} s")
+    # The freshly built arrays are dropped in favour of the shared mapping
+    return index_registry.acquire(path), "built", path
+
+
+class EnrichmentPlan:
+    """The lookups of one side attached to their indexes and checked against the input schema.
+
+    Holds a reference on every index it uses; call ``close`` when done.
+    """
+
+    def __init__(self, spec: EnrichmentSpec, files: Dict[str, List[FoundFile]], input_schema: Dict[str, str], cache_dir: str):
+        self.lookups: List[Tuple[LookupSpec, LookupIndex]] = []
+        self.sources: Dict[str, str] = {}
+        self.paths: List[str] = []
+        self.schema = dict(input_schema)
+        try:
+            for lookup in spec.lookups:
+                missing = [key for key in lookup.keys if key not in input_schema]
+                if missing:
+                    raise ValueError(f"lookup '{lookup.name}' keys {missing} are not in the dataset")
+                index, source, path = get_lookup_index(lookup, files.get(lookup.name, []), cache_dir)
+                self.paths.append(path)
+                for key, key_type in zip(lookup.keys, index.key_types):
+                    if index.stats["rows"] and input_schema[key] != key_type:
+                        raise ValueError(f"lookup '{lookup.name}': key '{key}' is {input_schema[key]} in the dataset "
+                                         f"but {key_type} in the lookup file")
+                for field, name in zip(lookup.fields, lookup.output_names()):
+                    if name in self.schema:
+                        raise ValueError(f"lookup '{lookup.name}' would overwrite column '{name}'; set a prefix")
+                    self.schema[name] = index.payload_types[field]
+                self.lookups.append((lookup, index))
+                self.sources[lookup.name] = source
+        except Exception:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        for path in self.paths:
+            index_registry.release(path)
+        self.paths = []
+        self.lookups = []
+
+    def apply(self, chunk: Chunk) -> Tuple[Chunk, Dict[str, int]]:
+        columns = dict(chunk.columns)
+        nulls = dict(chunk.nulls)
+        matched = {}
+        for lookup, index in self.lookups:
+            positions = index.probe([chunk.columns[key] for key in lookup.keys],
+                                    [chunk.null_mask(key) for key in lookup.keys])
+            matched[lookup.name] = int(np.count_nonzero(positions >= 0))
+            for field, name in zip(lookup.fields, lookup.output_names()):
+                columns[name], null_mask = index.take(field, positions)
+                if null_mask.any():
+                    nulls[name] = null_mask
+        return Chunk(columns, chunk.row_offset, nulls, chunk.invalid), matched
+
+
+def enrich_chunk_file(spec_json: str, files: Dict[str, List[FoundFile]], input_schema: Dict[str, str], cache_dir: str,
+                      path: str, row_offset: int, output_path: str) -> Tuple[int, Dict[str, int]]:
+    """Pool entry point: enrich one chunk file; indexes come from the worker's cache or the disk cache."""
+    plan = EnrichmentPlan(EnrichmentSpec.model_validate_json(spec_json), files, input_schema, cache_dir)
+    try:
+        chunk, matched = plan.apply(read_chunk_file(path, row_offset))
+    finally:
+        plan.close()
+    write_chunk_file(output_path, chunk)
+    return chunk.num_rows, matched
+
+
+def enrich_dataset(dataset: Dataset, spec: EnrichmentSpec, files: Dict[str, List[FoundFile]], output_path: str,
+                   cache_dir: str, max_workers: int = WORKER_PROCESSES) -> Tuple[Dataset, Dict[str, Dict[str, Any]]]:
+    """Add the fields of every lookup to ``dataset``; returns the enriched dataset and per-lookup stats."""
+    started = time.perf_counter()
+    plan = EnrichmentPlan(spec, files, dataset.schema, cache_dir)
+    try:
+        writer = DatasetWriter(output_path, plan.schema)
+        matched = {lookup.name: 0 for lookup in spec.lookups}
+        if len(dataset.chunks) <= 1 or max_workers <= 1 or dataset.num_rows < ENRICHMENT_PARALLEL_MIN_ROWS:
+            for chunk in dataset.iter_chunks():
+                enriched, chunk_matched = plan.apply(chunk)
+                writer.write(enriched)
+                for name, count in chunk_matched.items():
+                    matched[name] += count
+        else:
+            spec_json = spec.model_dump_json()
+            pool = get_process_pool()
+            futures = []
+            for index, entry in enumerate(dataset.chunks):
+                file_name = f"chunk_{index:06d}.npz"
+                futures.append((file_name, pool.submit(enrich_chunk_file, spec_json, files, dataset.schema, cache_dir,
+                                                       os.path.join(dataset.path, entry["file"]), entry["row_offset"],
+                                                       os.path.join(output_path, file_name))))
+            for file_name, future in futures:
+                num_rows, chunk_matched = future.result()
+                writer.add_chunk_file(file_name, num_rows)
+                for name, count in chunk_matched.items():
+                    matched[name] += count
+        result = writer.close({"source": dataset.path})
+        stats = {lookup.name: {**index.stats, "index": plan.sources[lookup.name], "matched_rows": matched[lookup.name],
+                               "unmatched_rows": result.num_rows - matched[lookup.name]}
+                 for lookup, index in plan.lookups}
+    finally:
+        plan.close()
+    logger.info(f"🔗 Enriched {result.num_rows} rows with {len(stats)} lookups in {(time.perf_counter() - started):.2f} s")
+    return result, stats
@@ -0,0 +1,1069 @@
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from columnar import Chunk, DictionaryArray, convert_column, map_text, maybe_dictionary_encode
+from config_loader import LRUCache
+
+# Expression text -> syntax tree; the same expression is tokenized and parsed once per process
+_parse_cache = LRUCache(4096)
+# (expressions, filters, schema, variables) hash -> ExpressionProgram
+_program_cache = LRUCache(128)
+
+TYPES = ("int", "float", "bool", "str", "date")
+_FILL = {"int": np.int64(0), "float": np.float64(np.nan), "bool": np.False_, "str": np.str_(""),
+         "date": np.datetime64("NaT", "D"), "null": np.False_}
+_DTYPES = {"int": np.int64, "float": np.float64, "bool": np.bool_, "str": np.str_}
+# Operations whose argument order does not matter, so ``a * b`` and ``b * a`` share a node
+_COMMUTATIVE = {"+", "*", "=", "!=", "and", "or"}
+# Operations that do not simply return null when an argument is null
+_NULL_AWARE = {"and", "or", "if", "coalesce", "is_null", "is_not_null", "concat", "in"}
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>`[^`]+`)
+  | (?P<variable>\$[A-Za-z_]\w*)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op><=|>=|<>|!=|==|\|\||[-+*/%()<>=,])
+""", re.VERBOSE)
+
+_KEYWORDS = {"and", "or", "not", "in", "is", "null", "true", "false", "case", "when", "then", "else", "end"}
+
+# Left binding power of infix operators; higher binds tighter
+_INFIX = {"or": 10, "and": 20, "=": 40, "==": 40, "!=": 40, "<>": 40, "<": 40, "<=": 40, ">": 40, ">=": 40,
+          "in": 40, "is": 40, "||": 50, "+": 60, "-": 60, "*": 70, "/": 70, "%": 70}
+_NOT_POWER = 30
+_NEGATE_POWER = 80
+_OPERATOR_NAMES = {"=": "=", "==": "=", "!=": "!=", "<>": "!="}
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    position: int
+
+
+def tokenize(text: str) -> List[Token]:
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"unexpected character {text[position]!r} at position {position} in '{text}'")
+        kind = match.lastgroup
+        if kind != "space":
+            value = match.group()
+            if kind == "name" and value.lower() in _KEYWORDS:
+                kind, value = "keyword", value.lower()
+            tokens.append(Token(kind, value, position))
+        position = match.end()
+    tokens.append(Token("end", "", len(text)))
+    return tokens
+
+
+class Parser:
+    """Pratt parser producing a syntax tree of nested tuples.
+
+    Every node is ``("column", name)``, ``("variable", name)``,
+    ``("literal", value, type)`` or ``("call", function, args)``; operators
+    are calls of their symbol and ``case`` becomes nested ``if`` calls.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def parse(self) -> tuple:
+        tree = self.expression(0)
+        if self.peek().kind != "end":
+            raise self.error(f"unexpected {self.peek().text!r}", self.peek())
+        return tree
+
+    def error(self, message: str, token: Token) -> ValueError:
+        return ValueError(f"{message} at position {token.position} in '{self.text}'")
+
+    def peek(self, offset: int = 0) -> Token:
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def next(self) -> Token:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, text: str) -> bool:
+        if self.peek().text == text and self.peek().kind in ("keyword", "op"):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text: str) -> Token:
+        token = self.next()
+        if token.text != text or token.kind not in ("keyword", "op"):
+            raise self.error(f"expected {text!r} but found {token.text or 'end of expression'!r}", token)
+        return token
+
+    def binding_power(self, token: Token) -> int:
+        if token.kind not in ("keyword", "op"):
+            return 0
+        if token.text == "not":
+            # Only ``not in`` continues an expression
+            return _INFIX["in"] if self.peek(1).text == "in" else 0
+        return _INFIX.get(token.text, 0)
+
+    def expression(self, right_power: int) -> tuple:
+        left = self.prefix(self.next())
+        while right_power < self.binding_power(self.peek()):
+            left = self.infix(self.next(), left)
+        return left
+
+    def prefix(self, token: Token) -> tuple:
+        if token.kind == "number":
+            is_float = any(c in token.text for c in ".eE")
+            return ("literal", float(token.text) if is_float else int(token.text), "float" if is_float else "int")
+        if token.kind == "string":
+            return ("literal", token.text[1:-1].replace("''", "'"), "str")
+        if token.kind == "quoted":
+            return ("column", token.text[1:-1])
+        if token.kind == "variable":
+            return ("variable", token.text[1:])
+        if token.kind == "name":
+            if self.accept("("):
+                args = []
+                if not self.accept(")"):
+                    args.append(self.expression(0))
+                    while self.accept(","):
+                        args.append(self.expression(0))
+                    self.expect(")")
+                return ("call", token.text.lower(), tuple(args))
+            return ("column", token.text)
+        if token.text == "(":
+            inner = self.expression(0)
+            self.expect(")")
+            return inner
+        if token.text == "-":
+            return ("call", "neg", (self.expression(_NEGATE_POWER),))
+        if token.text == "+":
+            return self.expression(_NEGATE_POWER)
+        if token.text == "not":
+            return ("call", "not", (self.expression(_NOT_POWER),))
+        if token.text in ("true", "false"):
+            return ("literal", token.text == "true", "bool")
+        if token.text == "null":
+            return ("literal", None, "null")
+        if token.text == "case":
+            return self.case()
+        raise self.error(f"unexpected {token.text or 'end of expression'!r}", token)
+
+    def case(self) -> tuple:
+        subject = None if self.peek().text == "when" else self.expression(0)
+        branches = []
+        while self.accept("when"):
+            condition = self.expression(0)
+            if subject is not None:
+                condition = ("call", "=", (subject, condition))
+            self.expect("then")
+            branches.append((condition, self.expression(0)))
+        if not branches:
+            raise self.error("case needs at least one when", self.peek())
+        result = self.expression(0) if self.accept("else") else ("literal", None, "null")
+        self.expect("end")
+        for condition, value in reversed(branches):
+            result = ("call", "if", (condition, value, result))
+        return result
+
+    def infix(self, token: Token, left: tuple) -> tuple:
+        if token.text == "is":
+            negate = self.accept("not")
+            self.expect("null")
+            return ("call", "is_not_null" if negate else "is_null", (left,))
+        if token.text in ("in", "not"):
+            if token.text == "not":
+                self.expect("in")
+            self.expect("(")
+            items = [self.expression(0)]
+            while self.accept(","):
+                items.append(self.expression(0))
+            self.expect(")")
+            member = ("call", "in", (left, *items))
+            return ("call", "not", (member,)) if token.text == "not" else member
+        right = self.expression(_INFIX[token.text])
+        return ("call", _OPERATOR_NAMES.get(token.text, token.text), (left, right))
+
+
+def parse(text: str) -> tuple:
+    tree = _parse_cache.get(text)
+    if tree is None:
+        tree = Parser(text).parse()
+        _parse_cache.put(text, tree)
+    return tree
+
+
+# ---------------------------------------------------------------------------
+# Typed, hash-consed expression graph
+# ---------------------------------------------------------------------------
+
+class Vector(NamedTuple):
+    """Values and null mask of an intermediate result.
+
+    Constants keep a numpy scalar and a numpy bool so they broadcast instead
+    of being materialised per row.
+    """
+    values: Any
+    nulls: Any
+
+
+class Node:
+    """One operation of a compiled program; equal subexpressions share a single node."""
+
+    __slots__ = ("op", "args", "value", "type")
+
+    def __init__(self, op: str, args: Tuple["Node", ...], value: Any, node_type: str):
+        self.op = op
+        self.args = args
+        self.value = value
+        self.type = node_type
+
+    @property
+    def is_constant(self) -> bool:
+        return self.op in ("literal", "null")
+
+    def constant(self) -> Vector:
+        return Vector(self.value, np.bool_(self.op == "null"))
+
+
+class Function(NamedTuple):
+    min_args: int
+    max_args: Optional[int]
+    # Argument types (and nodes, for constant-only arguments) -> result type; raises ValueError on misuse
+    result_type: Callable[[List[str], List[Node]], str]
+    evaluate: Callable[[List[Vector], List[str]], Vector]
+
+
+def _is_array(values) -> bool:
+    return isinstance(values, (np.ndarray, DictionaryArray))
+
+
+def _nulls_any(*vectors: Vector):
+    nulls = np.False_
+    for vector in vectors:
+        nulls = nulls | vector.nulls
+    return nulls
+
+
+def _dense(values):
+    return np.asarray(values) if isinstance(values, DictionaryArray) else values
+
+
+def _on_values(values, function: Callable[[np.ndarray], np.ndarray]):
+    """Apply an elementwise function; a dictionary column is only computed on its distinct values."""
+    if isinstance(values, DictionaryArray):
+        result = function(values.dictionary)
+        if result.dtype.kind == "U":
+            return map_text(values, function)
+        return result[values.codes]
+    return function(values)
+
+
+def _unify(types: List[str]) -> str:
+    present = {t for t in types if t != "null"}
+    if not present:
+        return "null"
+    if present <= {"int", "float"}:
+        return "float" if "float" in present else "int"
+    if len(present) == 1:
+        return present.pop()
+    raise ValueError(f"incompatible types {sorted(present)}")
+
+
+def _numeric(types: List[str]) -> str:
+    for t in types:
+        if t not in ("int", "float", "null"):
+            raise ValueError(f"expected a number, got {t}")
+    result = _unify(types)
+    return "float" if result == "null" else result
+
+
+def _float(types: List[str], args: List[Node]) -> str:
+    _numeric(types)
+    return "float"
+
+
+def _expect(*expected: str) -> Callable[[List[str], List[Node]], str]:
+    def check(types: List[str], args: List[Node]) -> None:
+        for position, t in enumerate(types):
+            allowed = expected[min(position, len(expected) - 1)]
+            if t != "null" and t not in allowed.split("|"):
+                raise ValueError(f"argument {position + 1} must be {allowed.replace('|', ' or ')}, got {t}")
+    return check
+
+
+def _constants(*positions: int) -> Callable[[List[str], List[Node]], None]:
+    def check(types: List[str], args: List[Node]) -> None:
+        for position in positions:
+            if position < len(args) and not args[position].is_constant:
+                raise ValueError(f"argument {position + 1} must be a constant")
+    return check
+
+
+def _typed(result: str, *checks) -> Callable[[List[str], List[Node]], str]:
+    def rule(types: List[str], args: List[Node]) -> str:
+        for check in checks:
+            check(types, args)
+        return result
+    return rule
+
+
+def _strict(function: Callable[..., Any]) -> Callable[[List[Vector], List[str]], Vector]:
+    """A function whose result is null wherever any argument is null."""
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        return Vector(function(*[arg.values for arg in args]), _nulls_any(*args))
+    return evaluate
+
+
+# -- arithmetic ---------------------------------------------------------------
+
+def _add_type(types: List[str], args: List[Node]) -> str:
+    left, right = types
+    if "date" in types:
+        if {left, right} <= {"date", "int", "null"} and types.count("date") == 1:
+            return "date"
+        raise ValueError(f"cannot add {left} and {right}")
+    return _numeric(types)
+
+
+def _sub_type(types: List[str], args: List[Node]) -> str:
+    left, right = types
+    if left == "date" and right in ("int", "null"):
+        return "date"
+    if left == "date" and right == "date":
+        return "int"
+    if "date" in types:
+        raise ValueError(f"cannot subtract {right} from {left}")
+    return _numeric(types)
+
+
+def _days(values):
+    return values.astype("timedelta64[D]") if _is_array(values) else np.timedelta64(int(values), "D")
+
+
+def _add(args: List[Vector], types: List[str]) -> Vector:
+    left, right = args
+    if types[0] == "date":
+        return Vector(left.values + _days(right.values), _nulls_any(*args))
+    if types[1] == "date":
+        return Vector(right.values + _days(left.values), _nulls_any(*args))
+    return Vector(left.values + right.values, _nulls_any(*args))
+
+
+def _sub(args: List[Vector], types: List[str]) -> Vector:
+    left, right = args
+    if types == ["date", "date"]:
+        return Vector((left.values - right.values).astype(np.int64), _nulls_any(*args))
+    if types[0] == "date":
+        return Vector(left.values - _days(right.values), _nulls_any(*args))
+    return Vector(left.values - right.values, _nulls_any(*args))
+
+
+def _divide(args: List[Vector], types: List[str]) -> Vector:
+    left, right = args
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.true_divide(left.values, right.values)
+    # Division by zero gives null rather than inf
+    return Vector(values, _nulls_any(*args) | (right.values == 0))
+
+
+def _modulo(args: List[Vector], types: List[str]) -> Vector:
+    left, right = args
+    zero = right.values == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.mod(left.values, np.where(zero, 1, right.values))
+    return Vector(values, _nulls_any(*args) | zero)
+
+
+def _round(args: List[Vector], types: List[str]) -> Vector:
+    digits = int(args[1].values) if len(args) > 1 else 0
+    return Vector(np.round(args[0].values, digits), args[0].nulls)
+
+
+def _rounding(function: Callable[[np.ndarray], np.ndarray]) -> Callable[[List[Vector], List[str]], Vector]:
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        values = args[0].values
+        return Vector(values if types[0] == "int" else function(values), args[0].nulls)
+    return evaluate
+
+
+# -- comparison and logic -----------------------------------------------------
+
+def _comparable(types: List[str], args: List[Node]) -> str:
+    left, right = types
+    if "null" in types or left == right or {left, right} <= {"int", "float"}:
+        return "bool"
+    raise ValueError(f"cannot compare {left} with {right}")
+
+
+_COMPARISONS = {"=": np.equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal,
+                ">": np.greater, ">=": np.greater_equal}
+
+
+def _comparison(op: str) -> Callable[[List[Vector], List[str]], Vector]:
+    compare = _COMPARISONS[op]
+
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        left, right = args
+        if isinstance(left.values, DictionaryArray) and not _is_array(right.values):
+            values = _on_values(left.values, lambda dictionary: compare(dictionary, right.values))
+        elif isinstance(right.values, DictionaryArray) and not _is_array(left.values):
+            values = _on_values(right.values, lambda dictionary: compare(left.values, dictionary))
+        else:
+            values = compare(_dense(left.values), _dense(right.values))
+        return Vector(values, _nulls_any(*args))
+    return evaluate
+
+
+def _truth(vector: Vector) -> Tuple[Any, Any]:
+    """Rows known to be true and rows known to be false."""
+    return vector.values & ~vector.nulls, ~vector.values & ~vector.nulls
+
+
+def _and(args: List[Vector], types: List[str]) -> Vector:
+    # Three-valued logic: false and null is false
+    (left_true, left_false), (right_true, right_false) = _truth(args[0]), _truth(args[1])
+    true, false = left_true & right_true, left_false | right_false
+    return Vector(true, ~(true | false))
+
+
+def _or(args: List[Vector], types: List[str]) -> Vector:
+    (left_true, left_false), (right_true, right_false) = _truth(args[0]), _truth(args[1])
+    true, false = left_true | right_true, left_false & right_false
+    return Vector(true, ~(true | false))
+
+
+def _not(args: List[Vector], types: List[str]) -> Vector:
+    return Vector(~args[0].values, args[0].nulls)
+
+
+def _member_type(types: List[str], args: List[Node]) -> str:
+    _constants(*range(1, len(args)))(types, args)
+    _unify(types)
+    return "bool"
+
+
+def _member(args: List[Vector], types: List[str]) -> Vector:
+    subject = args[0]
+    choices = np.array([arg.values for arg in args[1:] if not arg.nulls])
+    if isinstance(subject.values, DictionaryArray):
+        values = subject.values.isin(choices)
+    else:
+        values = np.isin(subject.values, choices)
+    return Vector(values, subject.nulls)
+
+
+def _is_null(args: List[Vector], types: List[str]) -> Vector:
+    return Vector(args[0].nulls, np.False_)
+
+
+def _is_not_null(args: List[Vector], types: List[str]) -> Vector:
+    return Vector(~args[0].nulls, np.False_)
+
+
+# -- conditionals -------------------------------------------------------------
+
+def _if_type(types: List[str], args: List[Node]) -> str:
+    _expect("bool", "int|float|bool|str|date")(types[:1], args[:1])
+    return _unify(types[1:])
+
+
+def _if(args: List[Vector], types: List[str]) -> Vector:
+    condition, when_true, when_false = args
+    chosen = condition.values & ~condition.nulls
+    return Vector(np.where(chosen, _dense(when_true.values), _dense(when_false.values)),
+                  np.where(chosen, when_true.nulls, when_false.nulls))
+
+
+def _coalesce_type(types: List[str], args: List[Node]) -> str:
+    return _unify(types)
+
+
+def _coalesce(args: List[Vector], types: List[str]) -> Vector:
+    values, nulls = _dense(args[0].values), args[0].nulls
+    for arg in args[1:]:
+        values = np.where(nulls, _dense(arg.values), values)
+        nulls = nulls & arg.nulls
+    return Vector(values, nulls)
+
+
+def _extreme(function) -> Callable[[List[Vector], List[str]], Vector]:
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        values = _dense(args[0].values)
+        for arg in args[1:]:
+            values = function(values, _dense(arg.values))
+        return Vector(values, _nulls_any(*args))
+    return evaluate
+
+
+def _ordered_type(types: List[str], args: List[Node]) -> str:
+    result = _unify(types)
+    if result not in ("int", "float", "date", "null"):
+        raise ValueError(f"expected numbers or dates, got {result}")
+    return result
+
+
+# -- text ---------------------------------------------------------------------
+
+def _format_text(values, column_type: str):
+    if column_type in ("str", "null"):
+        return values
+    if column_type == "date":
+        return np.datetime_as_string(values, unit="D")
+    if column_type == "bool":
+        return np.where(values, "true", "false")
+    if _is_array(values):
+        return values.astype(str)
+    return np.str_(values)
+
+
+def _concat_values(parts: List[Any]):
+    arrays = [part for part in parts if _is_array(part)]
+    if len(arrays) == 1 and isinstance(arrays[0], DictionaryArray):
+        # One dictionary column among constants: build the text per distinct value only
+        def join(dictionary: np.ndarray) -> np.ndarray:
+            text = np.array([""])
+            for part in parts:
+                text = np.char.add(text, dictionary if part is arrays[0] else part)
+            return text
+        return map_text(arrays[0], join)
+    text = np.str_("")
+    for part in parts:
+        text = np.char.add(text, _dense(part))
+    return text
+
+
+def _concat_operator(args: List[Vector], types: List[str]) -> Vector:
+    return Vector(_concat_values([_format_text(arg.values, t) for arg, t in zip(args, types)]), _nulls_any(*args))
+
+
+def _concat(args: List[Vector], types: List[str]) -> Vector:
+    # concat() reads null arguments as empty text, unlike ||
+    parts = []
+    for arg, t in zip(args, types):
+        text = _format_text(arg.values, t)
+        if np.any(arg.nulls):
+            text = np.where(arg.nulls, "", _dense(text))
+        parts.append(text)
+    return Vector(_concat_values(parts), np.False_)
+
+
+def _text_function(function: Callable[..., np.ndarray]) -> Callable[[List[Vector], List[str]], Vector]:
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        extra = [arg.values for arg in args[1:]]
+        return Vector(_on_values(args[0].values, lambda text: function(text, *extra)), _nulls_any(*args))
+    return evaluate
+
+
+def _code_points(text: np.ndarray) -> Tuple[np.ndarray, int]:
+    """Fixed-width unicode values as a (rows, width) matrix of code points."""
+    width = text.dtype.itemsize // 4
+    return np.ascontiguousarray(text).reshape(-1).view(np.uint32).reshape(-1, width), width
+
+
+def _from_code_points(points: np.ndarray, shape: Tuple[int, ...]) -> np.ndarray:
+    # Trailing zero code points are padding, exactly as in numpy's own fixed-width strings
+    return np.ascontiguousarray(points, dtype=np.uint32).view(np.dtype(f"U{points.shape[1]}")).reshape(shape)
+
+
+def _substr(text: np.ndarray, start, length=None) -> np.ndarray:
+    """1-based substring of every value, by slicing the code point matrix."""
+    text = np.asarray(text)
+    points, width = _code_points(text)
+    begin = max(int(start) - 1, 0)
+    end = width if length is None else min(begin + max(int(length), 0), width)
+    if begin >= end or text.size == 0:
+        return np.full(text.shape, "")
+    return _from_code_points(points[:, begin:end], text.shape)
+
+
+def _right(text: np.ndarray, count) -> np.ndarray:
+    text = np.asarray(text)
+    points, width = _code_points(text)
+    count = min(max(int(count), 0), width)
+    if count == 0 or text.size == 0:
+        return np.full(text.shape, "")
+    lengths = np.char.str_len(text.reshape(-1))
+    taken = np.minimum(lengths, count)
+    positions = np.minimum((lengths - taken)[:, None] + np.arange(count), width - 1)
+    picked = np.where(np.arange(count) < taken[:, None], np.take_along_axis(points, positions, axis=1), 0)
+    return _from_code_points(picked, text.shape)
+
+
+def _length(args: List[Vector], types: List[str]) -> Vector:
+    values = args[0].values
+    if not _is_array(values):
+        return Vector(np.int64(len(str(values))), args[0].nulls)
+    return Vector(_on_values(values, lambda text: np.char.str_len(text).astype(np.int64)), args[0].nulls)
+
+
+def _predicate(function: Callable[[np.ndarray, Any], np.ndarray]) -> Callable[[List[Vector], List[str]], Vector]:
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        pattern = args[1].values
+        return Vector(_on_values(args[0].values, lambda text: np.asarray(function(text, pattern), dtype=bool)),
+                      _nulls_any(*args))
+    return evaluate
+
+
+# -- casts --------------------------------------------------------------------
+
+def _cast_type(target: str) -> Callable[[List[str], List[Node]], str]:
+    allowed = {"int": ("int", "float", "bool", "str"), "float": ("int", "float", "bool", "str"),
+               "str": TYPES, "date": ("date", "str")}[target]
+
+    def rule(types: List[str], args: List[Node]) -> str:
+        if types[0] not in allowed and types[0] != "null":
+            raise ValueError(f"cannot convert {types[0]} to {target}")
+        if len(args) > 1:
+            _expect(types[0], "str")(types, args)
+            _constants(1)(types, args)
+        return target
+    return rule
+
+
+def _cast(target: str) -> Callable[[List[Vector], List[str]], Vector]:
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        source, values, nulls = types[0], args[0].values, args[0].nulls
+        if source == target or source == "null":
+            return args[0]
+        if target == "str":
+            return Vector(_on_values(values, lambda v: _format_text(v, source)) if _is_array(values)
+                          else _format_text(values, source), nulls)
+        if source == "str":
+            fmt = str(args[1].values) if len(args) > 1 else None
+            if isinstance(values, DictionaryArray):
+                converted, converted_nulls, _ = convert_column(values.dictionary, target, fmt)
+                return Vector(converted[values.codes], nulls | converted_nulls[values.codes])
+            converted, converted_nulls, _ = convert_column(np.atleast_1d(values), target, fmt)
+            if not _is_array(values):
+                return Vector(converted[0], nulls | bool(converted_nulls[0]))
+            return Vector(converted, nulls | converted_nulls)
+        if target == "float":
+            return Vector(np.asarray(values).astype(np.float64) if _is_array(values) else np.float64(values), nulls)
+        # float -> int truncates; non-finite values become null
+        finite = np.isfinite(values) if source == "float" else np.True_
+        truncated = np.where(finite, np.trunc(values) if source == "float" else values, 0).astype(np.int64)
+        return Vector(truncated if _is_array(values) else np.int64(truncated), nulls | ~finite)
+    return evaluate
+
+
+# -- dates --------------------------------------------------------------------
+
+def _date_part(function: Callable[[np.ndarray], np.ndarray]) -> Callable[[List[Vector], List[str]], Vector]:
+    def evaluate(args: List[Vector], types: List[str]) -> Vector:
+        values = np.asarray(args[0].values, dtype="datetime64[D]")
+        with np.errstate(invalid="ignore"):
+            return Vector(np.asarray(function(values)).astype(np.int64), args[0].nulls)
+    return evaluate
+
+
+def _months(values: np.ndarray) -> np.ndarray:
+    return values.astype("datetime64[M]")
+
+
+def _add_months(args: List[Vector], types: List[str]) -> Vector:
+    dates = np.asarray(args[0].values, dtype="datetime64[D]")
+    target = _months(dates) + np.asarray(args[1].values).astype("timedelta64[M]")
+    month_start = target.astype("datetime64[D]")
+    month_days = (target + 1).astype("datetime64[D]") - month_start
+    # The day of month is kept, clamped to the length of the target month
+    offset = np.minimum(dates - _months(dates).astype("datetime64[D]"), month_days - 1)
+    return Vector(month_start + offset, _nulls_any(*args))
+
+
+def _days_between(args: List[Vector], types: List[str]) -> Vector:
+    start, end = (np.asarray(arg.values, dtype="datetime64[D]") for arg in args)
+    return Vector((end - start).astype(np.int64), _nulls_any(*args))
+
+
+_FUNCTIONS: Dict[str, Function] = {
+    "+": Function(2, 2, _add_type, _add),
+    "-": Function(2, 2, _sub_type, _sub),
+    "*": Function(2, 2, lambda t, a: _numeric(t), _strict(np.multiply)),
+    "/": Function(2, 2, _float, _divide),
+    "%": Function(2, 2, lambda t, a: _numeric(t), _modulo),
+    "neg": Function(1, 1, lambda t, a: _numeric(t), _strict(np.negative)),
+    "||": Function(2, 2, _typed("str"), _concat_operator),
+    **{op: Function(2, 2, _comparable, _comparison(op)) for op in _COMPARISONS},
+    "and": Function(2, 2, _typed("bool", _expect("bool")), _and),
+    "or": Function(2, 2, _typed("bool", _expect("bool")), _or),
+    "not": Function(1, 1, _typed("bool", _expect("bool")), _not),
+    "in": Function(2, None, _member_type, _member),
+    "is_null": Function(1, 1, _typed("bool"), _is_null),
+    "is_not_null": Function(1, 1, _typed("bool"), _is_not_null),
+    "if": Function(3, 3, _if_type, _if),
+    "coalesce": Function(1, None, _coalesce_type, _coalesce),
+    "least": Function(1, None, _ordered_type, _extreme(np.minimum)),
+    "greatest": Function(1, None, _ordered_type, _extreme(np.maximum)),
+    "abs": Function(1, 1, lambda t, a: _numeric(t), _strict(np.abs)),
+    "round": Function(1, 2, lambda t, a: _typed(_numeric(t[:1]), _expect("int|float", "int"), _constants(1))(t, a),
+                      _round),
+    "floor": Function(1, 1, lambda t, a: _numeric(t), _rounding(np.floor)),
+    "ceil": Function(1, 1, lambda t, a: _numeric(t), _rounding(np.ceil)),
+    "power": Function(2, 2, _float, _strict(lambda x, y: np.power(np.float64(x), y))),
+    "upper": Function(1, 1, _typed("str", _expect("str")), _text_function(np.char.upper)),
+    "lower": Function(1, 1, _typed("str", _expect("str")), _text_function(np.char.lower)),
+    "trim": Function(1, 1, _typed("str", _expect("str")), _text_function(np.char.strip)),
+    "ltrim": Function(1, 1, _typed("str", _expect("str")), _text_function(np.char.lstrip)),
+    "rtrim": Function(1, 1, _typed("str", _expect("str")), _text_function(np.char.rstrip)),
+    "substr": Function(2, 3, _typed("str", _expect("str", "int"), _constants(1, 2)), _text_function(_substr)),
+    "left": Function(2, 2, _typed("str", _expect("str", "int"), _constants(1)),
+                     _text_function(lambda text, count: _substr(text, 1, count))),
+    "right": Function(2, 2, _typed("str", _expect("str", "int"), _constants(1)), _text_function(_right)),
+    "replace": Function(3, 3, _typed("str", _expect("str"), _constants(1, 2)), _text_function(np.char.replace)),
+    "length": Function(1, 1, _typed("int", _expect("str")), _length),
+    "startswith": Function(2, 2, _typed("bool", _expect("str"), _constants(1)), _predicate(np.char.startswith)),
+    "endswith": Function(2, 2, _typed("bool", _expect("str"), _constants(1)), _predicate(np.char.endswith)),
+    "contains": Function(2, 2, _typed("bool", _expect("str"), _constants(1)),
+                         _predicate(lambda text, part: np.char.find(text, part) >= 0)),
+    "concat": Function(1, None, _typed("str"), _concat),
+    "int": Function(1, 1, _cast_type("int"), _cast("int")),
+    "float": Function(1, 1, _cast_type("float"), _cast("float")),
+    "str": Function(1, 1, _cast_type("str"), _cast("str")),
+    "date": Function(1, 2, _cast_type("date"), _cast("date")),
+    "year": Function(1, 1, _typed("int", _expect("date")),
+                     _date_part(lambda d: d.astype("datetime64[Y]").astype(np.int64) + 1970)),
+    "month": Function(1, 1, _typed("int", _expect("date")),
+                      _date_part(lambda d: d.astype("datetime64[M]").astype(np.int64) % 12 + 1)),
+    "day": Function(1, 1, _typed("int", _expect("date")),
+                    _date_part(lambda d: (d - d.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64) + 1)),
+    # Monday is 0; 1970-01-01 was a Thursday
+    "weekday": Function(1, 1, _typed("int", _expect("date")), _date_part(lambda d: (d.astype(np.int64) + 3) % 7)),
+    "add_days": Function(2, 2, _typed("date", _expect("date", "int")),
+                         _strict(lambda d, n: d + _days(n))),
+    "add_months": Function(2, 2, _typed("date", _expect("date", "int")), _add_months),
+    "days_between": Function(2, 2, _typed("int", _expect("date")), _days_between),
+    "month_start": Function(1, 1, _typed("date", _expect("date")),
+                            _strict(lambda d: _months(d).astype("datetime64[D]"))),
+    "month_end": Function(1, 1, _typed("date", _expect("date")),
+                          _strict(lambda d: (_months(d) + 1).astype("datetime64[D]") - np.timedelta64(1, "D"))),
+}
+
+
+def _literal_value(value: Any, value_type: str):
+    if value_type == "date":
+        return np.datetime64(value, "D")
+    return _DTYPES[value_type](value)
+
+
+class Compiler:
+    """Turns syntax trees into typed nodes of one shared graph.
+
+    Nodes are hash-consed: building an operation that already exists returns
+    the existing node, so a subexpression repeated within or across
+    expressions is evaluated once per chunk. Operations whose arguments are
+    all constants are evaluated at compile time.
+    """
+
+    def __init__(self, schema: Dict[str, str], variables: Optional[Dict[str, Any]] = None):
+        self.schema = dict(schema)
+        self.variables = variables or {}
+        self.nodes: Dict[tuple, Node] = {}
+        # Derived names resolve to the node that computes them
+        self.aliases: Dict[str, Node] = {}
+        self.folded = 0
+
+    def intern(self, op: str, args: Tuple[Node, ...], value: Any, node_type: str) -> Node:
+        if op == "literal":
+            key = (op, node_type, repr(value.item() if isinstance(value, np.generic) else value))
+        elif op == "null":
+            key = (op, node_type)
+        elif op == "column":
+            key = (op, value, node_type)
+        else:
+            key = (op, tuple(id(arg) for arg in args), node_type)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = Node(op, args, value, node_type)
+        return node
+
+    def literal(self, value: Any, value_type: str) -> Node:
+        if value is None:
+            # A null constant carries the fill value of its type so it combines with typed columns
+            return self.intern("null", (), _FILL[value_type], value_type)
+        return self.intern("literal", (), _literal_value(value, value_type), value_type)
+
+    def define(self, name: str, node: Node) -> None:
+        self.aliases[name] = node
+
+    def compile(self, text: str) -> Node:
+        tree = parse(text)
+        try:
+            return self.build(tree)
+        except ValueError as e:
+            raise ValueError(f"{e} in '{text}'") from None
+
+    def build(self, tree: tuple) -> Node:
+        kind = tree[0]
+        if kind == "literal":
+            return self.literal(tree[1], tree[2])
+        if kind == "column":
+            name = tree[1]
+            if name in self.aliases:
+                return self.aliases[name]
+            if name not in self.schema:
+                raise ValueError(f"unknown column '{name}'")
+            return self.intern("column", (), name, self.schema[name])
+        if kind == "variable":
+            if tree[1] not in self.variables:
+                raise ValueError(f"unknown variable '${tree[1]}'")
+            value = self.variables[tree[1]]
+            return self.literal(value, _python_type(value))
+        name, arg_trees = tree[1], tree[2]
+        function = _FUNCTIONS.get(name)
+        if function is None:
+            raise ValueError(f"unknown function '{name}'")
+        if len(arg_trees) < function.min_args or (function.max_args is not None and len(arg_trees) > function.max_args):
+            raise ValueError(f"wrong number of arguments for '{name}'")
+        args = [self.build(arg) for arg in arg_trees]
+        args = self.coerce_dates(name, args)
+        try:
+            result_type = function.result_type([arg.type for arg in args], args)
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}") from None
+        if name not in _NULL_AWARE and any(arg.op == "null" for arg in args):
+            self.folded += 1
+            return self.literal(None, result_type)
+        if name in ("if", "coalesce"):
+            first = 1 if name == "if" else 0
+            args = args[:first] + [self.literal(None, result_type) if arg.op == "null" else arg for arg in args[first:]]
+        if name in _COMMUTATIVE:
+            args = sorted(args, key=id)
+        node = self.intern(name, tuple(args), None, result_type)
+        if all(arg.is_constant for arg in args):
+            return self.fold(node)
+        return node
+
+    def coerce_dates(self, name: str, args: List[Node]) -> List[Node]:
+        """Text constants compared with or combined with dates are read as ISO dates."""
+        if name not in ("in", "if", "coalesce", "least", "greatest", "days_between", *_COMPARISONS):
+            return args
+        if not any(arg.type == "date" for arg in args):
+            return args
+        coerced = []
+        for arg in args:
+            if arg.op == "literal" and arg.type == "str":
+                try:
+                    arg = self.literal(str(arg.value), "date")
+                except ValueError:
+                    raise ValueError(f"'{arg.value}' is not a date (YYYY-MM-DD)") from None
+            coerced.append(arg)
+        return coerced
+
+    def fold(self, node: Node) -> Node:
+        result = evaluate_node(node, [arg.constant() for arg in node.args])
+        self.folded += 1
+        if np.any(result.nulls) or node.type == "null":
+            return self.literal(None, node.type)
+        values = result.values
+        if isinstance(values, DictionaryArray):
+            values = values.decode()
+        if isinstance(values, np.ndarray):
+            values = values.reshape(-1)[0]
+        return self.literal(values, node.type)
+
+
+def _python_type(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, np.datetime64) or hasattr(value, "isoformat"):
+        return "date"
+    return "str"
+
+
+def evaluate_node(node: Node, args: List[Vector]) -> Vector:
+    return _FUNCTIONS[node.op].evaluate(args, [arg.type for arg in node.args])
+
+
+# ---------------------------------------------------------------------------
+# Programs
+# ---------------------------------------------------------------------------
+
+def reachable_nodes(roots: List[Node]) -> List[Node]:
+    """Nodes needed by ``roots`` in evaluation order, each once."""
+    order: List[Node] = []
+    seen = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in seen:
+            continue
+        if expanded:
+            seen.add(id(node))
+            order.append(node)
+            continue
+        stack.append((node, True))
+        stack.extend((arg, False) for arg in reversed(node.args) if id(arg) not in seen)
+    return order
+
+
+def take_vector(vector: Vector, rows: np.ndarray) -> Vector:
+    values = vector.values[rows] if _is_array(vector.values) else vector.values
+    nulls = vector.nulls[rows] if isinstance(vector.nulls, np.ndarray) else vector.nulls
+    return Vector(values, nulls)
+
+
+def _materialise(vector: Vector, column_type: str, num_rows: int) -> Tuple[Any, np.ndarray]:
+    """Full-length column values and null mask of an output, with the type's fill value in null rows."""
+    values, nulls = vector.values, np.broadcast_to(np.asarray(vector.nulls, dtype=bool), (num_rows,)).copy()
+    if column_type == "null":
+        return DictionaryArray(np.zeros(num_rows, dtype=np.uint8), np.array([""])), np.ones(num_rows, dtype=bool)
+    if column_type == "str":
+        if not _is_array(values):
+            return DictionaryArray(np.zeros(num_rows, dtype=np.uint8), np.array([str(values)])), nulls
+        return maybe_dictionary_encode(values), nulls
+    values = np.broadcast_to(values, (num_rows,)).copy() if not _is_array(values) or values.shape != (num_rows,) \
+        else values
+    if column_type in ("int", "float"):
+        values = values.astype(_DTYPES[column_type], copy=False)
+    if nulls.any() and column_type in ("float", "date"):
+        values = values.copy()
+        values[nulls] = _FILL[column_type]
+    return values, nulls
+
+
+class ExpressionProgram:
+    """Derived columns and filters compiled into one graph of vectorized operations.
+
+    ``apply`` evaluates every distinct node once per chunk in dependency
+    order and releases intermediate results after their last use. Filters are
+    evaluated first and the remaining nodes only run on the rows they keep.
+    """
+
+    def __init__(self, input_schema: Dict[str, str], outputs: List[Tuple[str, Node]], filters: List[Node],
+                 folded: int):
+        self.input_schema = input_schema
+        self.outputs = outputs
+        self.filter = None
+        for node in filters:
+            self.filter = node if self.filter is None else self._and(self.filter, node)
+        self.schema = {**input_schema, **{name: ("str" if node.type == "null" else node.type) for name, node in outputs}}
+        self.filter_order = reachable_nodes([self.filter]) if self.filter is not None else []
+        filtered = {id(node) for node in self.filter_order}
+        self.output_order = [node for node in reachable_nodes([node for _, node in outputs]) if id(node) not in filtered]
+        self.folded = folded
+        self.input_columns = sorted({node.value for node in self.filter_order + self.output_order if node.op == "column"})
+        self._releases = self._release_points()
+
+    @staticmethod
+    def _and(left: Node, right: Node) -> Node:
+        return Node("and", (left, right), None, "bool")
+
+    def _release_points(self) -> Dict[int, List[int]]:
+        """Position in evaluation order after which each intermediate result is no longer needed."""
+        last_use: Dict[int, int] = {}
+        for position, node in enumerate(self.filter_order + self.output_order):
+            for arg in node.args:
+                last_use[id(arg)] = position
+        keep = {id(node) for _, node in self.outputs}
+        if self.filter is not None:
+            keep.add(id(self.filter))
+        releases: Dict[int, List[int]] = {}
+        for key, position in last_use.items():
+            if key not in keep:
+                releases.setdefault(position, []).append(key)
+        return releases
+
+    def describe(self) -> Dict[str, int]:
+        return {"outputs": len(self.outputs), "nodes": len(self.filter_order) + len(self.output_order),
+                "constants_folded": self.folded}
+
+    def _run(self, nodes: List[Node], start: int, values: Dict[int, Vector], columns: Dict[str, Vector]) -> None:
+        for offset, node in enumerate(nodes):
+            if node.op == "column":
+                values[id(node)] = columns[node.value]
+            elif node.is_constant:
+                values[id(node)] = node.constant()
+            else:
+                values[id(node)] = evaluate_node(node, [values[id(arg)] for arg in node.args])
+            for key in self._releases.get(start + offset, ()):
+                values.pop(key, None)
+
+    def evaluate(self, columns: Dict[str, Vector], num_rows: int) -> Tuple[Dict[str, Vector], Optional[np.ndarray]]:
+        """Output vectors and, when the program filters, the boolean mask of kept input rows."""
+        values: Dict[int, Vector] = {}
+        keep = None
+        if self.filter is not None:
+            self._run(self.filter_order, 0, values, columns)
+            result = values[id(self.filter)]
+            keep = np.broadcast_to(np.asarray(result.values & ~result.nulls, dtype=bool), (num_rows,))
+            if not keep.all():
+                rows = np.flatnonzero(keep)
+                columns = {name: take_vector(vector, rows) for name, vector in columns.items()}
+                values = {key: take_vector(vector, rows) for key, vector in values.items()}
+        self._run(self.output_order, len(self.filter_order), values, columns)
+        return {name: values[id(node)] for name, node in self.outputs}, keep
+
+    def apply(self, chunk: Chunk) -> Chunk:
+        """Evaluate on a chunk: the rows kept by the filters, input columns followed by derived columns."""
+        num_rows = chunk.num_rows
+        columns = {name: Vector(chunk.columns[name], chunk.nulls.get(name, np.False_)) for name in self.input_columns}
+        outputs, keep = self.evaluate(columns, num_rows)
+        if keep is not None and not keep.all():
+            chunk = chunk.take(keep)
+        num_rows = chunk.num_rows
+        result_columns, nulls, invalid = dict(chunk.columns), dict(chunk.nulls), dict(chunk.invalid)
+        for name, vector in outputs.items():
+            result_columns[name], mask = _materialise(vector, self.schema[name], num_rows)
+            invalid.pop(name, None)
+            if mask.any():
+                nulls[name] = mask
+            else:
+                nulls.pop(name, None)
+        return Chunk(result_columns, chunk.row_offset, nulls, invalid)
+
+
+def program_hash(expressions: List[Tuple[str, str]], filters: List[str], schema: Dict[str, str],
+                 variables: Optional[Dict[str, Any]] = None) -> str:
+    document = {"expressions": expressions, "filters": filters, "schema": schema,
+                "variables": {name: str(value) for name, value in (variables or {}).items()}}
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+
+def compile_program(expressions: List[Tuple[str, str]], filters: List[str], schema: Dict[str, str],
+                    variables: Optional[Dict[str, Any]] = None) -> ExpressionProgram:
+    """Compile ``(name, expression)`` pairs and filter expressions against ``schema``.
+
+    Expressions see the input columns and the columns derived before them;
+    a derived name equal to an input column replaces it. Compiled programs
+    are cached by a hash of their text, schema and variables.
+    """
+    key = program_hash(expressions, filters, schema, variables)
+    program = _program_cache.get(key)
+    if program is not None:
+        return program
+    compiler = Compiler(schema, variables)
+    outputs: Dict[str, Node] = {}
+    for name, text in expressions:
+        node = compiler.compile(text)
+        compiler.define(name, node)
+        outputs[name] = node
+    predicates = []
+    for text in filters:
+        node = compiler.compile(text)
+        if node.type not in ("bool", "null"):
+            raise ValueError(f"filter must be a condition, got {node.type} in '{text}'")
+        predicates.append(node)
+    program = ExpressionProgram(dict(schema), list(outputs.items()), predicates, compiler.folded)
+    _program_cache.put(key, program)
+    return program
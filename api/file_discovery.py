@@ -0,0 +1,358 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_WORKERS = int(os.environ.get("FILE_DISCOVERY_WORKERS", "16"))
+LISTING_CACHE_MAX_DIRS = int(os.environ.get("FILE_DISCOVERY_CACHE_DIRS", "20000"))
+# Paths modified this close to a search are re-checked by listing; guards against coarse filesystem mtimes
+RESOLUTION_CACHE_MTIME_SLACK_MS = int(os.environ.get("RESOLUTION_CACHE_MTIME_SLACK_MS", "2000"))
+# Resolutions kept in memory; keys include the run date, so older days fall out as new ones come in
+RESOLUTION_CACHE_MAX_KEYS = int(os.environ.get("RESOLUTION_CACHE_KEYS", "1024"))
+
+_DATE_TOKEN = re.compile(r"\{date(?::([^}]*))?\}")
+_WILDCARDS = re.compile(r"[*?\[]")
+
+
+class DirEntry(NamedTuple):
+    name: str
+    is_dir: bool
+
+
+class FoundFile(NamedTuple):
+    path: str
+    relative_path: str
+    size: int
+    mtime_ns: int
+
+
+class _Segment:
+    """One path component of a search pattern, e.g. ``trades_20240102_*.csv``."""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.is_recursive = pattern == "**"
+        self.has_wildcards = bool(_WILDCARDS.search(pattern))
+        # Literal prefix lets most non-matching names be rejected with str.startswith
+        match = _WILDCARDS.search(pattern)
+        self.prefix = pattern[:match.start()] if match else pattern
+        self._regex = re.compile(fnmatch.translate(pattern))
+
+    def matches(self, name: str) -> bool:
+        if not name.startswith(self.prefix):
+            return False
+        if not self.has_wildcards:
+            return name == self.pattern
+        return self._regex.match(name) is not None
+
+
+class SearchPattern:
+    """A compiled, date-resolved glob pattern relative to a search root.
+
+    ``{date}`` expands to ``expectedRunDate`` as YYYYMMDD and ``{date:<strftime>}``
+    to any other format; ``**`` matches any number of directories.
+    """
+
+    def __init__(self, pattern: str, run_date: Optional[str] = None):
+        self.source = pattern
+        self.resolved = resolve_date_tokens(pattern, run_date)
+        parts = [part for part in self.resolved.replace("\\", "/").split("/") if part and part != "."]
+        self.segments = [_Segment(part) for part in parts] or [_Segment("*")]
+        self.last = len(self.segments) - 1
+
+    def closure(self, states: FrozenSet[int]) -> FrozenSet[int]:
+        expanded: Set[int] = set(states)
+        for state in sorted(states):
+            index = state
+            while index <= self.last and self.segments[index].is_recursive:
+                index += 1
+                expanded.add(index)
+        return frozenset(state for state in expanded if state <= self.last)
+
+    def descend(self, states: FrozenSet[int], dir_name: str) -> FrozenSet[int]:
+        """States after entering ``dir_name``; empty means the directory is pruned."""
+        next_states: Set[int] = set()
+        for state in states:
+            segment = self.segments[state]
+            if segment.is_recursive:
+                next_states.add(state)
+            elif state < self.last and segment.matches(dir_name):
+                next_states.add(state + 1)
+        return self.closure(frozenset(next_states))
+
+    def matches_file(self, states: FrozenSet[int], file_name: str) -> bool:
+        return any(state == self.last and self.segments[state].matches(file_name) for state in states)
+
+
+def resolve_date_tokens(pattern: str, run_date: Optional[str]) -> str:
+    if not _DATE_TOKEN.search(pattern):
+        return pattern
+    if not run_date:
+        raise ValueError(f"Pattern {pattern} uses {{date}} but no expectedRunDate was given")
+    parsed = parse_run_date(run_date)
+    return _DATE_TOKEN.sub(lambda m: parsed.strftime(m.group(1) or "%Y%m%d"), pattern)
+
+
+def parse_run_date(run_date: str) -> datetime:
+    for fmt in ("%Y-%m-%d", "%Y%m%d", "%d/%m/%Y", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%fZ"):
+        try:
+            return datetime.strptime(run_date, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised expectedRunDate format: {run_date}")
+
+
+class ListingCache:
+    """Directory listings keyed by path and invalidated when the directory mtime changes."""
+
+    def __init__(self, max_dirs: int = LISTING_CACHE_MAX_DIRS):
+        self.max_dirs = max_dirs
+        self._entries: "OrderedDict[str, Tuple[int, List[DirEntry]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def list_dir(self, path: str) -> List[DirEntry]:
+        dir_mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == dir_mtime:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+        listing = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                listing.append(DirEntry(entry.name, is_dir))
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (dir_mtime, listing)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_dirs:
+                self._entries.popitem(last=False)
+        return listing
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cached_dirs": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+listing_cache = ListingCache()
+
+
+def discover_files(root: str, pattern: str, run_date: Optional[str] = None,
+                   max_workers: int = DISCOVERY_WORKERS, cache: Optional[ListingCache] = None,
+                   scanned: Optional[Dict[str, int]] = None) -> List[FoundFile]:
+    """Find the files under ``root`` matching ``pattern``.
+
+    Directories are scanned concurrently (``os.scandir`` releases the GIL,
+    which matters most on network mounts) and subtrees that can no longer
+    match the pattern are never entered. ``scanned``, when given, receives
+    the mtime of every directory listed, taken before it was listed.
+    """
+    cache = cache or listing_cache
+    compiled = SearchPattern(pattern, run_date)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Search root {root} does not exist")
+
+    def scan(dir_path: str, rel_dir: str, states: FrozenSet[int]):
+        files = []
+        children = []
+        try:
+            if scanned is not None:
+                scanned[dir_path] = os.stat(dir_path).st_mtime_ns
+            listing = cache.list_dir(dir_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return files, children
+        except OSError as e:
+            # One unreadable directory (e.g. no permission) must not abort the whole search
+            logger.warning(f"⚠️ Skipping unreadable directory {dir_path}: {e}")
+            if scanned is not None:
+                # Never matches a real mtime, so a cached resolution that skipped it is always searched again
+                scanned[dir_path] = -1
+            return files, children
+        for entry in listing:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_dir:
+                child_states = compiled.descend(states, entry.name)
+                if child_states:
+                    children.append((os.path.join(dir_path, entry.name), rel_path, child_states))
+            elif compiled.matches_file(states, entry.name):
+                # Only matched files are stat'ed, never the whole landing directory
+                path = os.path.join(dir_path, entry.name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning(f"⚠️ Skipping unreadable file {path}: {e}")
+                    continue
+                files.append(FoundFile(path, rel_path, st.st_size, st.st_mtime_ns))
+        return files, children
+
+    found: List[FoundFile] = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(scan, root, "", compiled.closure(frozenset([0])))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, children = future.result()
+                found.extend(files)
+                for child in children:
+                    pending.add(pool.submit(scan, *child))
+    found.sort(key=lambda f: f.relative_path)
+    logger.info(f"🔎 Found {len(found)} files for {compiled.resolved} under {root} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return found
+
+
+def describe_files(files: List[FoundFile]) -> List[Dict[str, Any]]:
+    return [file._asdict() for file in files]
+
+
+class ResolutionCache:
+    """Resolved file sets of named patterns, shared by every instance through JSON files under a cache directory.
+
+    An entry records the mtime of every directory its search listed and of
+    every file it found. It stays valid while all of them are unchanged: a
+    file added, removed or renamed changes its directory's mtime, and a
+    rewritten file its own. Checking an entry stats those paths instead of
+    listing directories. Mtimes within ``RESOLUTION_CACHE_MTIME_SLACK_MS``
+    of the search are not trusted, as a change in the same clock tick would
+    go unseen. Concurrent resolutions of one key in a process wait for a
+    single search. At most ``max_keys`` entries are held in memory, least
+    recently used first out; a key's lock lives only while it is in use.
+    """
+
+    def __init__(self, max_keys: int = RESOLUTION_CACHE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(root: str, patterns: Dict[str, str], run_date: Optional[str], scope: Dict[str, Any]) -> str:
+        document = {"root": os.path.abspath(root), "patterns": patterns, "run_date": run_date, **scope}
+        return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+    def resolve(self, root: str, patterns: Dict[str, str], run_date: Optional[str], cache_dir: str,
+                scope: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, List[FoundFile]], str]:
+        """The files of every named pattern under ``root`` and where they came from: memory, disk or scan."""
+        key = self.cache_key(root, patterns, run_date, scope or {})
+        path = os.path.join(cache_dir, f"{key}.json")
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+            self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            with key_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                source = "memory"
+                if entry is None or not self._is_valid(entry):
+                    entry, source = self._load(path), "disk"
+                    if entry is None or not self._is_valid(entry):
+                        entry, source = self._scan(root, patterns, run_date), "scan"
+                        self._save(path, entry)
+                with self._lock:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_keys:
+                        self._entries.popitem(last=False)
+                    if source == "memory":
+                        self.hits += 1
+                    elif source == "disk":
+                        self.disk_hits += 1
+                    else:
+                        self.misses += 1
+        finally:
+            with self._lock:
+                self._lock_users[key] -= 1
+                if not self._lock_users[key]:
+                    del self._lock_users[key], self._locks[key]
+        return {name: [FoundFile(**found) for found in files] for name, files in entry["files"].items()}, source
+
+    @staticmethod
+    def _scan(root: str, patterns: Dict[str, str], run_date: Optional[str]) -> Dict[str, Any]:
+        started_ns = time.time_ns()
+        scanned: Dict[str, int] = {}
+        files = {name: discover_files(root, pattern, run_date, scanned=scanned) for name, pattern in patterns.items()}
+        return {"scanned_at_ns": started_ns, "dirs": scanned,
+                "files": {name: describe_files(found) for name, found in files.items()}}
+
+    @staticmethod
+    def _is_valid(entry: Dict[str, Any]) -> bool:
+        trusted_before = entry["scanned_at_ns"] - RESOLUTION_CACHE_MTIME_SLACK_MS * 1_000_000
+        paths = list(entry["dirs"].items())
+        paths += [(found["path"], found["mtime_ns"]) for files in entry["files"].values() for found in files]
+        try:
+            for path, mtime_ns in paths:
+                if mtime_ns >= trusted_before or os.stat(path).st_mtime_ns != mtime_ns:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _load(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable resolution cache entry {path}: {e}")
+            return None
+
+    @staticmethod
+    def _save(path: str, entry: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cached_keys": len(self._entries), "hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+resolution_cache = ResolutionCache()
+
+
+def cleanup_resolution_cache(cache_dir: str, max_age_seconds: float, now: Optional[float] = None) -> int:
+    """Remove cached resolutions written more than ``max_age_seconds`` ago; a later run of their date searches again."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    now = time.time() if now is None else now
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if now - os.path.getmtime(path) >= max_age_seconds:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logger.info(f"🧹 Removed {removed} cached file resolutions from {cache_dir}")
+    return removed
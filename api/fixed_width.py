@@ -0,0 +1,389 @@
+import codecs
+import functools
+import mmap
+import re
+import traceback
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from columnar import Chunk, maybe_dictionary_encode
+
+_SPACE = ord(" ")
+_MINUS = ord("-")
+_PLUS = ord("+")
+_POINT = ord(".")
+
+# Byte -> digit value, for ordinary positions and for the last position of a
+# zoned-decimal field where the sign is "overpunched" onto the final digit
+_DIGIT_VALUE = np.zeros(256, dtype=np.int64)
+_IS_DIGIT = np.zeros(256, dtype=bool)
+_OVERPUNCH_VALUE = np.zeros(256, dtype=np.int64)
+_IS_OVERPUNCH_DIGIT = np.zeros(256, dtype=bool)
+_IS_OVERPUNCH_NEGATIVE = np.zeros(256, dtype=bool)
+for _digit in range(10):
+    _DIGIT_VALUE[48 + _digit] = _digit
+    _IS_DIGIT[48 + _digit] = True
+    _OVERPUNCH_VALUE[48 + _digit] = _digit
+    _IS_OVERPUNCH_DIGIT[48 + _digit] = True
+for _digit, (_positive, _negative) in enumerate(zip("{ABCDEFGHI", "}JKLMNOPQR")):
+    _OVERPUNCH_VALUE[ord(_positive)] = _digit
+    _IS_OVERPUNCH_DIGIT[ord(_positive)] = True
+    _OVERPUNCH_VALUE[ord(_negative)] = _digit
+    _IS_OVERPUNCH_DIGIT[ord(_negative)] = True
+    _IS_OVERPUNCH_NEGATIVE[ord(_negative)] = True
+
+_POW10 = 10 ** np.arange(19, dtype=np.int64)
+_DATE_TOKENS = {"%Y": 4, "%m": 2, "%d": 2, "%y": 2}
+# Trailing bytes stripped from text fields: NUL and ASCII whitespace
+_IS_BLANK = np.zeros(0x21, dtype=bool)
+_IS_BLANK[[0x00, 0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x1C, 0x1D, 0x1E, 0x1F, 0x20]] = True
+_TRUE_BYTES = np.array([ord(c) for c in "YyTt1"], dtype=np.uint8)
+_FALSE_BYTES = np.array([ord(c) for c in "NnFf0"], dtype=np.uint8)
+
+
+def detect_record_length(mm, spec) -> int:
+    if spec.record_length:
+        return spec.record_length
+    newline = mm.find(b"\n")
+    if newline < 0:
+        raise ValueError("record_length must be configured for fixed-width files without line terminators")
+    return newline + 1
+
+
+def parse_integer_field(field: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Parse right- or left-justified digits (with optional sign, decimal point or overpunch).
+
+    ``field`` is an ``(rows, width)`` uint8 view. Returns the unscaled integer
+    values, the number of digits after a decimal point, a null mask (blank
+    fields) and an invalid mask. The loop runs over the field's byte positions
+    (Horner's rule), each step being a whole-column operation over all rows.
+    A sign is accepted once, either before the first digit or as the last
+    non-blank byte; blanks inside the number make the row invalid.
+    """
+    rows, width = field.shape
+    values = np.zeros(rows, dtype=np.int64)
+    digit_count = np.zeros(rows, dtype=np.int32)
+    fraction_digits = np.zeros(rows, dtype=np.int32)
+    point_count = np.zeros(rows, dtype=np.int32)
+    seen_point = np.zeros(rows, dtype=bool)
+    negative = np.zeros(rows, dtype=bool)
+    unexpected = np.zeros(rows, dtype=bool)
+    nulls = np.ones(rows, dtype=bool)
+    started = np.zeros(rows, dtype=bool)  # a non-blank byte has been seen
+    ended = np.zeros(rows, dtype=bool)  # a blank followed the number
+    signed = np.zeros(rows, dtype=bool)
+    closed = np.zeros(rows, dtype=bool)  # a sign followed the digits
+    # One transposing copy makes every byte position a contiguous vector
+    positions = np.ascontiguousarray(field.T)
+    for position in range(width):
+        byte = positions[position]
+        if position == width - 1:
+            is_digit = _IS_OVERPUNCH_DIGIT[byte]
+            digit = _OVERPUNCH_VALUE[byte]
+            negative |= _IS_OVERPUNCH_NEGATIVE[byte]
+            # An overpunched sign cannot be combined with an explicit one
+            unexpected |= signed & is_digit & ~_IS_DIGIT[byte]
+        else:
+            is_digit = _IS_DIGIT[byte]
+            digit = _DIGIT_VALUE[byte]
+        values = np.where(is_digit, values * 10 + digit, values)
+        digit_count += is_digit
+        fraction_digits += is_digit & seen_point
+        is_point = byte == _POINT
+        seen_point |= is_point
+        point_count += is_point
+        is_space = byte == _SPACE
+        is_minus = byte == _MINUS
+        is_sign = is_minus | (byte == _PLUS)
+        negative |= is_minus
+        nulls &= is_space
+        unexpected |= ~(is_digit | is_space | is_sign | is_point)
+        # Nothing but blanks may follow a trailing blank or a trailing sign, and only one sign is allowed
+        unexpected |= ~is_space & (ended | closed)
+        unexpected |= is_sign & signed
+        closed |= is_sign & ((digit_count > 0) | seen_point)
+        signed |= is_sign
+        ended |= is_space & started
+        started |= ~is_space
+    values = np.where(negative, -values, values)
+    invalid = ~nulls & (unexpected | (digit_count == 0) | (point_count > 1) | (digit_count > 18))
+    return values, fraction_digits, nulls, invalid
+
+
+@functools.lru_cache(maxsize=None)
+def single_byte_table(encoding: str) -> Optional[np.ndarray]:
+    """Code point of every byte for a single-byte encoding (U+FFFD where undefined).
+
+    Returns None for multi-byte encodings, recognised by an incremental
+    decoder holding back a lone byte as an incomplete sequence.
+    """
+    if codecs.lookup(encoding).name in ("iso8859-1", "ascii"):
+        return np.arange(256, dtype=np.uint32)
+    decoder = codecs.getincrementaldecoder(encoding)
+    table = np.empty(256, dtype=np.uint32)
+    for byte in range(256):
+        text = decoder(errors="replace").decode(bytes([byte]), final=False)
+        if len(text) != 1:
+            return None
+        table[byte] = ord(text)
+    return table
+
+
+def decode_utf8(field: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode an ``(rows, width)`` UTF-8 byte matrix into a left-aligned code point matrix.
+
+    Every byte position is classified with whole-matrix operations: a valid
+    lead byte yields its code point, the continuation bytes it consumes yield
+    nothing, and any other byte yields U+FFFD and flags its row as invalid.
+    """
+    rows, width = field.shape
+    padded = np.zeros((rows, width + 3), dtype=np.uint32)
+    padded[:, :width] = field
+    lead = padded[:, :width]
+    following = [padded[:, k:k + width] for k in (1, 2, 3)]
+    continues = [(byte & 0xC0) == 0x80 for byte in following]
+    payload = [byte & 0x3F for byte in following]
+    two = ((lead & 0xE0) == 0xC0) & continues[0]
+    three = ((lead & 0xF0) == 0xE0) & continues[0] & continues[1]
+    four = ((lead & 0xF8) == 0xF0) & continues[0] & continues[1] & continues[2]
+    code_points = np.where(lead < 0x80, lead, 0xFFFD)
+    two_point = (lead & 0x1F) << 6 | payload[0]
+    three_point = (lead & 0x0F) << 12 | payload[0] << 6 | payload[1]
+    four_point = (lead & 0x07) << 18 | payload[0] << 12 | payload[1] << 6 | payload[2]
+    # Overlong forms, surrogates and values past U+10FFFF are not valid UTF-8
+    two &= two_point >= 0x80
+    three &= (three_point >= 0x800) & ((three_point < 0xD800) | (three_point > 0xDFFF))
+    four &= (four_point >= 0x10000) & (four_point <= 0x10FFFF)
+    code_points = np.where(two, two_point, code_points)
+    code_points = np.where(three, three_point, code_points)
+    code_points = np.where(four, four_point, code_points)
+    consumed = np.zeros((rows, width + 3), dtype=bool)
+    for length, valid in ((2, two), (3, three), (4, four)):
+        for k in range(1, length):
+            consumed[:, k:k + width] |= valid
+    emitted = ~consumed[:, :width]
+    invalid = (emitted & (code_points == 0xFFFD)).any(axis=1)
+    if emitted.all():
+        return code_points, invalid
+    # Shift each row's emitted code points to the left, keeping their order
+    order = np.argsort(~emitted, axis=1, kind="stable")
+    code_points = np.take_along_axis(code_points, order, axis=1)
+    code_points[np.arange(width) >= emitted.sum(axis=1)[:, None]] = 0
+    return code_points, invalid
+
+
+def parse_string_field(field: np.ndarray, encoding: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode an ``(rows, width)`` byte view into a right-stripped unicode array.
+
+    Single-byte encodings go through a 256-entry code point table and UTF-8
+    through :func:`decode_utf8`; either way the result is a UCS-4 code point
+    matrix whose trailing blanks are zeroed (numpy drops trailing NULs) before
+    it is viewed as a unicode array, so no per-row Python strings are built.
+    Other multi-byte encodings fall back to decoding row by row. Undecodable
+    bytes become U+FFFD and their rows are flagged in the returned invalid
+    mask instead of failing the file.
+    """
+    rows, width = field.shape
+    table = single_byte_table(encoding)
+    if table is not None:
+        code_points = table[field]
+        invalid = (code_points == 0xFFFD).any(axis=1)
+    elif not (field >= 0x80).any():
+        code_points = field.astype(np.uint32)
+        invalid = np.zeros(rows, dtype=bool)
+    elif codecs.lookup(encoding).name == "utf-8":
+        code_points, invalid = decode_utf8(field)
+    else:
+        raw = np.ascontiguousarray(field).view(f"S{width}").ravel()
+        invalid = np.zeros(rows, dtype=bool)
+        decoded = []
+        for row, value in enumerate(raw.tolist()):
+            try:
+                decoded.append(value.decode(encoding))
+            except UnicodeDecodeError:
+                decoded.append(value.decode(encoding, errors="replace"))
+                invalid[row] = True
+        return np.char.rstrip(np.array(decoded, dtype=f"<U{width}")), invalid
+    # Zero every position from the last non-blank code point onwards
+    blank = (code_points <= 0x20) & _IS_BLANK[np.minimum(code_points, 0x20)]
+    kept = np.flip(np.logical_or.accumulate(np.flip(~blank, axis=1), axis=1), axis=1)
+    code_points = np.where(kept, code_points, 0).astype(np.uint32)
+    return np.ascontiguousarray(code_points).view(f"<U{width}").ravel(), invalid
+
+
+def compile_date_format(fmt: str) -> List[Tuple[str, int, int]]:
+    """Positions of %Y/%y/%m/%d within a fixed-width date format."""
+    tokens = []
+    position = 0
+    for match in re.finditer(r"%[Yymd]|%%|.", fmt):
+        token = match.group(0)
+        if token in _DATE_TOKENS:
+            tokens.append((token, position, _DATE_TOKENS[token]))
+            position += _DATE_TOKENS[token]
+        else:
+            position += 1
+    return tokens
+
+
+def parse_date_field(field: np.ndarray, fmt: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    parts: Dict[str, np.ndarray] = {}
+    invalid = np.zeros(field.shape[0], dtype=bool)
+    for token, position, width in compile_date_format(fmt):
+        sub = field[:, position:position + width]
+        invalid |= ~_IS_DIGIT[sub].all(axis=1)
+        parts[token] = (_DIGIT_VALUE[sub] * _POW10[np.arange(width - 1, -1, -1)]).sum(axis=1)
+    nulls = (field == _SPACE).all(axis=1) | (field == ord("0")).all(axis=1)
+    years = parts["%Y"] if "%Y" in parts else 2000 + parts.get("%y", np.zeros(field.shape[0], dtype=np.int64))
+    months = parts.get("%m", np.ones(field.shape[0], dtype=np.int64))
+    days = parts.get("%d", np.ones(field.shape[0], dtype=np.int64))
+    invalid |= (months < 1) | (months > 12) | (days < 1) | (days > 31)
+    invalid &= ~nulls
+    bad = nulls | invalid
+    safe_years = np.where(bad, 1970, years)
+    safe_months = np.where(bad, 1, months)
+    safe_days = np.where(bad, 1, days)
+    month_start = (safe_years - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (safe_months - 1).astype("timedelta64[M]")
+    values = month_start.astype("datetime64[D]") + (safe_days - 1).astype("timedelta64[D]")
+    # Days past the end of the month roll into the next month; treat those as invalid
+    rolled = values.astype("datetime64[M]") != month_start
+    invalid |= rolled & ~nulls
+    values[nulls | invalid] = np.datetime64("NaT")
+    return values, nulls, invalid
+
+
+def convert_field(field: np.ndarray, column, encoding: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if column.type == "str":
+        values, invalid = parse_string_field(field, encoding)
+        return maybe_dictionary_encode(values), (values == "") | invalid, invalid
+    if column.type in ("int", "float"):
+        values, fraction_digits, nulls, invalid = parse_integer_field(field)
+        if column.type == "int":
+            invalid |= (fraction_digits > 0) & ~nulls
+            values[nulls | invalid] = 0
+            return values, nulls | invalid, invalid
+        # An explicit decimal point wins over the layout's implied scale
+        has_point = (field == _POINT).any(axis=1)
+        exponent = np.where(has_point, fraction_digits, column.scale)
+        scaled = values / _POW10[np.minimum(exponent, len(_POW10) - 1)]
+        scaled[nulls | invalid] = np.nan
+        return scaled, nulls | invalid, invalid
+    if column.type == "date":
+        values, nulls, invalid = parse_date_field(field, column.format or "%Y%m%d")
+        return values, nulls | invalid, invalid
+    if column.type == "bool":
+        flag = field[:, 0]
+        values = np.isin(flag, _TRUE_BYTES)
+        nulls = (field == _SPACE).all(axis=1)
+        invalid = ~nulls & ~values & ~np.isin(flag, _FALSE_BYTES)
+        return values, nulls | invalid, invalid
+    raise ValueError(f"Unsupported column type {column.type}")
+
+
+def read_fixed_width(path: str, spec, stats, chunk_rows: int, start: int = 0, end: Optional[int] = None) -> Iterator[Chunk]:
+    """Stream a fixed-width file as typed column chunks straight from a memory map.
+
+    Records are viewed as a ``(rows, record_length)`` byte matrix over the
+    mapping; each field is a column slice of that matrix and is converted with
+    vectorized parsers, so no per-row Python strings are ever created.
+    ``start``/``end`` restrict reading to a byte range aligned to whole records.
+    Chunks hold converted copies only; the views over the mapping (including
+    those kept alive by a parse error's traceback) are released before it closes.
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            record_length = detect_record_length(mm, spec)
+            if start == 0 and spec.has_header:
+                start = record_length
+            end = size if end is None else min(end, size)
+            num_records = (end - start) // record_length
+            if (end - start) % record_length:
+                stats.malformed_rows += 1
+            buffer = np.frombuffer(mm, dtype=np.uint8, count=num_records * record_length, offset=start)
+            records = buffer.reshape(num_records, record_length)
+            window = None
+            try:
+                row_offset = 0
+                for window_start in range(0, num_records, chunk_rows):
+                    window = records[window_start:window_start + chunk_rows]
+                    chunk = records_to_chunk(window, spec, row_offset)
+                    window = None
+                    row_offset += chunk.num_rows
+                    stats.rows += chunk.num_rows
+                    stats.chunks += 1
+                    yield chunk
+            except BaseException as error:
+                # The parsers' frames in the traceback still hold field views
+                traceback.clear_frames(error.__traceback__)
+                raise
+            finally:
+                # Views must be released before the mapping can be closed
+                records = buffer = window = None
+
+
+def read_exactly(stream, size: int) -> bytes:
+    """Read ``size`` bytes unless the stream ends first; decompressors may return short reads."""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+def read_fixed_width_stream(stream, spec, stats, chunk_rows: int) -> Iterator[Chunk]:
+    """Fixed-width reader for streams that cannot be memory-mapped (e.g. decompressed extracts).
+
+    Reads ``chunk_rows`` whole records at a time into one buffer and parses
+    it with the same vectorized field parsers as the memory-mapped reader.
+    """
+    pending = b""
+    record_length = spec.record_length
+    if not record_length:
+        pending = stream.readline()
+        if not pending.endswith(b"\n"):
+            raise ValueError("record_length must be configured for fixed-width files without line terminators")
+        record_length = len(pending)
+    if spec.has_header:
+        if pending:
+            pending = b""
+        else:
+            read_exactly(stream, record_length)
+    row_offset = 0
+    while True:
+        data = pending + read_exactly(stream, chunk_rows * record_length - len(pending))
+        pending = b""
+        if not data:
+            break
+        whole = len(data) // record_length * record_length
+        if whole < len(data):
+            stats.malformed_rows += 1
+        if whole == 0:
+            break
+        records = np.frombuffer(data, dtype=np.uint8, count=whole).reshape(-1, record_length)
+        chunk = records_to_chunk(records, spec, row_offset)
+        row_offset += chunk.num_rows
+        stats.rows += chunk.num_rows
+        stats.chunks += 1
+        yield chunk
+
+
+def records_to_chunk(window: np.ndarray, spec, row_offset: int) -> Chunk:
+    columns = {}
+    nulls = {}
+    invalid = {}
+    for column in spec.columns:
+        field = window[:, column.start:column.start + column.length]
+        values, null_mask, invalid_mask = convert_field(field, column, spec.encoding)
+        columns[column.name] = values
+        if null_mask.any():
+            nulls[column.name] = null_mask
+        if invalid_mask.any():
+            invalid[column.name] = invalid_mask
+    return Chunk(columns, row_offset, nulls, invalid)
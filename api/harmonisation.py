@@ -0,0 +1,266 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from columnar import (Chunk, Dataset, DatasetWriter, DictionaryArray, convert_column, map_text,
+                      maybe_dictionary_encode, read_chunk_file, write_chunk_file)
+from config_loader import ColumnMapping, DerivedColumn, HarmonisationSpec, LRUCache
+from workers import WORKER_PROCESSES, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Smaller datasets are harmonised inline rather than across the process pool
+HARMONISATION_PARALLEL_MIN_ROWS = int(os.environ.get("HARMONISATION_PARALLEL_MIN_ROWS", "2000000"))
+
+# (spec hash) -> HarmonisationPlan
+_plan_cache = LRUCache(128)
+
+
+class Column(NamedTuple):
+    """Values of one column while a chunk moves through a plan."""
+    values: Any
+    nulls: np.ndarray
+    invalid: np.ndarray
+
+
+# A step reads the columns produced so far and returns one output column
+Step = Callable[[Dict[str, Column], int], Column]
+
+
+def translator(mapping: Dict[str, str], default: Optional[str]) -> Callable[[np.ndarray], np.ndarray]:
+    keys = np.array(sorted(mapping), dtype=str)
+    targets = np.array([mapping[key] for key in keys.tolist()], dtype=str)
+
+    def translate(values: np.ndarray) -> np.ndarray:
+        if len(keys) == 0:
+            return values if default is None else np.full(len(values), default)
+        positions = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+        found = keys[positions] == values
+        return np.where(found, targets[positions], values if default is None else default)
+
+    return translate
+
+
+def to_text(values, nulls: np.ndarray, column_type: str) -> Any:
+    if column_type == "str":
+        return values
+    if column_type in ("date", "bool"):
+        # Few distinct values: format each once and return a dictionary column
+        uniques, inverse = np.unique(values, return_inverse=True)
+        if column_type == "date":
+            text = np.where(np.isnat(uniques), "", np.datetime_as_string(uniques, unit="D"))
+        else:
+            text = np.where(uniques, "true", "false")
+        encoded = map_text(DictionaryArray(inverse.reshape(-1), uniques), lambda _: text)
+        if nulls.any():
+            return np.where(nulls, "", encoded.decode())
+        return encoded
+    return np.where(nulls, "", values.astype(str))
+
+
+_NUMERIC_CASTS = {("int", "float"), ("bool", "float"), ("float", "int"), ("bool", "int")}
+
+
+def can_cast(source_type: str, target_type: str) -> bool:
+    return source_type == target_type or "str" in (source_type, target_type) or (source_type, target_type) in _NUMERIC_CASTS
+
+
+def cast(column: Column, source_type: str, target_type: str, fmt: Optional[str]) -> Column:
+    """Convert a column between types; values that do not convert are flagged invalid and null."""
+    values, nulls, invalid = column
+    if source_type == target_type:
+        return column
+    if target_type == "str":
+        return Column(maybe_dictionary_encode(to_text(values, nulls, source_type)), nulls, invalid)
+    if source_type == "str":
+        if isinstance(values, DictionaryArray):
+            # Each distinct text value is parsed once
+            converted, converted_nulls, converted_invalid = convert_column(values.dictionary, target_type, fmt)
+            converted, converted_nulls, converted_invalid = (converted[values.codes], converted_nulls[values.codes],
+                                                             converted_invalid[values.codes])
+        else:
+            converted, converted_nulls, converted_invalid = convert_column(np.asarray(values), target_type, fmt)
+        return Column(converted, nulls | converted_nulls, invalid | (converted_invalid & ~nulls))
+    if (source_type, target_type) not in _NUMERIC_CASTS:
+        raise ValueError(f"cannot cast {source_type} to {target_type}")
+    if target_type == "float":
+        converted = values.astype(np.float64)
+        converted[nulls] = np.nan
+        return Column(converted, nulls, invalid)
+    if source_type == "float":
+        integral = np.isfinite(values) & (np.floor(values) == values)
+        bad = ~integral & ~nulls
+        return Column(np.where(integral, values, 0).astype(np.int64), nulls | bad, invalid | bad)
+    return Column(values.astype(np.int64), nulls, invalid)
+
+
+def mapping_step(mapping: ColumnMapping, source_type: str) -> Tuple[Step, str]:
+    text_functions: List[Callable[[np.ndarray], np.ndarray]] = []
+    if mapping.trim:
+        text_functions.append(np.char.strip)
+    if mapping.case == "upper":
+        text_functions.append(np.char.upper)
+    elif mapping.case == "lower":
+        text_functions.append(np.char.lower)
+    if mapping.translate or mapping.default is not None:
+        text_functions.append(translator(mapping.translate, mapping.default))
+    if text_functions and source_type != "str":
+        raise ValueError(f"column '{mapping.source}': trim, case and translate need a str column, not {source_type}")
+    target_type = mapping.type or source_type
+    if not can_cast(source_type, target_type):
+        raise ValueError(f"column '{mapping.source}': cannot cast {source_type} to {target_type}")
+
+    def step(columns: Dict[str, Column], num_rows: int) -> Column:
+        values, nulls, invalid = columns[mapping.source]
+        if text_functions:
+            def apply(text: np.ndarray) -> np.ndarray:
+                for function in text_functions:
+                    text = function(text)
+                return text
+            values = map_text(values, apply)
+            nulls = nulls | (values == "")
+        return cast(Column(values, nulls, invalid), source_type, target_type, mapping.format)
+
+    return step, target_type
+
+
+def derived_step(derived: DerivedColumn, types: Dict[str, str]) -> Tuple[Step, str]:
+    sources = derived.concat or derived.coalesce
+    missing = [name for name in sources if name not in types]
+    if missing:
+        raise ValueError(f"derived column '{derived.name}' uses unknown columns {missing}")
+
+    if derived.value is not None:
+        def constant(columns: Dict[str, Column], num_rows: int) -> Column:
+            no_rows = np.zeros(num_rows, dtype=bool)
+            return Column(DictionaryArray(np.zeros(num_rows, dtype=np.uint8), np.array([derived.value])), no_rows, no_rows)
+        return constant, "str"
+
+    if derived.concat:
+        def concat(columns: Dict[str, Column], num_rows: int) -> Column:
+            parts = [np.asarray(to_text(columns[name].values, columns[name].nulls, types[name])) for name in derived.concat]
+            text = parts[0]
+            for part in parts[1:]:
+                if derived.separator:
+                    text = np.char.add(text, derived.separator)
+                text = np.char.add(text, part)
+            return Column(maybe_dictionary_encode(text), np.zeros(num_rows, dtype=bool), np.zeros(num_rows, dtype=bool))
+        return concat, "str"
+
+    result_types = {types[name] for name in derived.coalesce}
+    if len(result_types) != 1:
+        raise ValueError(f"derived column '{derived.name}' coalesces columns of different types {sorted(result_types)}")
+
+    def coalesce(columns: Dict[str, Column], num_rows: int) -> Column:
+        values, nulls, invalid = columns[derived.coalesce[0]]
+        values = np.asarray(values)
+        for name in derived.coalesce[1:]:
+            other_values, other_nulls, other_invalid = columns[name]
+            values = np.where(nulls, np.asarray(other_values), values)
+            invalid = np.where(nulls, other_invalid, invalid)
+            nulls = nulls & other_nulls
+        return Column(maybe_dictionary_encode(values), nulls, invalid)
+
+    return coalesce, result_types.pop()
+
+
+class HarmonisationPlan:
+    """A mapping spec compiled against an input schema into whole-column steps.
+
+    Applying the plan to a chunk runs one step per output column, each a few
+    numpy operations; text steps on dictionary-encoded columns only touch the
+    dictionary.
+    """
+
+    def __init__(self, input_columns: List[str], steps: List[Tuple[str, Step]], schema: Dict[str, str]):
+        self.input_columns = input_columns
+        self.steps = steps
+        self.schema = schema
+
+    def apply(self, chunk: Chunk) -> Chunk:
+        num_rows = chunk.num_rows
+        columns = {name: Column(chunk.columns[name], chunk.null_mask(name), chunk.invalid_mask(name))
+                   for name in self.input_columns}
+        outputs: Dict[str, Column] = {}
+        for name, step in self.steps:
+            # Derived steps see the harmonised columns, mapping steps the input columns
+            outputs[name] = step({**columns, **outputs}, num_rows)
+        return Chunk({name: column.values for name, column in outputs.items()}, chunk.row_offset,
+                     {name: column.nulls for name, column in outputs.items() if column.nulls.any()},
+                     {name: column.invalid for name, column in outputs.items() if column.invalid.any()})
+
+
+def spec_hash(spec: HarmonisationSpec, input_schema: Dict[str, str]) -> str:
+    document = {"spec": spec.model_dump(mode="json"), "schema": input_schema}
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+
+def compile_plan(spec: HarmonisationSpec, input_schema: Dict[str, str]) -> HarmonisationPlan:
+    """Compile ``spec`` for datasets with ``input_schema``, reusing a cached plan for the same spec hash."""
+    key = spec_hash(spec, input_schema)
+    plan = _plan_cache.get(key)
+    if plan is not None:
+        return plan
+    missing = [mapping.source for mapping in spec.columns if mapping.source not in input_schema]
+    if missing:
+        raise ValueError(f"harmonisation maps columns {missing} that are not in the input dataset")
+
+    steps: List[Tuple[str, Step]] = []
+    schema: Dict[str, str] = {}
+    for mapping in spec.columns:
+        step, column_type = mapping_step(mapping, input_schema[mapping.source])
+        steps.append((mapping.output_name(), step))
+        schema[mapping.output_name()] = column_type
+    if spec.keep_unmapped:
+        sources = {mapping.source for mapping in spec.columns}
+        for name, column_type in input_schema.items():
+            if name not in sources and name not in schema:
+                steps.append((name, lambda columns, num_rows, name=name: columns[name]))
+                schema[name] = column_type
+    for derived in spec.derived:
+        step, column_type = derived_step(derived, {**input_schema, **schema})
+        steps.append((derived.name, step))
+        schema[derived.name] = column_type
+
+    plan = HarmonisationPlan(list(input_schema), steps, schema)
+    _plan_cache.put(key, plan)
+    return plan
+
+
+def harmonise_chunk_file(spec_json: str, input_schema: Dict[str, str], path: str, row_offset: int,
+                         output_path: str) -> int:
+    """Pool entry point: harmonise one chunk file; the plan is compiled once per worker via the cache."""
+    plan = compile_plan(HarmonisationSpec.model_validate_json(spec_json), input_schema)
+    chunk = plan.apply(read_chunk_file(path, row_offset, plan.input_columns))
+    write_chunk_file(output_path, chunk)
+    return chunk.num_rows
+
+
+def harmonise_dataset(dataset: Dataset, spec: HarmonisationSpec, output_path: str,
+                      max_workers: int = WORKER_PROCESSES) -> Dataset:
+    started = time.perf_counter()
+    plan = compile_plan(spec, dataset.schema)
+    writer = DatasetWriter(output_path, plan.schema)
+    if len(dataset.chunks) <= 1 or max_workers <= 1 or dataset.num_rows < HARMONISATION_PARALLEL_MIN_ROWS:
+        for chunk in dataset.iter_chunks(plan.input_columns):
+            writer.write(plan.apply(chunk))
+    else:
+        spec_json = spec.model_dump_json()
+        pool = get_process_pool()
+        futures = []
+        for index, entry in enumerate(dataset.chunks):
+            file_name = f"chunk_{index:06d}.npz"
+            futures.append((file_name, pool.submit(harmonise_chunk_file, spec_json, dataset.schema,
+                                                   os.path.join(dataset.path, entry["file"]), entry["row_offset"],
+                                                   os.path.join(output_path, file_name))))
+        for file_name, future in futures:
+            writer.add_chunk_file(file_name, future.result())
+    result = writer.close({"source": dataset.path})
+    logger.info(f"🧭 Harmonised {result.num_rows} rows into {len(plan.schema)} columns "
+                f"in {(time.perf_counter() - started):.2f} s")
+    return result
@@ -0,0 +1,277 @@
+import csv
+import io
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from columnar import Chunk, Dataset, DatasetWriter, write_chunk_file
+from compression import detect_compression, open_decompressed
+from fixed_width import read_fixed_width, read_fixed_width_stream
+from ingest_cache import IngestCache, file_digest, link_chunk_file, new_entry_dir, spec_fingerprint
+from readers import READ_CHUNK_ROWS, ReadStats, infer_spec, open_text, read_delimited
+from workers import WORKER_PROCESSES, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Files larger than this are split into newline-aligned byte ranges parsed in parallel
+SPLIT_MIN_BYTES = int(os.environ.get("INGEST_SPLIT_MIN_BYTES", str(64 * 1024 * 1024)))
+SPLIT_TARGET_BYTES = int(os.environ.get("INGEST_SPLIT_TARGET_BYTES", str(32 * 1024 * 1024)))
+
+
+class IngestTask(NamedTuple):
+    """One unit of parallel work: a whole file or a byte range of one."""
+    index: int
+    path: str
+    start: int
+    end: Optional[int]
+    header: Optional[List[str]]
+    compressed: bool
+
+
+class RangeReader(io.RawIOBase):
+    """Raw stream over ``[start, end)`` of a file."""
+
+    def __init__(self, path: str, start: int, end: Optional[int]):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = None if end is None else end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = len(buffer)
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        if size <= 0:
+            return 0
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def read_header(path: str, spec) -> Tuple[Optional[List[str]], int]:
+    """Header fields and the byte offset where data rows start."""
+    if not spec.has_header:
+        return None, 0
+    with open(path, "rb") as f:
+        line = f.readline()
+    fields = next(csv.reader([line.decode(spec.encoding).rstrip("\r\n")], delimiter=spec.delimiter), [])
+    return [name.strip() for name in fields], len(line)
+
+
+def fixed_width_layout(path: str, spec) -> Tuple[int, int]:
+    """Record length and the byte offset of the first data record of a fixed-width file."""
+    if spec.record_length:
+        record_length = spec.record_length
+    else:
+        with open(path, "rb") as f:
+            record_length = len(f.readline())
+    return record_length, record_length if spec.has_header else 0
+
+
+def split_record_ranges(start: int, size: int, record_length: int, target_bytes: int) -> List[Tuple[int, Optional[int]]]:
+    """Cut a fixed-width file into ranges of whole records."""
+    step = max(1, target_bytes // record_length) * record_length
+    boundaries = list(range(start, size, step)) or [start]
+    ranges: List[Tuple[int, Optional[int]]] = list(zip(boundaries, boundaries[1:]))
+    ranges.append((boundaries[-1], None))
+    return ranges
+
+
+def split_byte_ranges(path: str, start: int, size: int, target_bytes: int) -> List[Tuple[int, Optional[int]]]:
+    """Cut ``[start, size)`` into ranges of roughly ``target_bytes`` that begin on a line start."""
+    boundaries = [start]
+    with open(path, "rb") as f:
+        position = start + target_bytes
+        while position < size:
+            f.seek(position)
+            f.readline()
+            aligned = f.tell()
+            if aligned >= size:
+                break
+            if aligned > boundaries[-1]:
+                boundaries.append(aligned)
+            position = aligned + target_bytes
+    ranges: List[Tuple[int, Optional[int]]] = list(zip(boundaries, boundaries[1:]))
+    ranges.append((boundaries[-1], None))
+    return ranges
+
+
+def plan_tasks(files: List[Any], spec, split_min_bytes: int = SPLIT_MIN_BYTES,
+               split_target_bytes: int = SPLIT_TARGET_BYTES) -> List[IngestTask]:
+    tasks = []
+    for file in files:
+        if detect_compression(file.path):
+            # Compressed extracts cannot be split by byte offset; they are decompressed as one stream
+            # (in parallel threads where the format allows) and the header is read from that stream
+            tasks.append(IngestTask(len(tasks), file.path, 0, None, None, True))
+            continue
+        if spec.file_format == "fixed_width":
+            header = None
+            record_length, data_start = fixed_width_layout(file.path, spec)
+            if file.size >= split_min_bytes:
+                ranges = split_record_ranges(data_start, file.size, record_length, split_target_bytes)
+            else:
+                ranges = [(data_start, None)]
+        elif spec.split_large_files and file.size >= split_min_bytes:
+            header, data_start = read_header(file.path, spec)
+            ranges = split_byte_ranges(file.path, data_start, file.size, split_target_bytes)
+        else:
+            header, data_start = read_header(file.path, spec)
+            ranges = [(data_start, None)]
+        for start, end in ranges:
+            tasks.append(IngestTask(len(tasks), file.path, start, end, header, False))
+    return tasks
+
+
+def ingest_partition(task: IngestTask, spec, dataset_path: str, chunk_rows: int) -> Tuple[IngestTask, List[Tuple[str, int]], Dict[str, Any]]:
+    """Parse one task into chunk files; runs inside a pool worker."""
+    stats = ReadStats(task.path)
+    chunk_files = []
+    for chunk in iter_task_chunks(task, spec, stats, chunk_rows):
+        file_name = f"part_{task.index:05d}_{len(chunk_files):06d}.npz"
+        write_chunk_file(os.path.join(dataset_path, file_name), chunk)
+        chunk_files.append((file_name, chunk.num_rows))
+    return task, chunk_files, stats.as_dict()
+
+
+def iter_task_chunks(task: IngestTask, spec, stats: ReadStats, chunk_rows: int) -> Iterator[Chunk]:
+    if task.compressed:
+        if spec.file_format == "fixed_width":
+            with open_decompressed(task.path) as stream:
+                yield from read_fixed_width_stream(stream, spec, stats, chunk_rows)
+        else:
+            with open_text(task.path, spec.encoding) as stream:
+                yield from read_delimited(stream, spec, stats, chunk_rows)
+        return
+    if spec.file_format == "fixed_width":
+        # start is already past any header record, read_fixed_width only skips it at offset 0
+        yield from read_fixed_width(task.path, spec, stats, chunk_rows, task.start, task.end)
+        return
+    raw = RangeReader(task.path, task.start, task.end)
+    with io.TextIOWrapper(io.BufferedReader(raw, 1024 * 1024), encoding=spec.encoding, newline="") as stream:
+        # Ranges start after the header line, so it is handed over rather than read from the stream
+        yield from read_delimited(stream, spec, stats, chunk_rows, header=task.header)
+
+
+def reuse_cached_chunks(files: List[Any], fingerprint: str, dataset_path: str,
+                        cache_dir: str) -> Dict[str, Tuple[Dict[str, Any], List[Tuple[str, int]]]]:
+    """Hard-link the cached chunks of unchanged files into the dataset.
+
+    Returns each reused file's cache entry and linked chunk files. The lock is
+    only held while the manifest is read; an entry that a concurrent ingestion
+    replaces or prunes before its chunks are linked is treated as a miss.
+    """
+    cache = IngestCache.load(cache_dir)
+    reused = {}
+    for index, file in enumerate(files):
+        entry = cache.lookup(file, fingerprint)
+        if entry is None:
+            continue
+        linked: List[Tuple[str, int]] = []
+        try:
+            for part, (chunk_path, num_rows) in enumerate(entry["chunks"]):
+                file_name = f"cached_{index:05d}_{part:06d}.npz"
+                link_chunk_file(chunk_path, os.path.join(dataset_path, file_name))
+                linked.append((file_name, num_rows))
+        except FileNotFoundError:
+            for file_name, _ in linked:
+                os.remove(os.path.join(dataset_path, file_name))
+            continue
+        reused[file.path] = (entry, linked)
+    return reused
+
+
+def ingest_files(files: List[Any], spec, dataset_path: str, chunk_rows: int = READ_CHUNK_ROWS,
+                 max_workers: int = WORKER_PROCESSES, cache_dir: Optional[str] = None) -> Tuple[Dataset, List[Dict[str, Any]]]:
+    """Stream the discovered files of one side into a chunked dataset at ``dataset_path``.
+
+    Files (and newline-aligned byte ranges of large files) are parsed in
+    parallel across the shared process pool. Each worker writes its chunk
+    files straight into the dataset directory; the parent only stitches the
+    manifest together in task order, so partitions are merged without copying.
+
+    With ``cache_dir``, chunks are written to a pending directory of an
+    ``IngestCache`` instead, and files that are unchanged since an earlier run
+    reuse their cached chunks without being parsed again. Cached chunks are
+    hard-linked into the dataset, so it stays readable when the cache moves on.
+    The cache is locked only to read its manifest and to merge the new entries
+    afterwards, so concurrent runs sharing it parse in parallel.
+    """
+    started = time.perf_counter()
+    if files:
+        spec = infer_spec(files[0].path, spec)
+    writer = DatasetWriter(dataset_path, {column.name: column.type for column in spec.columns})
+
+    fingerprint = spec_fingerprint(spec) if cache_dir is not None else None
+    reused = reuse_cached_chunks(files, fingerprint, dataset_path, cache_dir) if cache_dir is not None else {}
+    pending_files = [file for file in files if file.path not in reused]
+    # Chunks of each parsed file go to its own pending cache directory, or straight into the dataset
+    output_dirs = {file.path: new_entry_dir(cache_dir) if cache_dir is not None else dataset_path for file in pending_files}
+    tasks = plan_tasks(pending_files, spec)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(4, len(pending_files)))) as hash_pool:
+            # Content hashes for the cache are computed while the pool parses
+            digests = {file.path: hash_pool.submit(file_digest, file.path) for file in pending_files} if cache_dir is not None else {}
+            if len(tasks) <= 1 or max_workers <= 1:
+                results = [ingest_partition(task, spec, output_dirs[task.path], chunk_rows) for task in tasks]
+            else:
+                pool = get_process_pool()
+                futures = [pool.submit(ingest_partition, task, spec, output_dirs[task.path], chunk_rows) for task in tasks]
+                results = [future.result() for future in futures]
+            digests = {path: future.result() for path, future in digests.items()}
+
+        parsed: Dict[str, List[Tuple[str, int]]] = {}
+        file_stats: Dict[str, Dict[str, Any]] = {}
+        for task, chunk_files, stats in sorted(results, key=lambda result: result[0].index):
+            for file_name, num_rows in chunk_files:
+                if cache_dir is not None:
+                    link_chunk_file(os.path.join(output_dirs[task.path], file_name), os.path.join(dataset_path, file_name))
+                parsed.setdefault(task.path, []).append((file_name, num_rows))
+            merged = file_stats.setdefault(task.path, {"path": task.path, "rows": 0, "chunks": 0, "malformed_rows": 0,
+                                                       "partitions": 0, "cached": False})
+            merged["rows"] += stats["rows"]
+            merged["chunks"] += stats["chunks"]
+            merged["malformed_rows"] += stats["malformed_rows"]
+            merged["partitions"] += 1
+        for file in pending_files:
+            file_stats.setdefault(file.path, {"path": file.path, "rows": 0, "chunks": 0, "malformed_rows": 0,
+                                              "partitions": 0, "cached": False})
+
+        if cache_dir is not None:
+            with IngestCache.open(cache_dir) as cache:
+                for file in files:
+                    if file.path in reused:
+                        cache.touch(file, fingerprint, reused[file.path][0])
+                    else:
+                        cache.store(file, fingerprint, digests[file.path], output_dirs[file.path],
+                                    parsed.get(file.path, []), file_stats[file.path])
+    finally:
+        if cache_dir is not None:
+            # Stored directories have moved under files/; only those of a failed ingestion remain
+            for output_dir in output_dirs.values():
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+    for file in files:
+        if file.path in reused:
+            entry, chunks = reused[file.path]
+            file_stats[file.path] = {**entry["stats"], "cached": True}
+        else:
+            chunks = parsed.get(file.path, [])
+        for file_name, num_rows in chunks:
+            writer.add_chunk_file(file_name, num_rows)
+
+    dataset = writer.close({"files": [file.path for file in files]})
+    logger.info(f"📥 Ingested {dataset.num_rows} rows from {len(files)} files ({len(reused)} unchanged, reused from cache) "
+                f"in {len(tasks)} partitions in {(time.perf_counter() - started):.2f} s")
+    return dataset, [file_stats[file.path] for file in files if file.path in file_stats]
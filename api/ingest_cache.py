@@ -0,0 +1,229 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is only locked within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INGEST_CACHE_MANIFEST = "manifest.json"
+INGEST_CACHE_LOCK = ".lock"
+# Chunk directories of ingestions still parsing; moved under files/ when their entry is stored
+INGEST_CACHE_PENDING = "pending"
+# Entries no run has reused for this long are dropped even while their file stays on disk
+INGEST_CACHE_MAX_AGE_SECONDS = float(os.environ.get("INGEST_CACHE_MAX_AGE_DAYS", "7")) * 86400
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file's contents, read in blocks (hashlib releases the GIL on large updates)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def spec_fingerprint(spec) -> str:
+    """Hash of everything in a side's config that affects how its files are parsed."""
+    return hashlib.sha256(spec.model_dump_json().encode()).hexdigest()
+
+
+def link_chunk_file(source: str, target: str) -> None:
+    """Hard-link a cached chunk file into a dataset, copying it where links are not supported."""
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        os.remove(target)
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _entry_key(path: str, fingerprint: str) -> str:
+    return f"{fingerprint}:{path}"
+
+
+def new_entry_dir(root: str) -> str:
+    """A fresh directory for the chunks of one file being parsed, owned by no entry yet."""
+    path = os.path.join(root, INGEST_CACHE_PENDING, uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def _locked(root: str) -> Iterator[None]:
+    """Lock ``root`` against other threads and, through a lock file, against other API processes."""
+    with _locks_guard:
+        lock = _locks.setdefault(os.path.abspath(root), threading.Lock())
+    with lock:
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, INGEST_CACHE_LOCK), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class IngestCache:
+    """Manifest of the files already ingested for one side, and the chunk files each produced.
+
+    Entries are keyed by path and parsing spec fingerprint, so controls that
+    parse the same file differently keep separate entries, and carry size,
+    mtime and content hash. A file whose size and mtime are unchanged is
+    reused without reading it; one whose mtime changed but whose content hash
+    matches (e.g. re-copied by the transfer job) is reused too. Datasets link
+    the chunk files rather than referencing the cache, so replacing or
+    pruning an entry never breaks a dataset built from it.
+
+    The cache is only locked while the manifest is read (:meth:`load`) and
+    while new entries are merged into it (:meth:`open`); files are parsed
+    into :func:`new_entry_dir` directories with no lock held.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.manifest_path = os.path.join(root, INGEST_CACHE_MANIFEST)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as f:
+                    entries = json.load(f).get("files", {})
+                # Entries of older manifests were keyed by path alone
+                self.entries = {key: entry for key, entry in entries.items() if "path" in entry}
+                self.dirty = len(self.entries) != len(entries)
+                for entry in self.entries.values():
+                    entry.setdefault("used", time.time())
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Ignoring unreadable ingest cache manifest {self.manifest_path}: {e}")
+
+    @classmethod
+    def load(cls, root: str) -> "IngestCache":
+        """A snapshot of the manifest for looking up reusable entries."""
+        with _locked(root):
+            return cls(root)
+
+    @classmethod
+    @contextmanager
+    def open(cls, root: str) -> Iterator["IngestCache"]:
+        """Load the current manifest for merging entries into it, then prune and save it."""
+        with _locked(root):
+            cache = cls(root)
+            yield cache
+            cache.prune()
+            cache.save()
+
+    def lookup(self, file, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """The cached entry for ``file`` if its chunks can be reused, else None."""
+        entry = self.entries.get(_entry_key(file.path, fingerprint))
+        if entry is None or entry["size"] != file.size:
+            return None
+        if not all(os.path.exists(chunk_file) for chunk_file, _ in entry["chunks"]):
+            return None
+        if entry["mtime_ns"] != file.mtime_ns and file_digest(file.path) != entry["sha256"]:
+            return None
+        return entry
+
+    def touch(self, file, fingerprint: str, reused: Dict[str, Any]) -> None:
+        """Record the use and current mtime of a reused entry, unless another ingestion replaced it meanwhile."""
+        entry = self.entries.get(_entry_key(file.path, fingerprint))
+        if entry is None or entry["dir"] != reused["dir"]:
+            return
+        entry["mtime_ns"] = file.mtime_ns
+        entry["used"] = time.time()
+        self.dirty = True
+
+    def store(self, file, fingerprint: str, sha256: str, pending_dir: str,
+              chunks: List[Tuple[str, int]], stats: Dict[str, Any]) -> None:
+        """Move a parsed file's pending directory under ``files/`` and make it the file's entry.
+
+        ``chunks`` lists the chunk file names inside ``pending_dir``.
+        """
+        key = _entry_key(file.path, fingerprint)
+        previous = self.entries.get(key)
+        entry_dir = os.path.join(self.root, "files", os.path.basename(pending_dir))
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        os.replace(pending_dir, entry_dir)
+        self.entries[key] = {
+            "path": file.path,
+            "size": file.size,
+            "mtime_ns": file.mtime_ns,
+            "sha256": sha256,
+            "spec": fingerprint,
+            "dir": entry_dir,
+            "chunks": [[os.path.join(entry_dir, file_name), num_rows] for file_name, num_rows in chunks],
+            "stats": stats,
+            "used": time.time(),
+        }
+        if previous is not None and previous["dir"] != entry_dir:
+            shutil.rmtree(previous["dir"], ignore_errors=True)
+        self.dirty = True
+
+    def prune(self, max_age_seconds: float = INGEST_CACHE_MAX_AGE_SECONDS, now: Optional[float] = None) -> int:
+        """Drop entries whose file no longer exists or that were not used for ``max_age_seconds``.
+
+        Chunk directories no entry owns are removed too, as are pending
+        directories older than ``max_age_seconds`` left by ingestions that died.
+        Returns the number of entries dropped.
+        """
+        now = time.time() if now is None else now
+        expired = [key for key, entry in self.entries.items()
+                   if now - entry["used"] >= max_age_seconds or not os.path.exists(entry["path"])]
+        for key in expired:
+            shutil.rmtree(self.entries.pop(key)["dir"], ignore_errors=True)
+            self.dirty = True
+        files_dir = os.path.join(self.root, "files")
+        if os.path.isdir(files_dir):
+            owned = {os.path.basename(entry["dir"]) for entry in self.entries.values()}
+            for name in os.listdir(files_dir):
+                if name not in owned:
+                    shutil.rmtree(os.path.join(files_dir, name), ignore_errors=True)
+        pending_dir = os.path.join(self.root, INGEST_CACHE_PENDING)
+        if os.path.isdir(pending_dir):
+            for name in os.listdir(pending_dir):
+                path = os.path.join(pending_dir, name)
+                try:
+                    if now - os.path.getmtime(path) >= max_age_seconds:
+                        shutil.rmtree(path, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+        return len(expired)
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.dirty = False
+
+
+def cleanup_ingest_cache(root: str, max_age_seconds: float, now: Optional[float] = None) -> int:
+    """Prune one side's ingest cache outside of an ingestion; returns the number of entries dropped."""
+    if not os.path.isdir(root):
+        return 0
+    with _locked(root):
+        cache = IngestCache(root)
+        removed = cache.prune(max_age_seconds, now)
+        cache.save()
+    if removed:
+        logger.info(f"🧹 Removed {removed} unused ingest cache entries from {root}")
+    return removed
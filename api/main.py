@@ -2,7 +2,7 @@ from fastapi import FastAPI, HTTPException
 import time
 from pydantic import BaseModel
 import asyncio
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Set
 import uuid
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -12,6 +12,29 @@ import random
 from datetime import datetime
 from enum import Enum
 import string
+import os
+import shutil
+import tempfile
+import threading
+
+from result_store import ResultStore
+from retention import input_runs, load_retention_policies, select_expired
+from config_loader import ConfigError, load_control_config
+from file_discovery import FoundFile, cleanup_resolution_cache, describe_files, discover_files, parse_run_date, resolution_cache
+from columnar import Dataset
+from ingest import ingest_files
+from data_quality import profile_dataset
+from harmonisation import harmonise_dataset
+from enrichment import ENRICHMENT_CACHE_MAX_AGE_SECONDS, enrich_dataset, index_registry, lookup_fingerprint
+from shared_index import cleanup_index_cache
+from ingest_cache import INGEST_CACHE_MAX_AGE_SECONDS, cleanup_ingest_cache
+from transform import transform_dataset
+from combine import combine_datasets
+from completeness import check_completeness, write_key_set
+from rules import apply_rules, rule_stats_path
+from output import OUTPUT_MANIFEST, output_directory, write_outputs
+from breaks import BreakHistory, break_store_path, key_value_hashes, roll_breaks
+from workers import cancellable, shutdown_process_pool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +55,17 @@ app.add_middleware(
 async def startup_event():
     logger.info("FastAPI server starting up...")
     logger.info("CORS middleware configured")
+    logger.info(f"Result store budget: {RESULT_MEMORY_BUDGET_MB} MB, spilling to {result_store.spill_dir}")
+    background_tasks["retention"] = asyncio.create_task(retention_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks.values():
+        task.cancel()
+    shutdown_process_pool()
+    index_registry.detach_idle()
+    result_store.clear()
+    shutil.rmtree(result_store.spill_dir, ignore_errors=True)
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -71,11 +105,13 @@ class CalculationInput(BaseModel):
     nodeId: str
     parameters: RunParameters
     previousOutputs: Optional[Dict[str, Any]] = None
+    instanceId: Optional[str] = None
 
 class ProcessStatus(BaseModel):
     process_id: str
     status: str  # "pending", "running", "completed", "failed", "stopped"
     node_id: str
+    instance_id: Optional[str] = None
     output: Optional[Dict] = None
     error: Optional[str] = None
     start_time: float
@@ -86,13 +122,52 @@ class ProcessResponse(BaseModel):
     status: str
     output: Optional[Dict] = None
 
+class OpenBreaksQuery(BaseModel):
+    control: str
+    tempFilePath: str
+    date: str
+    limit: int = 100
+
+class BreakEventsQuery(BaseModel):
+    control: str
+    tempFilePath: str
+    startDate: str
+    endDate: str
+    # Only the events of these breaks: one list of values per break key, matched position by position
+    keys: Optional[Dict[str, List[Any]]] = None
+    rowSets: Optional[List[str]] = None
+    limit: int = 100
+
 # Store process information and tasks in memory
 processes: Dict[str, ProcessStatus] = {}
 tasks: Dict[str, asyncio.Task] = {}
+# Runs whose datasets each process read through previousOutputs
+process_inputs: Dict[str, Set[str]] = {}
+# Removed processes whose datasets are kept until no live process reads them
+retired_runs: Dict[str, ProcessStatus] = {}
 
 # Store process states
 process_states = {}
 
+# Node outputs live in a memory-budgeted store rather than on ProcessStatus so that
+# many concurrent instances cannot grow the API's RSS without bound
+RESULT_MEMORY_BUDGET_MB = int(os.environ.get("RESULT_MEMORY_BUDGET_MB", "512"))
+RESULT_SPILL_DIR = os.environ.get("RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "dashboard_results"))
+result_store = ResultStore(
+    memory_budget_bytes=RESULT_MEMORY_BUDGET_MB * 1024 * 1024,
+    spill_dir=os.path.join(RESULT_SPILL_DIR, str(os.getpid()))
+)
+
+# Retention: per node type policies enforced by a background task
+RESULT_RETENTION_CONFIG = os.environ.get("RESULT_RETENTION_CONFIG")
+RESULT_RETENTION_INTERVAL_SECONDS = float(os.environ.get("RESULT_RETENTION_INTERVAL_SECONDS", "300"))
+RESULT_RETENTION_BATCH_SIZE = int(os.environ.get("RESULT_RETENTION_BATCH_SIZE", "200"))
+retention_policies = load_retention_policies(RESULT_RETENTION_CONFIG)
+background_tasks: Dict[str, asyncio.Task] = {}
+
+# Number of rows of each stage's dataset returned to the dashboard as a table preview
+PREVIEW_ROWS = int(os.environ.get("PREVIEW_ROWS", "100"))
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Long-Running Calculator API"}
@@ -116,6 +191,7 @@ async def run_node(node_id: str, input_data: CalculationInput):
         process_id=process_id,
         status="running",
         node_id=node_id,
+        instance_id=input_data.instanceId,
         start_time=time.time(),
         parameters=input_data.parameters.dict()
     )
@@ -123,6 +199,7 @@ async def run_node(node_id: str, input_data: CalculationInput):
     # Start the node processing in the background
     task = asyncio.create_task(process_node_async(process_id, node_id, input_data.parameters, input_data.previousOutputs))
     tasks[process_id] = task
+    process_inputs[process_id] = input_runs(input_data.previousOutputs)
     
     return {
         "process_id": process_id,
@@ -137,17 +214,66 @@ async def get_status(process_id: str):
     
     process = processes[process_id]
     elapsed_time = time.time() - process.start_time
+    # Spilled outputs are reloaded from disk, keep that off the event loop
+    output = await asyncio.to_thread(result_store.get, process_id)
     
     return {
         "process_id": process_id,
         "status": process.status,
         "node_id": process.node_id,
-        "output": process.output,
+        "output": output,
         "error": process.error,
         "elapsed_time": f"{elapsed_time:.2f} seconds",
         "parameters": process.parameters
     }
 
+@app.get("/result/{process_id}")
+async def get_result(process_id: str):
+    if process_id not in processes:
+        raise HTTPException(status_code=404, detail="Process not found")
+    
+    output = await asyncio.to_thread(result_store.get, process_id)
+    if output is None:
+        raise HTTPException(status_code=404, detail="Result not available")
+    
+    return {
+        "process_id": process_id,
+        "node_id": processes[process_id].node_id,
+        "output": output
+    }
+
+@app.get("/results/stats")
+async def get_result_stats():
+    return result_store.stats()
+
+@app.post("/results/retention")
+async def run_result_retention():
+    return await enforce_retention()
+
+@app.post("/breaks/open")
+async def get_open_breaks(query: OpenBreaksQuery):
+    """Breaks of a control open on a date, from the snapshots and event log of its break history."""
+    def run():
+        history = BreakHistory(break_store_path(query.tempFilePath, query.control))
+        return history.open_rows(parse_run_date(query.date).date(), query.limit)
+    try:
+        return await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/breaks/events")
+async def get_break_events(query: BreakEventsQuery):
+    """Break lifecycle events of a control between two run dates, optionally for some keys only."""
+    def run():
+        history = BreakHistory(break_store_path(query.tempFilePath, query.control))
+        hashes = key_value_hashes(history.key_schema, query.keys, query.rowSets) if query.keys else None
+        return history.event_rows(parse_run_date(query.startDate).date(), parse_run_date(query.endDate).date(),
+                                  hashes, query.limit)
+    try:
+        return await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/stop/{process_id}")
 async def stop_process(process_id: str):
     if process_id not in processes:
@@ -180,35 +306,191 @@ async def reset_process(process_id: str):
                 pass
             del tasks[process_id]
         
-        del processes[process_id]
+        process = processes.pop(process_id)
+        await asyncio.to_thread(result_store.delete, process_id)
+        await release_run_datasets([process])
     
     return {
         "message": "Process reset successfully",
         "process_id": process_id
     }
 
+async def enforce_retention() -> Dict[str, int]:
+    """Drop results outside their retention policy and compact the result store.
+
+    Deletions run in batches on a worker thread so spill-file removal never
+    blocks the event loop for long.
+    """
+    expired = select_expired(processes, retention_policies)
+    deleted = 0
+    removed = []
+    for start in range(0, len(expired), RESULT_RETENTION_BATCH_SIZE):
+        batch = expired[start:start + RESULT_RETENTION_BATCH_SIZE]
+        removed.extend(processes.pop(process_id) for process_id in batch if process_id in processes)
+        for process_id in batch:
+            tasks.pop(process_id, None)
+        deleted += await asyncio.to_thread(result_store.delete_many, batch)
+        await asyncio.sleep(0)
+    await release_run_datasets(removed)
+    compaction = await asyncio.to_thread(result_store.compact)
+    # Lookup indexes nobody has attached and file resolutions older than ENRICHMENT_CACHE_MAX_AGE_DAYS
+    temp_paths = {(process.parameters or {}).get("tempFilePath") for process in processes.values()} - {None}
+    for temp_path in temp_paths:
+        await asyncio.to_thread(cleanup_index_cache, os.path.join(temp_path, "enrichment_cache"), ENRICHMENT_CACHE_MAX_AGE_SECONDS)
+        await asyncio.to_thread(cleanup_resolution_cache, os.path.join(temp_path, "resolution_cache"), ENRICHMENT_CACHE_MAX_AGE_SECONDS)
+        # Ingest cache entries no run has reused for INGEST_CACHE_MAX_AGE_DAYS
+        for side in ("src", "tgt"):
+            await asyncio.to_thread(cleanup_ingest_cache, os.path.join(temp_path, "ingest_cache", side), INGEST_CACHE_MAX_AGE_SECONDS)
+    # Rebuild the registries in place so their hash tables shrink back
+    for registry in (processes, tasks, process_inputs, retired_runs):
+        live = dict(registry)
+        registry.clear()
+        registry.update(live)
+    if expired:
+        logger.info(f"🧹 Retention removed {len(expired)} processes ({deleted} stored results), compaction: {compaction}")
+    return {"expired_processes": len(expired), "deleted_results": deleted, **compaction}
+
+async def retention_loop():
+    while True:
+        await asyncio.sleep(RESULT_RETENTION_INTERVAL_SECONDS)
+        try:
+            await enforce_retention()
+        except Exception as e:
+            logger.error(f"❌ Error enforcing result retention: {str(e)}")
+
 async def process_node_async(process_id: str, node_id: str, params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None):
+    cancel = threading.Event()
     try:
         logger.info(f"[START] Node {node_id} (Process {process_id}) started at {datetime.now().isoformat()}")
-        # Simulate processing time (45 seconds)
-        await asyncio.sleep(45)
-        output = process_node(node_id, params, previous_outputs)
+        # Node handlers do blocking file I/O and number crunching, keep them off the event loop
+        work = asyncio.ensure_future(asyncio.to_thread(process_node, node_id, params, previous_outputs, process_id, cancel))
+        output = await asyncio.shield(work)
+        await asyncio.to_thread(result_store.put, process_id, output)
         processes[process_id].status = "completed"
-        processes[process_id].output = output
         logger.info(f"[END] Node {node_id} (Process {process_id}) completed at {datetime.now().isoformat()}")
         logger.info(f"📤 Output: {output}")
+    except asyncio.CancelledError:
+        # /stop or /reset: the worker thread cannot be interrupted, it stops at its next chunk boundary
+        cancel.set()
+        reaper = asyncio.create_task(reap_cancelled_node(process_id, params, work))
+        background_tasks[f"reap_{process_id}"] = reaper
+        reaper.add_done_callback(lambda _: background_tasks.pop(f"reap_{process_id}", None))
+        raise
     except Exception as e:
         logger.error(f"❌ Error processing node {node_id}: {str(e)}")
-        processes[process_id].status = "failed"
-        processes[process_id].error = str(e)
+        # Drop any provisional output the handler published, so /status does not pair it with the failure
+        await asyncio.to_thread(result_store.delete, process_id)
+        if process_id in processes:
+            processes[process_id].status = "failed"
+            processes[process_id].error = str(e)
+
+async def reap_cancelled_node(process_id: str, params: RunParameters, work: asyncio.Future) -> None:
+    """Wait for a cancelled node's worker thread to end, then remove what it wrote if the process was reset meanwhile."""
+    try:
+        await work
+    except Exception:
+        pass
+    if process_id not in processes and process_id not in retired_runs:
+        await asyncio.to_thread(shutil.rmtree, run_dataset_dir(params, process_id), True)
+        await asyncio.to_thread(result_store.delete, process_id)
+        logger.info(f"🧹 Removed the datasets of reset process {process_id} once its worker thread ended")
+
+def process_node(node_id: str, params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None,
+                 cancel: Optional[threading.Event] = None) -> Dict:
+    """Run a node's handler; once ``cancel`` is set, the handler raises RunCancelled at its next chunk."""
+    with cancellable(cancel):
+        return dispatch_node(node_id, params, previous_outputs, run_id)
 
-def process_node(node_id: str, params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
-    # Always return a large random table for all nodes
+def dispatch_node(node_id: str, params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None) -> Dict:
+    if node_id == NodeType.CONFIG_COMP:
+        return process_config_comp_node(params)
+    elif node_id == NodeType.READ_SRC_COMP:
+        return process_read_node(params, previous_outputs, "src", run_id)
+    elif node_id == NodeType.READ_TGT_COMP:
+        return process_read_node(params, previous_outputs, "tgt", run_id)
+    elif node_id == NodeType.PRE_HARMONISATION_SRC_COMP:
+        return process_pre_harmonisation_node(params, previous_outputs, "src")
+    elif node_id == NodeType.PRE_HARMONISATION_TGT_COMP:
+        return process_pre_harmonisation_node(params, previous_outputs, "tgt")
+    elif node_id == NodeType.HARMONISATION_SRC_COMP:
+        return process_harmonisation_node(params, previous_outputs, "src", run_id)
+    elif node_id == NodeType.HARMONISATION_TGT_COMP:
+        return process_harmonisation_node(params, previous_outputs, "tgt", run_id)
+    elif node_id == NodeType.ENRICHMENT_FILE_SEARCH_SRC_COMP:
+        return process_enrichment_file_search_node(params, previous_outputs, "src")
+    elif node_id == NodeType.ENRICHMENT_FILE_SEARCH_TGT_COMP:
+        return process_enrichment_file_search_node(params, previous_outputs, "tgt")
+    elif node_id == NodeType.ENRICHMENT_SRC_COMP:
+        return process_enrichment_node(params, previous_outputs, "src", run_id)
+    elif node_id == NodeType.ENRICHMENT_TGT_COMP:
+        return process_enrichment_node(params, previous_outputs, "tgt", run_id)
+    elif node_id == NodeType.DATA_TRANSFORM_SRC_COMP:
+        return process_transform_node(params, previous_outputs, "src", run_id)
+    elif node_id == NodeType.DATA_TRANSFORM_TGT_COMP:
+        return process_transform_node(params, previous_outputs, "tgt", run_id)
+    elif node_id == NodeType.COMBINE_DATA_COMP:
+        return process_combine_node(params, previous_outputs, run_id)
+    elif node_id == NodeType.APPLY_RULES_COMP:
+        return process_rules_node(params, previous_outputs, run_id)
+    elif node_id == NodeType.OUTPUT_RULES_COMP:
+        return process_output_node(params, previous_outputs, run_id)
+    elif node_id == NodeType.BREAK_ROLLING_COMP:
+        return process_break_node(params, previous_outputs, run_id)
+    # Node ids outside NodeType return a large random table
     return process_generic_node(params)
 
+def run_dataset_dir(params: RunParameters, run_id: Optional[str]) -> str:
+    """Directory under tempFilePath holding the datasets written by one node run."""
+    return os.path.join(params.tempFilePath, "datasets", run_id or f"run_{uuid.uuid4().hex}")
+
+async def release_run_datasets(removed: List[ProcessStatus]) -> None:
+    """Remove the datasets of removed processes, keeping those a live process read until it is removed too."""
+    for process in removed:
+        process_inputs.pop(process.process_id, None)
+        retired_runs[process.process_id] = process
+    referenced = set().union(*process_inputs.values())
+    for process_id in [process_id for process_id in retired_runs if process_id not in referenced]:
+        await asyncio.to_thread(remove_run_datasets, retired_runs.pop(process_id))
+
+def remove_run_datasets(process: ProcessStatus) -> None:
+    temp_path = (process.parameters or {}).get("tempFilePath")
+    if temp_path:
+        shutil.rmtree(os.path.join(temp_path, "datasets", process.process_id), ignore_errors=True)
+
+def open_input_dataset(previous_outputs: Optional[Dict[str, Any]], node_id: str) -> Dataset:
+    """Open the dataset produced by an upstream node from its output in previousOutputs."""
+    if not previous_outputs or node_id not in previous_outputs:
+        raise ValueError(f"No input data from {node_id}")
+    dataset_info = (previous_outputs[node_id].get("calculation_results") or {}).get("dataset")
+    if not dataset_info:
+        raise ValueError(f"Output of {node_id} does not reference a dataset")
+    return Dataset.open(dataset_info["path"])
+
+def open_input_datasets(previous_outputs: Optional[Dict[str, Any]], node_id: str) -> Dict[str, Dataset]:
+    """Open every dataset an upstream node lists under ``datasets``, such as the combine's row sets."""
+    if not previous_outputs or node_id not in previous_outputs:
+        raise ValueError(f"No input data from {node_id}")
+    datasets_info = (previous_outputs[node_id].get("calculation_results") or {}).get("datasets")
+    if not datasets_info:
+        raise ValueError(f"Output of {node_id} does not reference datasets")
+    return {name: Dataset.open(info["path"]) for name, info in datasets_info.items()}
+
+def get_control_config(params: RunParameters):
+    """Compiled control config for a run; cached by file path, mtime and size."""
+    return load_control_config(params.inputConfigFilePath, params.inputConfigFilePattern)
+
 def process_config_comp_node(params: RunParameters) -> Dict:
     """Process the combined config node that handles both SRC and TGT configurations."""
-    is_valid = validate_config_file(params.inputConfigFilePath, params.inputConfigFilePattern)
+    started = time.perf_counter()
+    compiled = None
+    error = None
+    try:
+        compiled = get_control_config(params)
+    except (ConfigError, OSError) as e:
+        error = str(e)
+        logger.error(f"❌ Config validation failed: {error}")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    is_valid = compiled is not None
     return {
         "status": "success" if is_valid else "failed",
         "run_parameters": params.dict(),
@@ -217,15 +499,18 @@ def process_config_comp_node(params: RunParameters) -> Dict:
             f"Checking file path: {params.inputConfigFilePath}",
             f"Validating against pattern: {params.inputConfigFilePattern}",
             f"Environment: {params.runEnv}",
-            "Combined file format validation completed"
+            *([f"Loaded {len(compiled.files)} config file(s) for control '{compiled.config.name}'"] if is_valid else [f"Validation error: {error}"]),
+            f"Combined file format validation completed in {elapsed_ms:.3f} ms"
         ],
         "calculation_results": {
             "validation_details": {
                 "file_path": params.inputConfigFilePath,
                 "pattern_matched": params.inputConfigFilePattern,
-                "path_format_valid": True,
-                "pattern_format_valid": True,
-                "combined_validation": True
+                "path_format_valid": os.path.exists(params.inputConfigFilePath),
+                "pattern_format_valid": is_valid,
+                "combined_validation": is_valid,
+                "errors": [error] if error else [],
+                "config": compiled.describe() if is_valid else None
             },
             "environment_info": {
                 "run_date": params.expectedRunDate,
@@ -237,188 +522,420 @@ def process_config_comp_node(params: RunParameters) -> Dict:
 
 def process_file_search_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, side: str = "src") -> Dict:
     """Process the file searching component for either SRC or TGT side."""
-    has_valid_path = '/' in params.rootFileDir or '\\' in params.rootFileDir
+    side_path = os.path.join(params.rootFileDir, side)
+    has_valid_path = os.path.isdir(side_path)
     
     # Use config node output if available
     config_validation = None
     if previous_outputs and "reading_config_comp" in previous_outputs:
         config_validation = previous_outputs["reading_config_comp"].get("calculation_results", {}).get("validation_details")
     
-    side_path = f"{params.rootFileDir}/{side}"
+    files = []
+    error = None
+    file_pattern = "*"
+    if has_valid_path:
+        try:
+            file_pattern = get_control_config(params).config.side(side).file_pattern
+            files = discover_files(side_path, file_pattern, params.expectedRunDate)
+        except (ConfigError, OSError, ValueError) as e:
+            error = str(e)
+            logger.error(f"❌ {side.upper()} file search failed: {error}")
     
     return {
-        "status": "success" if has_valid_path else "failed",
+        "status": "success" if has_valid_path and error is None else "failed",
         "run_parameters": params.dict(),
         "execution_logs": [
             f"Starting {side.upper()} file search at {datetime.now().isoformat()}",
             f"Checking {side.upper()} directory: {side_path}",
+            f"Searching for pattern: {file_pattern}",
             f"Environment: {params.runEnv}",
+            *([f"File search failed: {error}"] if error else [f"Found {len(files)} {side.upper()} files"]),
             f"File search completed for {side.upper()}",
             *(["Using config validation from previous node"] if config_validation else [])
         ],
         "calculation_results": {
             "file_search_details": {
                 "path": side_path,
+                "pattern": file_pattern,
                 "is_valid": has_valid_path,
-                "files_found": [f"example_{side}_1.dat", f"example_{side}_2.dat"]
+                "files_found": [f.relative_path for f in files],
+                "files": describe_files(files),
+                "total_bytes": sum(f.size for f in files)
             },
             "config_validation": config_validation
         }
     }
 
-def process_pre_harmonisation_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str) -> Dict:
-    """Process pre-harmonisation node for either SRC or TGT flow.
-    
-    This node performs initial data standardization before the main harmonisation:
-    1. Basic data type validation
-    2. Initial format standardization
-    3. Preliminary data quality checks
+def process_read_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str, run_id: Optional[str] = None) -> Dict:
+    """Read the SRC or TGT extracts found by file search into a chunked dataset.
+
+    Downstream stages open the dataset from ``calculation_results.dataset`` and
+    consume it chunk by chunk; only a small preview is returned to the dashboard.
     """
-    logger.info(f"Processing pre-harmonisation for {flow_type.upper()} flow")
+    search = process_file_search_node(params, previous_outputs, flow_type)
+    search_details = search["calculation_results"]["file_search_details"]
+    if search["status"] != "success":
+        return search
     
-    try:
-        # Get previous node output
-        prev_node_id = f"read_{flow_type}_comp"
-        if not previous_outputs or prev_node_id not in previous_outputs:
-            raise ValueError(f"No input data from {prev_node_id}")
-            
-        input_data = previous_outputs[prev_node_id]
-        
-        # Simulate pre-harmonisation processing
-        output = {
-            "standardized_data": input_data,
-            "data_quality_metrics": {
-                "missing_values": 0,
-                "invalid_formats": 0,
-                "standardization_applied": True
-            },
-            "flow_type": flow_type,
-            "timestamp": datetime.now().isoformat()
+    spec = get_control_config(params).config.side(flow_type)
+    files = [FoundFile(**f) for f in search_details["files"]]
+    dataset_path = os.path.join(run_dataset_dir(params, run_id), f"read_{flow_type}_comp")
+    # Files unchanged since an earlier run (e.g. an intraday re-run after one late file) reuse their chunks
+    cache_dir = os.path.join(params.tempFilePath, "ingest_cache", flow_type)
+    dataset, file_stats = ingest_files(files, spec, dataset_path, cache_dir=cache_dir)
+    headers, table = dataset.preview(PREVIEW_ROWS)
+    
+    return {
+        "status": "success",
+        "run_parameters": params.dict(),
+        "execution_logs": [
+            *search["execution_logs"],
+            f"Reading {len(files)} {flow_type.upper()} files as {spec.file_format}",
+            f"Read {dataset.num_rows} rows into {len(dataset.chunks)} chunks",
+            f"Reused cached chunks for {sum(1 for stats in file_stats if stats.get('cached'))} unchanged files",
+            *[f"{stats['path']}: {stats['malformed_rows']} malformed rows" for stats in file_stats if stats["malformed_rows"]]
+        ],
+        "calculation_results": {
+            "headers": headers,
+            "table": table,
+            "dataset": dataset.describe(),
+            "file_search_details": search_details,
+            "read_stats": file_stats,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
-        
-        logger.info(f"✅ Pre-harmonisation completed for {flow_type.upper()} flow")
-        return output
-        
-    except Exception as e:
-        logger.error(f"❌ Error in pre-harmonisation node: {str(e)}")
-        raise
+    }
+
+def process_pre_harmonisation_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str) -> Dict:
+    """Profile the data quality of the SRC or TGT dataset before harmonisation.
 
-def process_harmonisation_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+    Every column is checked for missing values, type-conversion failures,
+    nullability violations and format-pattern mismatches, with sample failing
+    row ids per check. The dataset itself is passed through unchanged.
+    """
+    logger.info(f"Processing pre-harmonisation for {flow_type.upper()} flow")
+    dataset = open_input_dataset(previous_outputs, f"read_{flow_type}_comp")
+    spec = get_control_config(params).config.side(flow_type)
+    metrics = profile_dataset(dataset, spec)
+    headers, table = dataset.preview(PREVIEW_ROWS)
+
+    failing_columns = [name for name, column in metrics["columns"].items()
+                       if any(column[check]["count"] for check in ("type", "not_null", "pattern"))]
+    logger.info(f"✅ Pre-harmonisation completed for {flow_type.upper()} flow")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting harmonisation at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Harmonisation completed"
+            f"Profiling {dataset.num_rows} {flow_type.upper()} rows across {len(headers)} columns",
+            f"{metrics['missing_values']} missing values, {metrics['invalid_formats']} invalid formats, "
+            f"{metrics['not_null_violations']} not-null violations",
+            *[f"Column {name} has data-quality failures" for name in failing_columns]
         ],
         "calculation_results": {
-            "harmonisation_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "headers": headers,
+            "table": table,
+            "dataset": dataset.describe(),
+            "data_quality_metrics": metrics,
+            "flow_type": flow_type,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
-def process_enrichment_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+def process_harmonisation_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str, run_id: Optional[str] = None) -> Dict:
+    """Map the SRC or TGT dataset onto the harmonised schema from the config's harmonisation section.
+
+    The mapping is compiled once into a plan of whole-column operations
+    (cached by spec hash) and applied chunk by chunk.
+    """
+    logger.info(f"Processing harmonisation for {flow_type.upper()} flow")
+    dataset = open_input_dataset(previous_outputs, f"pre_harmonisation_{flow_type}_comp")
+    spec = get_control_config(params).config.harmonisation_spec(flow_type)
+    output_path = os.path.join(run_dataset_dir(params, run_id), f"harmonisation_{flow_type}_comp")
+    harmonised = harmonise_dataset(dataset, spec, output_path)
+    headers, table = harmonised.preview(PREVIEW_ROWS)
+    logger.info(f"✅ Harmonisation completed for {flow_type.upper()} flow")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting enrichment at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Enrichment completed"
+            f"Harmonising {dataset.num_rows} {flow_type.upper()} rows",
+            f"Applied {len(spec.columns)} column mappings and {len(spec.derived)} derived columns",
+            f"Harmonised schema: {', '.join(f'{name}:{column_type}' for name, column_type in harmonised.schema.items())}"
         ],
         "calculation_results": {
-            "enrichment_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "headers": headers,
+            "table": table,
+            "dataset": harmonised.describe(),
+            "flow_type": flow_type,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
-def process_transform_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+def process_enrichment_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str, run_id: Optional[str] = None) -> Dict:
+    """Join the lookup fields onto the SRC or TGT dataset.
+
+    Lookup indexes are cached by the fingerprint of their files under
+    tempFilePath/enrichment_cache, so they are built once and reused by
+    every run and instance until the reference data changes.
+    """
+    logger.info(f"Processing enrichment for {flow_type.upper()} flow")
+    search_node = f"enrichment_file_search_{flow_type}_comp"
+    dataset = open_input_dataset(previous_outputs, search_node)
+    search_results = previous_outputs[search_node].get("calculation_results") or {}
+    files = {name: [FoundFile(**f) for f in found] for name, found in (search_results.get("enrichment_files") or {}).items()}
+    spec = get_control_config(params).config.enrichment_spec(flow_type)
+    output_path = os.path.join(run_dataset_dir(params, run_id), f"enrichment_{flow_type}_comp")
+    cache_dir = os.path.join(params.tempFilePath, "enrichment_cache")
+    enriched, lookup_stats = enrich_dataset(dataset, spec, files, output_path, cache_dir)
+    headers, table = enriched.preview(PREVIEW_ROWS)
+    logger.info(f"✅ Enrichment completed for {flow_type.upper()} flow")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting data transformation at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Transformation completed"
+            f"Enriching {dataset.num_rows} {flow_type.upper()} rows with {len(spec.lookups)} lookups",
+            *[f"{name}: index from {stats['index']}, {stats['matched_rows']} matched, {stats['unmatched_rows']} unmatched rows"
+              for name, stats in lookup_stats.items()]
         ],
         "calculation_results": {
-            "transform_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "headers": headers,
+            "table": table,
+            "dataset": enriched.describe(),
+            "lookup_stats": lookup_stats,
+            "flow_type": flow_type,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
-def process_combine_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+def process_transform_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str, run_id: Optional[str] = None) -> Dict:
+    """Evaluate the config's transform expressions and filters on the enriched SRC or TGT dataset.
+
+    Expressions are parsed once, constant-folded and merged into one graph
+    of vectorized column operations in which shared subexpressions run once
+    per chunk; compiled programs are cached by a hash of their text and schema.
+    """
+    logger.info(f"Processing data transform for {flow_type.upper()} flow")
+    dataset = open_input_dataset(previous_outputs, f"enrichment_{flow_type}_comp")
+    spec = get_control_config(params).config.transform_spec(flow_type)
+    variables = {"run_date": parse_run_date(params.expectedRunDate).date(), "run_env": params.runEnv}
+    output_path = os.path.join(run_dataset_dir(params, run_id), f"data_transform_{flow_type}_comp")
+    transformed, stats = transform_dataset(dataset, spec, variables, output_path)
+    headers, table = transformed.preview(PREVIEW_ROWS)
+    execution_logs = [
+        f"Transforming {dataset.num_rows} {flow_type.upper()} rows",
+        f"Compiled {len(spec.columns)} expressions and {len(spec.filters)} filters into {stats['nodes']} operations "
+        f"({stats['constants_folded']} constants folded)",
+        f"Kept {stats['output_rows']} of {stats['input_rows']} rows"
+    ]
+    # Key sets let the completeness check answer without a join; once both sides exist it runs right away
+    keys = get_control_config(params).config.combine_keys()
+    completeness = None
+    if keys and all(key in transformed.schema for key in keys):
+        key_set = write_key_set(transformed, keys)
+        execution_logs.append(f"Indexed {len(key_set.hashes)} distinct keys on {', '.join(keys)}")
+        other = "tgt" if flow_type == "src" else "src"
+        if previous_outputs and f"data_transform_{other}_comp" in previous_outputs:
+            other_dataset = open_input_dataset(previous_outputs, f"data_transform_{other}_comp")
+            sides = {flow_type: transformed, other: other_dataset}
+            completeness = check_completeness(sides["src"], sides["tgt"], keys)
+            execution_logs.append(completeness_summary(completeness))
+    logger.info(f"✅ Data transform completed for {flow_type.upper()} flow")
+    return {
+        "status": "success",
+        "run_parameters": params.dict(),
+        "execution_logs": execution_logs,
+        "calculation_results": {
+            "headers": headers,
+            "table": table,
+            "dataset": transformed.describe(),
+            "transform_stats": stats,
+            "completeness": completeness,
+            "flow_type": flow_type,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
+        }
+    }
+
+def process_combine_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None) -> Dict:
+    """Reconcile the transformed SRC and TGT datasets with a full outer join on the business keys.
+
+    Produces matched, src-only and tgt-only datasets. Large inputs are
+    hash-partitioned by key and joined across the process pool; inputs
+    already sorted by key are merged by key range without a shuffle.
+    """
+    logger.info("Processing combine")
+    src = open_input_dataset(previous_outputs, "data_transform_src_comp")
+    tgt = open_input_dataset(previous_outputs, "data_transform_tgt_comp")
+    config = get_control_config(params).config
+    keys = config.combine_keys()
+    completeness = check_completeness(src, tgt, keys) if keys else None
+    if completeness and run_id in processes:
+        # Published while the join runs so /status answers the completeness question early; a run
+        # reset meanwhile is skipped, and one reset after this point is cleared by its reaper
+        result_store.put(run_id, {
+            "status": "running",
+            "run_parameters": params.dict(),
+            "execution_logs": [completeness_summary(completeness)],
+            "calculation_results": {"completeness": completeness, "environment": params.runEnv}
+        })
+    output_path = os.path.join(run_dataset_dir(params, run_id), "combine_data_comp")
+    datasets, stats = combine_datasets(src, tgt, config.combine, keys, output_path)
+    headers, table = datasets["matched"].preview(PREVIEW_ROWS)
+    logger.info("✅ Combine completed")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting data combination at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Combination completed"
+            *([completeness_summary(completeness)] if completeness else []),
+            f"Joining {src.num_rows} SRC rows with {tgt.num_rows} TGT rows on {', '.join(keys)}",
+            f"Join strategy: {stats['strategy']} over {stats['partitions']} partitions",
+            *[f"Match rule {name}: {rule_stats['matched_rows']} pairs from {rule_stats['candidates']} candidates"
+              for name, rule_stats in stats["match_rules"].items()],
+            f"{stats['matched_rows']} matched, {stats['src_only_rows']} SRC only, {stats['tgt_only_rows']} TGT only rows"
         ],
         "calculation_results": {
-            "combine_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "headers": headers,
+            "table": table,
+            "dataset": datasets["matched"].describe(),
+            "datasets": {name: dataset.describe() for name, dataset in datasets.items()},
+            "combine_stats": stats,
+            "completeness": completeness,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
-def process_rules_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+def completeness_summary(completeness: Dict[str, Any]) -> str:
+    return (f"Completeness: {completeness['src_missing_keys']} of {completeness['src_keys']} SRC keys missing from TGT, "
+            f"{completeness['tgt_missing_keys']} of {completeness['tgt_keys']} TGT keys missing from SRC")
+
+def process_rules_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None) -> Dict:
+    """Classify the combined row sets with the config's rule pack.
+
+    All rules of a row set compile into one expression graph, so predicates
+    shared by many rules are computed once per chunk; every rule yields a
+    hit bitmap and each row's first rule and hit count come from bitwise
+    operations on the bitmaps. With ``rules.short_circuit`` rows stop once
+    their first rule is known and rules run cheapest and most selective
+    first, using cost and hit rates recorded over earlier runs.
+    """
+    logger.info("Processing rules")
+    inputs = open_input_datasets(previous_outputs, "combine_data_comp")
+    config = get_control_config(params).config
+    variables = {**config.rules.variables, "run_date": parse_run_date(params.expectedRunDate).date(),
+                 "run_env": params.runEnv}
+    run_dir = os.path.join(run_dataset_dir(params, run_id), "apply_rules_comp")
+    datasets, stats = {}, {}
+    for row_set, dataset in inputs.items():
+        datasets[row_set], stats[row_set] = apply_rules(
+            dataset, config.rules.row_set_rules(row_set), variables, os.path.join(run_dir, row_set),
+            config.rules.rule_columns, config.rules.short_circuit,
+            rule_stats_path(params.tempFilePath, config.name, row_set))
+    headers, table = datasets["matched"].preview(PREVIEW_ROWS)
+    logger.info("✅ Rules applied")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting rules application at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Rules applied"
+            *[f"{row_set}: {row_stats['rules']} rules compiled into {row_stats['nodes']} operations "
+              f"({row_stats['independent_nodes']} if evaluated one by one), {row_stats['rows_hit']} of "
+              f"{row_stats['rows']} rows hit" for row_set, row_stats in stats.items()],
+            *[f"{row_set}: rule order {', '.join(row_stats['order'][:10])}"
+              f"{' ...' if len(row_stats['order']) > 10 else ''}"
+              for row_set, row_stats in stats.items() if row_stats["short_circuit"] and row_stats["order"]]
         ],
         "calculation_results": {
-            "rules_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "headers": headers,
+            "table": table,
+            "dataset": datasets["matched"].describe(),
+            "datasets": {name: dataset.describe() for name, dataset in datasets.items()},
+            "rules_stats": stats,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
-def process_output_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+def process_output_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None) -> Dict:
+    """Write the classified row sets as partitioned CSV.gz and columnar files with a checksummed manifest.
+
+    Chunks are split by partition and each partition's files are written
+    by its own pool task; checksums are computed while the bytes are
+    written and the output replaces the previous one for the run date
+    once its manifest is complete.
+    """
+    logger.info("Processing output")
+    datasets = open_input_datasets(previous_outputs, "apply_rules_comp")
+    compiled = get_control_config(params)
+    spec = compiled.config.output
+    output_dir = output_directory(spec, params.rootFileDir, params.tempFilePath, compiled.config.name,
+                                  params.expectedRunDate)
+    metadata = {"control": compiled.config.name, "version": compiled.config.version,
+                "config_fingerprint": compiled.fingerprint, "run_date": params.expectedRunDate,
+                "run_env": params.runEnv, "run_id": run_id}
+    manifest = write_outputs(datasets, spec, output_dir, metadata)
+    logger.info("✅ Output generated")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting output generation at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Output generated"
+            f"Writing {', '.join(spec.row_sets)} rows partitioned by {', '.join(spec.partition_by) or 'nothing'}",
+            *[f"{row_set}: {info['rows']} rows in {len(info['partitions'])} partitions"
+              for row_set, info in manifest["row_sets"].items()],
+            f"Wrote {len(manifest['files'])} files ({', '.join(spec.formats)}) to {output_dir}"
         ],
         "calculation_results": {
-            "output_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "output_dir": output_dir,
+            "manifest": os.path.join(output_dir, OUTPUT_MANIFEST),
+            "files": manifest["files"][:PREVIEW_ROWS],
+            "num_files": len(manifest["files"]),
+            "row_sets": {row_set: {"rows": info["rows"], "partitions": len(info["partitions"])}
+                         for row_set, info in manifest["row_sets"].items()},
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
-def process_break_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None) -> Dict:
+def process_break_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]] = None, run_id: Optional[str] = None) -> Dict:
+    """Roll the control's open breaks forward to the run date.
+
+    Today's breaks are looked up in the persistent break store by a hash of
+    their row set and keys: known breaks keep their open date and age,
+    unseen ones open and stored breaks missing today close. Only those
+    changes are written back to the store.
+    """
+    logger.info("Processing break rolling")
+    inputs = open_input_datasets(previous_outputs, "apply_rules_comp")
+    config = get_control_config(params).config
+    variables = {**config.rules.variables, "run_date": parse_run_date(params.expectedRunDate).date(),
+                 "run_env": params.runEnv}
+    run_dir = os.path.join(run_dataset_dir(params, run_id), "break_rolling_comp")
+    datasets, stats = roll_breaks(inputs, config.breaks.conditions, config.break_keys(), variables,
+                                  break_store_path(params.tempFilePath, config.name),
+                                  parse_run_date(params.expectedRunDate).date(), run_dir, config.breaks.age_events)
+    first_row_set = next(iter(config.breaks.conditions))
+    headers, table = datasets[first_row_set].preview(PREVIEW_ROWS)
+    logger.info("✅ Breaks rolled")
     return {
         "status": "success",
         "run_parameters": params.dict(),
         "execution_logs": [
-            f"Starting break rolling at {datetime.now().isoformat()}",
-            f"Processing with environment: {params.runEnv}",
-            "Break rolling completed"
+            f"Rolling breaks from {stats['previous_run_date'] or 'an empty store'} to {stats['run_date']} "
+            f"on {', '.join(stats['keys'])}",
+            *[f"{row_set}: {row_stats['rows']} break rows, {row_stats['carried']} carried, {row_stats['new']} new "
+              f"({row_stats['untracked']} with null keys)" for row_set, row_stats in stats["row_sets"].items()],
+            f"{stats['opened']} breaks opened, {stats['closed']} closed, {stats['aged']} aged, {stats['open']} open"
         ],
         "calculation_results": {
-            "break_info": {
-                "processed_at": datetime.now().isoformat(),
-                "environment": params.runEnv
-            }
+            "headers": headers,
+            "table": table,
+            "dataset": datasets[first_row_set].describe(),
+            "datasets": {name: dataset.describe() for name, dataset in datasets.items()},
+            "break_stats": stats,
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
     }
 
@@ -467,50 +984,50 @@ def process_generic_node(params: RunParameters) -> Dict:
     }
 
 def process_enrichment_file_search_node(params: RunParameters, previous_outputs: Optional[Dict[str, Any]], flow_type: str) -> Dict:
-    """Process enrichment file search node for either SRC or TGT flow.
-    
-    This node searches for enrichment files based on the harmonized data:
-    1. Identifies required enrichment files
-    2. Validates file existence and format
-    3. Prepares files for enrichment process
+    """Resolve the reference and lookup files of the config's enrichment lookups for SRC or TGT.
+
+    Each lookup's ``file_pattern`` is searched under rootFileDir; a required
+    lookup without any file fails the stage. The harmonised dataset is passed
+    through for the enrichment stage. Resolved file sets are cached under
+    tempFilePath/resolution_cache per flow, run date and root, so every
+    control resolving the same lookups that day shares one search.
     """
     logger.info(f"Processing enrichment file search for {flow_type.upper()} flow")
-    
-    try:
-        # Get previous node output (harmonisation)
-        prev_node_id = f"harmonisation_{flow_type}_comp"
-        if not previous_outputs or prev_node_id not in previous_outputs:
-            raise ValueError(f"No input data from {prev_node_id}")
-            
-        harmonised_data = previous_outputs[prev_node_id]
-        
-        # Simulate enrichment file search processing
-        output = {
-            "enrichment_files": {
-                "reference_data": f"/path/to/{flow_type}/reference_data.csv",
-                "lookup_tables": [
-                    f"/path/to/{flow_type}/lookup1.csv",
-                    f"/path/to/{flow_type}/lookup2.csv"
-                ]
-            },
+    dataset = open_input_dataset(previous_outputs, f"harmonisation_{flow_type}_comp")
+    spec = get_control_config(params).config.enrichment_spec(flow_type)
+
+    resolved, source = resolution_cache.resolve(
+        params.rootFileDir, {lookup.name: lookup.file_pattern for lookup in spec.lookups}, params.expectedRunDate,
+        os.path.join(params.tempFilePath, "resolution_cache"), {"flow_type": flow_type})
+    enrichment_files = {lookup.name: describe_files(resolved[lookup.name]) for lookup in spec.lookups}
+    fingerprints = {lookup.name: lookup_fingerprint(lookup, resolved[lookup.name]) for lookup in spec.lookups}
+    missing = [lookup.name for lookup in spec.lookups if lookup.required and not enrichment_files[lookup.name]]
+    if missing:
+        logger.error(f"❌ Enrichment file search found no files for required lookups {missing}")
+    else:
+        logger.info(f"✅ Enrichment file search completed for {flow_type.upper()} flow")
+    return {
+        "status": "failed" if missing else "success",
+        "run_parameters": params.dict(),
+        "execution_logs": [
+            f"Searching enrichment files for {len(spec.lookups)} {flow_type.upper()} lookups under {params.rootFileDir}",
+            f"Enrichment file sets resolved from {source}",
+            *[f"{lookup.name}: {len(enrichment_files[lookup.name])} files for pattern {lookup.file_pattern}" for lookup in spec.lookups],
+            *([f"No files found for required lookups: {', '.join(missing)}"] if missing else [])
+        ],
+        "calculation_results": {
+            "dataset": dataset.describe(),
+            "enrichment_files": enrichment_files,
+            "enrichment_fingerprints": fingerprints,
             "file_validation": {
-                "all_files_exist": True,
-                "valid_formats": True
+                "all_files_exist": not missing,
+                "missing_required": missing
             },
             "flow_type": flow_type,
-            "timestamp": datetime.now().isoformat()
+            "processed_at": datetime.now().isoformat(),
+            "environment": params.runEnv
         }
-        
-        logger.info(f"✅ Enrichment file search completed for {flow_type.upper()} flow")
-        return output
-        
-    except Exception as e:
-        logger.error(f"❌ Error in enrichment file search node: {str(e)}")
-        raise
-
-def validate_config_file(file_path: str, pattern: str) -> bool:
-    # Add your config file validation logic here
-    return True  # Placeholder return
+    }
 
 @app.get("/health")
 def health_check():
@@ -0,0 +1,391 @@
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from columnar import Chunk, DictionaryArray
+from config_loader import MatchField, MatchRule
+
+logger = logging.getLogger(__name__)
+
+# Candidate row pairs generated and verified at a time, bounding the memory of one matching step
+MATCH_BATCH_PAIRS = int(os.environ.get("MATCH_BATCH_PAIRS", "2000000"))
+# Strings turned into trigrams at a time
+_QGRAM_BLOCK_ROWS = 65536
+
+QGRAM_SIZE = 3
+# Code point padding the start and end of every string, so short strings and word edges get grams
+_PAD = 1
+# Slack on tolerance comparisons so that e.g. 100.01 - 100.00 is within 0.01
+_RELATIVE_SLACK = 1e-9
+
+
+def _expand(starts: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """For ranges ``starts[i]:starts[i] + counts[i]``: the range of every element and the element positions."""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    return owner, starts[owner] + np.arange(len(owner)) - offsets[owner]
+
+
+# ---------------------------------------------------------------------------
+# Trigram index
+# ---------------------------------------------------------------------------
+
+class QGramIndex:
+    """Distinct trigrams of each string, case-folded and padded at both ends.
+
+    Stored CSR-style: the grams of string ``i`` are
+    ``grams[starts[i]:starts[i] + counts[i]]``, sorted. A gram is its three
+    code points packed into one int64. Empty strings have no grams and
+    never match.
+    """
+
+    def __init__(self, values: np.ndarray):
+        rows, grams = [], []
+        for begin in range(0, len(values), _QGRAM_BLOCK_ROWS):
+            block_rows, block_grams = self._grams(np.asarray(values[begin:begin + _QGRAM_BLOCK_ROWS], dtype=str))
+            rows.append(block_rows + begin)
+            grams.append(block_grams)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        grams = np.concatenate(grams) if grams else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((grams, rows))
+        rows, grams = rows[order], grams[order]
+        distinct = np.ones(len(rows), dtype=bool)
+        distinct[1:] = (rows[1:] != rows[:-1]) | (grams[1:] != grams[:-1])
+        rows, self.grams = rows[distinct], grams[distinct]
+        self.counts = np.bincount(rows, minlength=len(values)).astype(np.int64)
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @staticmethod
+    def _grams(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        text = np.char.lower(np.char.strip(values))
+        lengths = np.char.str_len(text).astype(np.int64)
+        width = max(text.dtype.itemsize // 4, 1)
+        pad = QGRAM_SIZE - 1
+        padded = np.zeros((len(text), width + 2 * pad), dtype=np.int64)
+        if text.dtype.itemsize:
+            padded[:, pad:pad + width] = np.ascontiguousarray(text).view(np.uint32).reshape(len(text), width)
+        padded[:, :pad] = _PAD
+        for offset in range(pad):
+            padded[np.arange(len(text)), pad + lengths + offset] = _PAD
+        positions = width + pad
+        grams = np.zeros((len(text), positions), dtype=np.int64)
+        for k in range(QGRAM_SIZE):
+            # Code points fit in 21 bits, so three of them pack into one int64
+            grams |= padded[:, k:k + positions] << (21 * (QGRAM_SIZE - 1 - k))
+        valid = (np.arange(positions) < (lengths + pad)[:, None]) & (lengths > 0)[:, None]
+        rows, _ = np.nonzero(valid)
+        return rows.astype(np.int64), grams[valid]
+
+
+def _shared_grams(left: QGramIndex, right: QGramIndex, left_rows: np.ndarray, right_rows: np.ndarray) -> np.ndarray:
+    """Number of grams the strings of every pair have in common."""
+    left_pairs, left_positions = _expand(left.starts[left_rows], left.counts[left_rows])
+    right_pairs, right_positions = _expand(right.starts[right_rows], right.counts[right_rows])
+    pairs = np.concatenate([left_pairs, right_pairs])
+    grams = np.concatenate([left.grams[left_positions], right.grams[right_positions]])
+    order = np.lexsort((grams, pairs))
+    pairs, grams = pairs[order], grams[order]
+    shared = (pairs[1:] == pairs[:-1]) & (grams[1:] == grams[:-1])
+    return np.bincount(pairs[1:][shared], minlength=len(left_rows))
+
+
+def jaccard(left: QGramIndex, right: QGramIndex, left_rows: np.ndarray, right_rows: np.ndarray) -> np.ndarray:
+    """Trigram Jaccard similarity of every ``(left_rows[i], right_rows[i])`` string pair."""
+    similarity = np.zeros(len(left_rows))
+    # Bounded batches: every pair expands into the grams of both of its strings
+    step = max(MATCH_BATCH_PAIRS // 32, 1)
+    for begin in range(0, len(left_rows), step):
+        li, ri = left_rows[begin:begin + step], right_rows[begin:begin + step]
+        shared = _shared_grams(left, right, li, ri)
+        union = left.counts[li] + right.counts[ri] - shared
+        similarity[begin:begin + step] = np.where(union > 0, shared / np.maximum(union, 1), 0.0)
+    return similarity
+
+
+def similar_pairs(left: QGramIndex, right: QGramIndex, threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Every pair of strings with trigram Jaccard similarity of at least ``threshold``.
+
+    Candidates come from a prefix-filtered inverted index: each string's
+    grams are ordered rarest first, and two strings that reach the
+    threshold must share one of the first ``n - ceil(threshold * n) + 1``
+    grams of each. Only those prefixes are indexed and probed, so common
+    grams never produce candidates; a length filter and exact verification
+    follow.
+    """
+    all_grams, ids = np.unique(np.concatenate([left.grams, right.grams]), return_inverse=True)
+    ids = ids.reshape(-1)
+    frequency = np.bincount(ids, minlength=len(all_grams))
+
+    def prefixes(index: QGramIndex, gram_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.repeat(np.arange(len(index)), index.counts)
+        order = np.lexsort((gram_ids, frequency[gram_ids], rows))
+        rows, gram_ids = rows[order], gram_ids[order]
+        position = np.arange(len(rows)) - index.starts[rows]
+        counts = index.counts[rows]
+        keep = position < counts - np.ceil(threshold * counts - 1e-9).astype(np.int64) + 1
+        return rows[keep], gram_ids[keep]
+
+    left_rows, left_ids = prefixes(left, ids[:len(left.grams)])
+    right_rows, right_ids = prefixes(right, ids[len(left.grams):])
+    order = np.argsort(right_ids, kind="stable")
+    right_rows, right_ids = right_rows[order], right_ids[order]
+    first = np.searchsorted(right_ids, left_ids, "left")
+    counts = np.searchsorted(right_ids, left_ids, "right") - first
+    owner, positions = _expand(first, counts)
+    candidates = np.unique(left_rows[owner] * np.int64(max(len(right), 1)) + right_rows[positions])
+    li, ri = candidates // max(len(right), 1), candidates % max(len(right), 1)
+    left_counts, right_counts = left.counts[li], right.counts[ri]
+    plausible = (right_counts >= threshold * left_counts - 1e-9) & (left_counts >= threshold * right_counts - 1e-9)
+    li, ri = li[plausible], ri[plausible]
+    similarity = jaccard(left, right, li, ri)
+    keep = similarity >= threshold - 1e-12
+    return li[keep], ri[keep], similarity[keep]
+
+
+# ---------------------------------------------------------------------------
+# Match rules
+# ---------------------------------------------------------------------------
+
+class _TextField:
+    """The distinct values of a text column on both sides with their trigram indexes."""
+
+    def __init__(self, src_values, tgt_values):
+        self.src_distinct, self.src_codes = _distinct(src_values)
+        self.tgt_distinct, self.tgt_codes = _distinct(tgt_values)
+        self.src_index = QGramIndex(self.src_distinct)
+        self.tgt_index = QGramIndex(self.tgt_distinct)
+
+    def similarity(self, src_rows: np.ndarray, tgt_rows: np.ndarray) -> np.ndarray:
+        # Computed once per distinct pair of values
+        pairs = self.src_codes[src_rows] * np.int64(max(len(self.tgt_distinct), 1)) + self.tgt_codes[tgt_rows]
+        distinct, inverse = np.unique(pairs, return_inverse=True)
+        size = max(len(self.tgt_distinct), 1)
+        return jaccard(self.src_index, self.tgt_index, distinct // size, distinct % size)[inverse.reshape(-1)]
+
+
+def _distinct(values) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(values, DictionaryArray):
+        return values.dictionary, values.codes.astype(np.int64)
+    distinct, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    return distinct, codes.reshape(-1).astype(np.int64)
+
+
+def _numbers(values) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[D]").astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def _within(difference: np.ndarray, tolerance: float, magnitude: np.ndarray) -> np.ndarray:
+    return difference <= tolerance + _RELATIVE_SLACK * np.maximum(magnitude, 1.0)
+
+
+class _RuleInputs:
+    """The columns one rule compares, for the SRC and TGT rows still unmatched."""
+
+    def __init__(self, rule: MatchRule, src: Chunk, tgt: Chunk):
+        from combine import join_key_codes
+        self.exact = [field.column for field in rule.fields if field.tolerance is None and field.similarity is None]
+        self.bands = [field for field in rule.fields if field.tolerance is not None]
+        self.texts = [field for field in rule.fields if field.similarity is not None]
+        if self.exact:
+            self.src_groups, self.tgt_groups = join_key_codes(src, tgt, self.exact)
+        else:
+            self.src_groups = np.zeros(src.num_rows, dtype=np.int64)
+            self.tgt_groups = np.zeros(tgt.num_rows, dtype=np.int64)
+        self.numbers: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for field in self.bands:
+            src_values, tgt_values = _numbers(src.columns[field.column]), _numbers(tgt.columns[field.column])
+            src_values[src.null_mask(field.column)] = np.nan
+            tgt_values[tgt.null_mask(field.column)] = np.nan
+            self.numbers[field.column] = (src_values, tgt_values)
+        self.text_fields: Dict[str, _TextField] = {}
+        self.text_nulls: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for field in self.texts:
+            self.text_fields[field.column] = _TextField(src.columns[field.column], tgt.columns[field.column])
+            self.text_nulls[field.column] = (src.null_mask(field.column), tgt.null_mask(field.column))
+
+    def candidates(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Batches of candidate ``(src_row, tgt_row)`` pairs from the rule's most selective blocking index."""
+        if self.bands:
+            return self._band_candidates(self.bands[0])
+        if self.texts:
+            return self._text_candidates(self.texts[0])
+        return self._group_candidates()
+
+    def _band_candidates(self, field: MatchField) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Sorted neighbourhood: TGT rows sorted by (group, value); each SRC row probes its tolerance window."""
+        src_values, tgt_values = self.numbers[field.column]
+        src_rows = np.flatnonzero((self.src_groups >= 0) & ~np.isnan(src_values))
+        tgt_rows = np.flatnonzero((self.tgt_groups >= 0) & ~np.isnan(tgt_values))
+        uniques = np.unique(np.concatenate([src_values[src_rows], tgt_values[tgt_rows]]))
+        size = np.int64(len(uniques) + 1)
+        tgt_codes = self.tgt_groups[tgt_rows] * size + np.searchsorted(uniques, tgt_values[tgt_rows])
+        order = np.argsort(tgt_codes, kind="stable")
+        tgt_rows, tgt_codes = tgt_rows[order], tgt_codes[order]
+        values = src_values[src_rows]
+        reach = field.tolerance + _RELATIVE_SLACK * np.maximum(np.abs(values), 1.0)
+        base = self.src_groups[src_rows] * size
+        low = base + np.searchsorted(uniques, values - reach, "left")
+        high = base + np.searchsorted(uniques, values + reach, "right")
+        first = np.searchsorted(tgt_codes, low, "left")
+        return _batches(src_rows, first, np.searchsorted(tgt_codes, high, "left") - first, tgt_rows)
+
+    def _text_candidates(self, field: MatchField) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Trigram blocking: pairs of distinct values that reach the similarity, expanded to their rows."""
+        text = self.text_fields[field.column]
+        src_nulls, tgt_nulls = self.text_nulls[field.column]
+        value_src, value_tgt, _ = similar_pairs(text.src_index, text.tgt_index, field.similarity)
+        src_rows = np.flatnonzero(~src_nulls & (self.src_groups >= 0))
+        tgt_rows = np.flatnonzero(~tgt_nulls & (self.tgt_groups >= 0))
+        # Rows of each distinct value, as ranges over rows sorted by value
+        src_rows = src_rows[np.argsort(text.src_codes[src_rows], kind="stable")]
+        tgt_rows = tgt_rows[np.argsort(text.tgt_codes[tgt_rows], kind="stable")]
+        src_first = np.searchsorted(text.src_codes[src_rows], value_src, "left")
+        src_counts = np.searchsorted(text.src_codes[src_rows], value_src, "right") - src_first
+        tgt_first = np.searchsorted(text.tgt_codes[tgt_rows], value_tgt, "left")
+        tgt_counts = np.searchsorted(text.tgt_codes[tgt_rows], value_tgt, "right") - tgt_first
+        pair, positions = _expand(src_first, src_counts)
+        return _batches(src_rows[positions], tgt_first[pair], tgt_counts[pair], tgt_rows)
+
+    def _group_candidates(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        src_rows = np.flatnonzero(self.src_groups >= 0)
+        tgt_rows = np.flatnonzero(self.tgt_groups >= 0)
+        tgt_rows = tgt_rows[np.argsort(self.tgt_groups[tgt_rows], kind="stable")]
+        tgt_groups = self.tgt_groups[tgt_rows]
+        first = np.searchsorted(tgt_groups, self.src_groups[src_rows], "left")
+        counts = np.searchsorted(tgt_groups, self.src_groups[src_rows], "right") - first
+        return _batches(src_rows, first, counts, tgt_rows)
+
+    def verify(self, src_rows: np.ndarray, tgt_rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Which candidate pairs satisfy every field, and a score per pair where lower is a closer match."""
+        ok = (self.src_groups[src_rows] == self.tgt_groups[tgt_rows]) & (self.src_groups[src_rows] >= 0)
+        score = np.zeros(len(src_rows))
+        for field in self.bands:
+            src_values, tgt_values = self.numbers[field.column]
+            a, b = src_values[src_rows], tgt_values[tgt_rows]
+            difference = np.abs(a - b)
+            ok &= _within(difference, field.tolerance, np.maximum(np.abs(a), np.abs(b)))
+            score += np.nan_to_num(difference / field.tolerance if field.tolerance else difference)
+        for field in self.texts:
+            src_nulls, tgt_nulls = self.text_nulls[field.column]
+            ok &= ~src_nulls[src_rows] & ~tgt_nulls[tgt_rows]
+            if not ok.any():
+                break
+            similarity = np.zeros(len(src_rows))
+            similarity[ok] = self.text_fields[field.column].similarity(src_rows[ok], tgt_rows[ok])
+            ok &= similarity >= field.similarity - 1e-12
+            score += 1.0 - similarity
+        return ok, score
+
+
+def _batches(src_rows: np.ndarray, first: np.ndarray, counts: np.ndarray,
+             tgt_order: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Expand ``src_rows[i]`` against ``tgt_order[first[i]:first[i] + counts[i]]`` about MATCH_BATCH_PAIRS at a time."""
+    total = np.cumsum(counts)
+    begin = 0
+    while begin < len(src_rows):
+        done = total[begin - 1] if begin else 0
+        end = max(int(np.searchsorted(total, done + MATCH_BATCH_PAIRS, "right")), begin + 1)
+        owner, positions = _expand(first[begin:end], counts[begin:end])
+        yield src_rows[begin:end][owner], tgt_order[positions]
+        begin = end
+
+
+def _group_min(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """The smallest value of each element's key, aligned with the elements."""
+    order = np.lexsort((values, keys))
+    starts = np.flatnonzero(np.concatenate([[True], keys[order][1:] != keys[order][:-1]]))
+    result = np.empty(len(keys), dtype=values.dtype)
+    result[order] = np.repeat(values[order][starts], np.diff(np.append(starts, len(order))))
+    return result
+
+
+def assign_pairs(src_rows: np.ndarray, tgt_rows: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """One-to-one pairs from scored candidates, closest first.
+
+    Every round considers the "tight" candidates, whose score is the best
+    remaining one of both their rows, so accepting any of them never takes a
+    closer match from another row. Rows tied on the same tight targets (such
+    as duplicate amounts) pair off in bulk, the n-th src with its n-th
+    target, and a target proposed twice goes to the lower src. The best
+    remaining pair overall always gets through, so every round makes
+    progress, and a block of N exact ties takes one round instead of N.
+    """
+    matched_src, matched_tgt = [], []
+    alive = np.arange(len(src_rows))
+    while len(alive):
+        alive_src, alive_tgt, alive_scores = src_rows[alive], tgt_rows[alive], scores[alive]
+        tight = ((alive_scores == _group_min(alive_src, alive_scores))
+                 & (alive_scores == _group_min(alive_tgt, alive_scores)))
+        tight = np.flatnonzero(tight)
+        tight = tight[np.lexsort((alive_tgt[tight], alive_src[tight]))]
+        tight_src, tight_tgt, tight_scores = alive_src[tight], alive_tgt[tight], alive_scores[tight]
+        # One entry per src: where its tight targets start, how many there are
+        starts = np.flatnonzero(np.concatenate([[True], tight_src[1:] != tight_src[:-1]]))
+        counts = np.diff(np.append(starts, len(tight)))
+        # srcs with the same first target, target count and score form a block; rank them within it
+        first_tgt, first_score = tight_tgt[starts], tight_scores[starts]
+        block_order = np.lexsort((tight_src[starts], counts, first_tgt, first_score))
+        block_keys = (first_score[block_order], first_tgt[block_order], counts[block_order])
+        new_block = np.concatenate([[True], np.any([key[1:] != key[:-1] for key in block_keys], axis=0)])
+        block_start = np.maximum.accumulate(np.where(new_block, np.arange(len(starts)), 0))
+        rank = np.empty(len(starts), dtype=np.int64)
+        rank[block_order] = np.arange(len(starts)) - block_start
+        proposing = rank < counts
+        proposals = tight[starts[proposing] + rank[proposing]]
+        proposals = proposals[np.lexsort((alive_src[proposals], alive_tgt[proposals]))]
+        proposed_tgt = alive_tgt[proposals]
+        accepted = proposals[np.concatenate([[True], proposed_tgt[1:] != proposed_tgt[:-1]])]
+        matched_src.append(alive_src[accepted])
+        matched_tgt.append(alive_tgt[accepted])
+        alive = alive[~np.isin(alive_src, alive_src[accepted]) & ~np.isin(alive_tgt, alive_tgt[accepted])]
+    if not matched_src:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(matched_src), np.concatenate(matched_tgt)
+
+
+def match_residues(src: Chunk, tgt: Chunk, rules: List[MatchRule]) -> Tuple[List[Tuple[str, np.ndarray, np.ndarray]], Dict[str, Any]]:
+    """Pair the SRC and TGT rows a key join left unmatched, rule by rule.
+
+    ``src`` and ``tgt`` hold the columns the rules name. Rules apply in
+    order and each sees only the rows earlier rules left unmatched. Returns
+    the matched row positions per rule and per-rule statistics.
+    """
+    src_available = np.ones(src.num_rows, dtype=bool)
+    tgt_available = np.ones(tgt.num_rows, dtype=bool)
+    matches, stats = [], {}
+    for rule in rules:
+        started = time.perf_counter()
+        src_rows, tgt_rows = np.flatnonzero(src_available), np.flatnonzero(tgt_available)
+        candidates = 0
+        found_src, found_tgt, found_scores = [], [], []
+        if len(src_rows) and len(tgt_rows):
+            inputs = _RuleInputs(rule, src.take(src_rows), tgt.take(tgt_rows))
+            for batch_src, batch_tgt in inputs.candidates():
+                candidates += len(batch_src)
+                ok, scores = inputs.verify(batch_src, batch_tgt)
+                found_src.append(batch_src[ok])
+                found_tgt.append(batch_tgt[ok])
+                found_scores.append(scores[ok])
+        if found_src:
+            local_src, local_tgt = assign_pairs(np.concatenate(found_src), np.concatenate(found_tgt),
+                                                np.concatenate(found_scores))
+        else:
+            local_src = local_tgt = np.zeros(0, dtype=np.int64)
+        matched_src, matched_tgt = src_rows[local_src], tgt_rows[local_tgt]
+        src_available[matched_src] = False
+        tgt_available[matched_tgt] = False
+        matches.append((rule.name, matched_src, matched_tgt))
+        stats[rule.name] = {"candidates": candidates, "matched_rows": len(matched_src),
+                            "seconds": round(time.perf_counter() - started, 3)}
+        logger.info(f"🧩 Match rule '{rule.name}': {len(matched_src)} pairs from {candidates} candidates "
+                    f"in {stats[rule.name]['seconds']:.2f} s")
+    return matches, stats
@@ -0,0 +1,235 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, List, Tuple
+from urllib.parse import quote
+
+import numpy as np
+
+from columnar import Chunk, Dataset, DictionaryArray, chunk_file_bytes, read_chunk_file, to_python_list
+from config_loader import OutputSpec
+from workers import WORKER_PROCESSES, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Smaller outputs are written in-process
+OUTPUT_PARALLEL_MIN_ROWS = int(os.environ.get("OUTPUT_PARALLEL_MIN_ROWS", "1000000"))
+# Rows formatted into CSV text at a time; bounds the memory of each partition writer
+OUTPUT_CSV_BATCH_ROWS = int(os.environ.get("OUTPUT_CSV_BATCH_ROWS", "65536"))
+OUTPUT_MANIFEST = "manifest.json"
+NULL_PARTITION = "__null__"
+# Partition files are written here before the run's output replaces the previous one
+_STAGING_PREFIX = ".staging-"
+
+
+class _HashingFile:
+    """Write-only file wrapper that computes the sha256 and size of everything written through it."""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.raw.write(data)
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+
+def _file_entry(path: str, root: str, file_format: str, rows: int, hashing: _HashingFile) -> Dict[str, Any]:
+    return {"path": os.path.relpath(path, root), "format": file_format, "rows": rows, "bytes": hashing.bytes,
+            "sha256": hashing.sha256.hexdigest()}
+
+
+def partition_groups(chunk: Chunk, partition_by: List[str]) -> List[Tuple[str, np.ndarray]]:
+    """The rows of every partition of a chunk, keyed by their ``column=value/...`` directory."""
+    if not partition_by:
+        return [("", np.arange(chunk.num_rows))] if chunk.num_rows else []
+    codes = np.zeros(chunk.num_rows, dtype=np.int64)
+    labels: List[List[str]] = []
+    for name in partition_by:
+        values = chunk.columns[name]
+        if isinstance(values, DictionaryArray):
+            distinct, inverse = values.dictionary, values.codes.astype(np.int64)
+        else:
+            distinct, inverse = np.unique(values, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        column_labels = [quote(str(value), safe="") for value in to_python_list(np.asarray(distinct))]
+        # Null rows get their own partition, whatever placeholder value they hold
+        inverse = np.where(chunk.null_mask(name), len(column_labels), inverse)
+        column_labels.append(NULL_PARTITION)
+        codes = codes * len(column_labels) + inverse
+        labels.append([f"{name}={label}" for label in column_labels])
+    order = np.argsort(codes, kind="stable")
+    distinct_codes, starts = np.unique(codes[order], return_index=True)
+    bounds = list(starts[1:]) + [len(order)]
+    groups = []
+    for code, start, stop in zip(distinct_codes.tolist(), starts.tolist(), bounds):
+        parts = []
+        for column_labels in reversed(labels):
+            code, position = divmod(code, len(column_labels))
+            parts.append(column_labels[position])
+        groups.append(("/".join(reversed(parts)), order[start:stop]))
+    return groups
+
+
+def write_partition_chunk(path: str, row_offset: int, partition_by: List[str], staging: str, row_set: str,
+                          index: int, columnar: bool) -> Dict[str, Dict[str, Any]]:
+    """Pool entry point: split one chunk by partition and write each part as an ``.npz`` file.
+
+    The file's checksum is computed from the bytes as they are written.
+    Returns the file written per partition. Without ``columnar`` output the
+    parts only feed the CSV writers and live under ``_parts``.
+    """
+    chunk = read_chunk_file(path, row_offset)
+    written = {}
+    root = staging if columnar else os.path.join(staging, "_parts")
+    for partition, rows in partition_groups(chunk, partition_by):
+        directory = os.path.join(root, row_set, partition)
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"part-{index:06d}.npz")
+        with open(file_path, "wb") as f:
+            hashing = _HashingFile(f)
+            hashing.write(chunk_file_bytes(chunk.take(rows)))
+        written[partition] = _file_entry(file_path, staging, "npz", len(rows), hashing)
+    return written
+
+
+def _csv_rows(chunk: Chunk) -> List[List[Any]]:
+    columns = []
+    for name, values in chunk.columns.items():
+        cells = to_python_list(np.asarray(values))
+        mask = chunk.nulls.get(name)
+        if mask is not None and mask.any():
+            cells = [None if is_null else cell for cell, is_null in zip(cells, mask.tolist())]
+        columns.append(cells)
+    return [list(row) for row in zip(*columns)]
+
+
+def write_partition_csv(part_files: List[str], columns: List[str], staging: str, row_set: str,
+                        partition: str) -> Dict[str, Any]:
+    """Pool entry point: write one partition's rows as a gzip CSV, hashing the compressed bytes as they go out.
+
+    Parts are read one at a time and formatted ``OUTPUT_CSV_BATCH_ROWS``
+    rows at a time, so a partition writer holds at most one part in memory.
+    """
+    directory = os.path.join(staging, row_set, partition)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "part-000000.csv.gz")
+    rows = 0
+    with open(path, "wb") as f:
+        hashing = _HashingFile(f)
+        with gzip.GzipFile(filename="", mode="wb", fileobj=hashing, mtime=0) as compressed:
+            text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(columns)
+            for part_file in part_files:
+                chunk = read_chunk_file(part_file, 0, columns)
+                for start in range(0, chunk.num_rows, OUTPUT_CSV_BATCH_ROWS):
+                    writer.writerows(_csv_rows(chunk.take(slice(start, start + OUTPUT_CSV_BATCH_ROWS))))
+                rows += chunk.num_rows
+            text.flush()
+            text.detach()
+    return _file_entry(path, staging, "csv.gz", rows, hashing)
+
+
+def output_directory(spec: OutputSpec, root_dir: str, temp_dir: str, control: str, run_date: str) -> str:
+    """``<directory>/<control>/<run date>``; a rerun for the same date replaces the earlier output."""
+    base = spec.directory or os.path.join(temp_dir, "output")
+    if not os.path.isabs(base):
+        base = os.path.join(root_dir, base)
+    return os.path.join(base, re.sub(r"[^A-Za-z0-9_.-]", "_", control), re.sub(r"[^A-Za-z0-9_.-]", "_", run_date))
+
+
+def write_outputs(datasets: Dict[str, Dataset], spec: OutputSpec, output_dir: str, metadata: Dict[str, Any],
+                  max_workers: int = WORKER_PROCESSES) -> Dict[str, Any]:
+    """Write the rows of every row set as partitioned files under ``output_dir`` and return its manifest.
+
+    Input chunks are split by partition in parallel (writing the columnar
+    files), then every partition's CSV is written by its own pool task.
+    Files go to a staging directory that replaces ``output_dir`` once the
+    manifest is written, so readers never see a partial output.
+    """
+    started = time.perf_counter()
+    for row_set in spec.row_sets:
+        missing = [name for name in spec.partition_by if name not in datasets[row_set].schema]
+        if missing:
+            raise ValueError(f"output partition columns {missing} are not in the {row_set} rows")
+    parent = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent, exist_ok=True)
+    staging = os.path.join(parent, f"{_STAGING_PREFIX}{os.path.basename(output_dir)}-{uuid.uuid4().hex}")
+    columnar = "npz" in spec.formats
+    total_rows = sum(datasets[row_set].num_rows for row_set in spec.row_sets)
+    parallel = max_workers > 1 and total_rows >= OUTPUT_PARALLEL_MIN_ROWS
+    pool = get_process_pool() if parallel else None
+    try:
+        # Partition -> its part files in input order
+        parts: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        calls = []
+        for row_set in spec.row_sets:
+            dataset = datasets[row_set]
+            for index, entry in enumerate(dataset.chunks):
+                calls.append((row_set, (write_partition_chunk, os.path.join(dataset.path, entry["file"]),
+                                        entry["row_offset"], spec.partition_by, staging, row_set, index, columnar)))
+        for row_set, written in _run(pool, calls):
+            for partition, file_entry in written.items():
+                parts.setdefault((row_set, partition), []).append(file_entry)
+        files = [file_entry for entries in parts.values() for file_entry in entries] if columnar else []
+        if "csv.gz" in spec.formats:
+            calls = []
+            for (row_set, partition), entries in sorted(parts.items()):
+                part_files = [os.path.join(staging, file_entry["path"]) for file_entry in entries]
+                calls.append((row_set, (write_partition_csv, part_files, list(datasets[row_set].schema), staging,
+                                        row_set, partition)))
+            files.extend(file_entry for _, file_entry in _run(pool, calls))
+        shutil.rmtree(os.path.join(staging, "_parts"), ignore_errors=True)
+        files.sort(key=lambda file_entry: file_entry["path"])
+        manifest = {
+            **metadata,
+            "created_at": datetime.now().isoformat(),
+            "partition_by": spec.partition_by,
+            "formats": spec.formats,
+            "row_sets": {row_set: {"rows": datasets[row_set].num_rows, "schema": datasets[row_set].schema,
+                                   "partitions": sorted(partition for key, partition in parts if key == row_set)}
+                         for row_set in spec.row_sets},
+            "files": files,
+        }
+        with open(os.path.join(staging, OUTPUT_MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=1)
+        _replace_directory(staging, output_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"📦 Wrote {total_rows} rows as {len(files)} files in {len(parts)} partitions to {output_dir} "
+                f"in {(time.perf_counter() - started):.2f} s")
+    return manifest
+
+
+def _run(pool, calls: List[Tuple[str, tuple]]) -> List[Tuple[str, Any]]:
+    """Results of ``(tag, (function, *args))`` calls, across the pool when one is given."""
+    if pool is None:
+        return [(tag, function(*args)) for tag, (function, *args) in calls]
+    futures = [(tag, pool.submit(function, *args)) for tag, (function, *args) in calls]
+    return [(tag, future.result()) for tag, future in futures]
+
+
+def _replace_directory(source: str, target: str) -> None:
+    """Move ``source`` to ``target``, replacing a previous output there."""
+    previous = None
+    if os.path.exists(target):
+        previous = f"{target}.previous-{uuid.uuid4().hex}"
+        os.replace(target, previous)
+    os.replace(source, target)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
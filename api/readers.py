@@ -0,0 +1,166 @@
+import csv
+import io
+import logging
+import os
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+from columnar import Chunk, convert_column, dtype_to_column_type, infer_column_type
+from config_loader import ColumnSpec
+from compression import detect_compression, open_decompressed
+from fixed_width import read_fixed_width, read_fixed_width_stream
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_ROWS = int(os.environ.get("READ_CHUNK_ROWS", "65536"))
+
+
+class ReadStats:
+    """Counters collected while streaming one file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self.chunks = 0
+        self.malformed_rows = 0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {"path": self.path, "rows": self.rows, "chunks": self.chunks, "malformed_rows": self.malformed_rows}
+
+
+class ColumnLayout:
+    """Resolved column names and types for a delimited file."""
+
+    def __init__(self, names: List[str], types: List[str], formats: List[Optional[str]], positions: List[int],
+                 width: int):
+        self.names = names
+        self.types = types
+        self.formats = formats
+        # Position of each output column in the file's fields
+        self.positions = positions
+        # Number of fields of a well-formed row: the header's, else the declared columns'
+        self.width = width
+
+    @classmethod
+    def resolve(cls, spec, header: Optional[List[str]], width: int) -> "ColumnLayout":
+        if spec.columns:
+            names = [column.name for column in spec.columns]
+            if header is not None:
+                missing = [name for name in names if name not in header]
+                if missing:
+                    raise ValueError(f"Columns {missing} are missing from the file header")
+                positions = [header.index(name) for name in names]
+            else:
+                positions = list(range(len(names)))
+            return cls(names, [c.type for c in spec.columns], [c.format for c in spec.columns], positions,
+                       len(header) if header is not None else len(names))
+        names = header if header is not None else [f"col_{i + 1}" for i in range(width)]
+        # Types are inferred from the first chunk when the config does not declare columns
+        return cls(list(names), [None] * len(names), [None] * len(names), list(range(len(names))), len(names))
+
+
+def iter_row_batches(reader, batch_rows: int) -> Iterator[List[List[str]]]:
+    batch = []
+    for row in reader:
+        if not row:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def rows_to_chunk(rows: List[List[str]], layout: ColumnLayout, row_offset: int, stats: ReadStats) -> Chunk:
+    """Transpose a batch of parsed rows into typed columns.
+
+    Rows with more or fewer fields than the file's width are counted as
+    malformed and padded or cut to it.
+    """
+    width = layout.width
+    for i, row in enumerate(rows):
+        if len(row) != width:
+            stats.malformed_rows += 1
+            rows[i] = (row + [""] * width)[:width]
+    fields = list(zip(*rows)) if rows else [()] * width
+    columns: Dict[str, np.ndarray] = {}
+    nulls: Dict[str, np.ndarray] = {}
+    invalid: Dict[str, np.ndarray] = {}
+    for index, name in enumerate(layout.names):
+        raw = np.array(fields[layout.positions[index]], dtype=str)
+        if layout.types[index] is None:
+            layout.types[index] = infer_column_type(raw)
+        values, null_mask, invalid_mask = convert_column(raw, layout.types[index], layout.formats[index])
+        columns[name] = values
+        if null_mask.any():
+            nulls[name] = null_mask
+        if invalid_mask.any():
+            invalid[name] = invalid_mask
+    return Chunk(columns, row_offset, nulls, invalid)
+
+
+def read_delimited(stream: TextIO, spec, stats: ReadStats, chunk_rows: int = READ_CHUNK_ROWS,
+                   header: Optional[List[str]] = None, row_offset: int = 0) -> Iterator[Chunk]:
+    """Stream a CSV or delimited ``.dat`` file as typed column chunks.
+
+    At most ``chunk_rows`` parsed rows are held at a time, so memory stays
+    bounded regardless of file size. ``header`` is passed in when the stream
+    starts after the header line (e.g. a byte range of a larger file).
+    """
+    reader = csv.reader(stream, delimiter=spec.delimiter)
+    if header is None and spec.has_header:
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [name.strip() for name in header]
+    layout = None
+    for rows in iter_row_batches(reader, chunk_rows):
+        if layout is None:
+            layout = ColumnLayout.resolve(spec, header, len(rows[0]))
+        chunk = rows_to_chunk(rows, layout, row_offset, stats)
+        row_offset += chunk.num_rows
+        stats.rows += chunk.num_rows
+        stats.chunks += 1
+        yield chunk
+
+
+def open_text(path: str, encoding: str) -> TextIO:
+    """Open a (possibly gzip/zstd/bz2 compressed) extract as text, decompressing on the fly."""
+    return io.TextIOWrapper(open_decompressed(path), encoding=encoding, newline="")
+
+
+def read_file(path: str, spec, chunk_rows: int = READ_CHUNK_ROWS) -> Tuple[ReadStats, Iterator[Chunk]]:
+    """Open ``path`` according to the side's config and return its chunk stream."""
+    stats = ReadStats(path)
+
+    def chunks() -> Iterator[Chunk]:
+        if spec.file_format == "fixed_width":
+            if detect_compression(path):
+                with open_decompressed(path) as stream:
+                    yield from read_fixed_width_stream(stream, spec, stats, chunk_rows)
+            else:
+                yield from read_fixed_width(path, spec, stats, chunk_rows)
+            return
+        with open_text(path, spec.encoding) as stream:
+            yield from read_delimited(stream, spec, stats, chunk_rows)
+
+    return stats, chunks()
+
+
+def infer_spec(path: str, spec, sample_rows: int = 10000):
+    """Return ``spec`` with column names and types filled in from the start of ``path``.
+
+    Used when the config does not declare columns, so every file of a side
+    ends up with the same schema.
+    """
+    if spec.columns or spec.file_format == "fixed_width":
+        return spec
+    stats = ReadStats(path)
+    with open_text(path, spec.encoding) as stream:
+        chunk = next(read_delimited(stream, spec, stats, sample_rows), None)
+    if chunk is None:
+        return spec
+    columns = [ColumnSpec(name=name, type=dtype_to_column_type(values)) for name, values in chunk.columns.items()]
+    return spec.model_copy(update={"columns": columns})
@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(obj: Any) -> int:
+    """Approximate the in-memory footprint of a JSON-like node output in bytes."""
+    size = 0
+    stack = [obj]
+    seen = set()
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (dict, list, tuple)):
+            if id(item) in seen:
+                continue
+            seen.add(id(item))
+            size += sys.getsizeof(item)
+            if isinstance(item, dict):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+            else:
+                stack.extend(item)
+        else:
+            size += sys.getsizeof(item)
+    return size
+
+
+class ResultStore:
+    """Keeps node outputs under a global memory budget.
+
+    Outputs are held in memory in least-recently-accessed order. When the
+    budget is exceeded the coldest outputs are written to compressed JSON
+    files under ``spill_dir`` and transparently reloaded by ``get``. The
+    lock only guards the indexes: outputs are encoded, compressed, written
+    and read outside it, and an output being spilled is still served from
+    memory until its file is in place.
+    """
+
+    def __init__(self, memory_budget_bytes: int, spill_dir: str):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.spill_dir = spill_dir
+        self._lock = threading.RLock()
+        # key -> (output, estimated size); ordered from coldest to hottest
+        self._memory: "OrderedDict[str, Tuple[Dict, int]]" = OrderedDict()
+        # key -> (spill file path, estimated size)
+        self._spilled: Dict[str, Tuple[str, int]] = {}
+        # key -> (output, estimated size, write token) while its spill file is written
+        self._spilling: Dict[str, Tuple[Dict, int, str]] = {}
+        # Temporary files of spills in progress, left alone by compact
+        self._writing: Set[str] = set()
+        self._memory_bytes = 0
+        self._spill_count = 0
+        self._reload_count = 0
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._memory or key in self._spilling or key in self._spilled
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memory) + len(self._spilling) + len(self._spilled)
+
+    def put(self, key: str, output: Dict) -> None:
+        size = estimate_size(output)
+        with self._lock:
+            self._discard(key)
+            if size > self.memory_budget_bytes:
+                # Never let a single oversized output push everything else out
+                evicted = [self._start_spill(key, output, size)]
+            else:
+                self._memory[key] = (output, size)
+                self._memory_bytes += size
+                evicted = self._evict()
+        self._write_spills(evicted)
+
+    def get(self, key: str) -> Optional[Dict]:
+        while True:
+            with self._lock:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    return self._memory[key][0]
+                if key in self._spilling:
+                    return self._spilling[key][0]
+                if key not in self._spilled:
+                    return None
+                path, size = self._spilled[key]
+            try:
+                output = self._read_spill(path)
+            except FileNotFoundError:
+                # Deleted or replaced while it was read, look again
+                continue
+            evicted = []
+            with self._lock:
+                self._reload_count += 1
+                if self._spilled.get(key) == (path, size) and size <= self.memory_budget_bytes:
+                    del self._spilled[key]
+                    self._remove_file(path)
+                    self._memory[key] = (output, size)
+                    self._memory_bytes += size
+                    evicted = self._evict()
+            self._write_spills(evicted)
+            return output
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._memory.keys()) + list(self._spilling.keys()) + list(self._spilled.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "memory_bytes": self._memory_bytes,
+                "in_memory": len(self._memory),
+                "spilling": len(self._spilling),
+                "spilled": len(self._spilled),
+                "spilled_bytes": sum(size for _, size in self._spilled.values()),
+                "spill_count": self._spill_count,
+                "reload_count": self._reload_count,
+            }
+
+    def delete_many(self, keys) -> int:
+        deleted = 0
+        with self._lock:
+            for key in keys:
+                if key in self._memory or key in self._spilling or key in self._spilled:
+                    self._discard(key)
+                    deleted += 1
+        return deleted
+
+    def compact(self) -> Dict[str, int]:
+        """Reclaim space left behind by deleted results.
+
+        Rebuilds the index dictionaries (Python dicts never shrink on delete)
+        and removes spill files that are no longer referenced.
+        """
+        with self._lock:
+            self._memory = OrderedDict(self._memory)
+            self._spilled = dict(self._spilled)
+            referenced = {path for path, _ in self._spilled.values()} | self._writing
+        removed_files = 0
+        reclaimed_bytes = 0
+        with os.scandir(self.spill_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.path in referenced:
+                    continue
+                with self._lock:
+                    # Re-check under the lock, the entry may have been spilled meanwhile
+                    if entry.path in self._writing or any(path == entry.path for path, _ in self._spilled.values()):
+                        continue
+                    try:
+                        reclaimed_bytes += entry.stat().st_size
+                        os.remove(entry.path)
+                        removed_files += 1
+                    except FileNotFoundError:
+                        pass
+        return {"removed_files": removed_files, "reclaimed_bytes": reclaimed_bytes}
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._spilled):
+                self._discard(key)
+            self._memory.clear()
+            self._spilling.clear()
+            self._memory_bytes = 0
+
+    def _discard(self, key: str) -> None:
+        if key in self._memory:
+            _, size = self._memory.pop(key)
+            self._memory_bytes -= size
+        # A spill still being written notices it was dropped when it finishes
+        self._spilling.pop(key, None)
+        if key in self._spilled:
+            path, _ = self._spilled.pop(key)
+            self._remove_file(path)
+
+    def _evict(self) -> List[Tuple[str, Dict, int, str]]:
+        """Move the coldest outputs over the budget to ``_spilling``; called with the lock held."""
+        evicted = []
+        while self._memory_bytes > self.memory_budget_bytes and self._memory:
+            key, (output, size) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            evicted.append(self._start_spill(key, output, size))
+        return evicted
+
+    def _start_spill(self, key: str, output: Dict, size: int) -> Tuple[str, Dict, int, str]:
+        token = uuid.uuid4().hex
+        self._spilling[key] = (output, size, token)
+        return key, output, size, token
+
+    def _spill_path(self, key: str, token: str) -> str:
+        safe_key = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        return os.path.join(self.spill_dir, f"{safe_key}-{token[:12]}.json.z")
+
+    def _write_spills(self, evicted: List[Tuple[str, Dict, int, str]]) -> None:
+        """Write the files of spills started under the lock, without holding it."""
+        for key, output, size, token in evicted:
+            path = self._spill_path(key, token)
+            tmp_path = f"{path}.tmp"
+            with self._lock:
+                self._writing.add(tmp_path)
+            try:
+                payload = zlib.compress(json.dumps(output, separators=(",", ":"), default=str).encode("utf-8"), 1)
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                with self._lock:
+                    pending = self._spilling.get(key)
+                    if pending is None or pending[2] != token:
+                        # Deleted or replaced meanwhile
+                        self._remove_file(tmp_path)
+                        continue
+                    os.replace(tmp_path, path)
+                    del self._spilling[key]
+                    self._spilled[key] = (path, size)
+                    self._spill_count += 1
+            except OSError:
+                with self._lock:
+                    pending = self._spilling.get(key)
+                    if pending is not None and pending[2] == token:
+                        # Keep the output in memory rather than lose it
+                        del self._spilling[key]
+                        self._memory[key] = (output, size)
+                        self._memory_bytes += size
+                self._remove_file(tmp_path)
+                logger.exception(f"❌ Failed to spill result {key}, keeping it in memory")
+                continue
+            finally:
+                with self._lock:
+                    self._writing.discard(tmp_path)
+            logger.info(f"💾 Spilled result {key} to disk ({size} bytes in memory, {len(payload)} on disk)")
+
+    def _read_spill(self, path: str) -> Dict:
+        with open(path, "rb") as f:
+            return json.loads(zlib.decompress(f.read()).decode("utf-8"))
+
+    def _remove_file(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Processes in these states may still produce an output and are never expired
+ACTIVE_STATUSES = {"pending", "running"}
+
+
+class RetentionPolicy(BaseModel):
+    """How long results of one node type are kept.
+
+    ``keep_runs`` keeps the N most recent runs per instance and expectedRunDate,
+    ``max_age_days`` drops runs older than X days. Either may be combined.
+    """
+    keep_runs: Optional[int] = None
+    max_age_days: Optional[float] = None
+
+
+# Retention is opt-in: without a config nothing expires, as frontends may still pass old outputs as previousOutputs
+DEFAULT_RETENTION_POLICIES: Dict[str, RetentionPolicy] = {}
+
+
+def load_retention_policies(config_path: Optional[str] = None) -> Dict[str, RetentionPolicy]:
+    """Load per node type policies from a JSON file.
+
+    The file maps node types (or ``default``) to policies, e.g.
+    ``{"default": {"keep_runs": 3}, "combine_data_comp": {"max_age_days": 2}}``.
+    Node types without a policy (and no ``default``) are kept.
+    """
+    if not config_path:
+        return dict(DEFAULT_RETENTION_POLICIES)
+    if not os.path.exists(config_path):
+        logger.warning(f"⚠️ Retention config {config_path} not found, retention is disabled")
+        return dict(DEFAULT_RETENTION_POLICIES)
+    with open(config_path) as f:
+        raw = json.load(f)
+    policies = dict(DEFAULT_RETENTION_POLICIES)
+    for node_type, policy in raw.items():
+        policies[node_type] = RetentionPolicy(**policy)
+    return policies
+
+
+def policy_for(node_id: str, policies: Dict[str, RetentionPolicy]) -> RetentionPolicy:
+    return policies.get(node_id) or policies.get("default") or RetentionPolicy()
+
+
+def input_runs(previous_outputs: Optional[Dict[str, Any]]) -> Set[str]:
+    """Ids of the runs whose datasets (``<tempFilePath>/datasets/<run id>/...``) a node's inputs reference."""
+    runs = set()
+    for output in (previous_outputs or {}).values():
+        results = (output or {}).get("calculation_results") or {}
+        infos = [results.get("dataset")] + list((results.get("datasets") or {}).values())
+        for info in infos:
+            if not isinstance(info, dict) or not info.get("path"):
+                continue
+            parts = os.path.normpath(info["path"]).split(os.sep)
+            for position in range(len(parts) - 2, -1, -1):
+                if parts[position] == "datasets":
+                    runs.add(parts[position + 1])
+                    break
+    return runs
+
+
+def select_expired(processes: Dict[str, Any], policies: Dict[str, RetentionPolicy], now: Optional[float] = None) -> List[str]:
+    """Return the ids of finished processes that fall outside their retention policy."""
+    now = time.time() if now is None else now
+    groups: Dict[Tuple[str, Optional[str], Optional[str]], List[Any]] = defaultdict(list)
+    for process in processes.values():
+        if process.status in ACTIVE_STATUSES:
+            continue
+        run_date = (process.parameters or {}).get("expectedRunDate")
+        groups[(process.node_id, process.instance_id, run_date)].append(process)
+
+    expired = []
+    for (node_id, _, _), runs in groups.items():
+        policy = policy_for(node_id, policies)
+        runs.sort(key=lambda p: p.start_time, reverse=True)
+        for index, process in enumerate(runs):
+            too_many = policy.keep_runs is not None and index >= policy.keep_runs
+            too_old = policy.max_age_days is not None and now - process.start_time > policy.max_age_days * 86400
+            if too_many or too_old:
+                expired.append(process.process_id)
+    return expired
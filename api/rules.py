@@ -0,0 +1,409 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from columnar import Chunk, Dataset, DatasetWriter, DictionaryArray, code_dtype, read_chunk_file, write_chunk_file
+from config_loader import RuleSpec
+from expressions import ExpressionProgram, Node, Vector, compile_program, evaluate_node, reachable_nodes, take_vector
+from workers import WORKER_PROCESSES, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Datasets smaller than this are classified in-process
+RULES_PARALLEL_MIN_ROWS = int(os.environ.get("RULES_PARALLEL_MIN_ROWS", "2000000"))
+# Weight of earlier runs in the stored rule statistics; each run's counts are added to the decayed totals
+RULE_STATS_DECAY = float(os.environ.get("RULE_STATS_DECAY", "0.8"))
+# Hit rate assumed for rules without statistics
+_DEFAULT_SELECTIVITY = 0.5
+
+RULE_COLUMN = "rule"
+RULE_HITS_COLUMN = "rule_hits"
+
+# Set bits of every byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.int64)
+
+_stats_locks: Dict[str, threading.Lock] = {}
+_stats_locks_guard = threading.Lock()
+
+
+def popcount(bitmap: np.ndarray) -> int:
+    return int(_POPCOUNT[bitmap].sum())
+
+
+def hit_bitmap(vector: Vector, num_rows: int) -> np.ndarray:
+    """Rows where a rule's condition is true (not null), packed eight to a byte."""
+    return np.packbits(np.broadcast_to(_hits(vector), (num_rows,)))
+
+
+def _hits(vector: Vector):
+    return np.asarray(vector.values, dtype=bool) & ~np.asarray(vector.nulls, dtype=bool)
+
+
+def add_to_counter(planes: List[np.ndarray], bitmap: np.ndarray) -> None:
+    """Add one bitmap to a bit-sliced counter: ``planes[k]`` holds bit k of every row's count."""
+    carry = bitmap
+    for plane in planes:
+        if not carry.any():
+            return
+        carry, plane[:] = plane & carry, plane ^ carry
+    if carry.any():
+        planes.append(carry.copy())
+
+
+class _Evaluation:
+    """Node results of one chunk for a sequence of rules, each on its own rows.
+
+    Results of nodes that several rules share are kept until the last of
+    those rules has run, and reused for any subset of the rows they were
+    computed on.
+    """
+
+    def __init__(self, program: "RuleProgram", chunk: Chunk, order: List[int]):
+        self.program = program
+        self.columns = {name: Vector(chunk.columns[name], chunk.nulls.get(name, np.False_))
+                        for name in program.input_columns}
+        self.shared: Dict[int, Tuple[Optional[np.ndarray], Vector]] = {}
+        # Shared nodes to forget after each rule, by evaluation position
+        last_use: Dict[int, int] = {}
+        for position, index in enumerate(order):
+            for key in program.shared_nodes[index]:
+                last_use[key] = position
+        self.releases: Dict[int, List[int]] = {}
+        for key, position in last_use.items():
+            self.releases.setdefault(position, []).append(key)
+
+    def _reuse(self, key: int, rows: Optional[np.ndarray]) -> Optional[Vector]:
+        cached = self.shared.get(key)
+        if cached is None:
+            return None
+        cached_rows, vector = cached
+        if cached_rows is None:
+            return vector if rows is None else take_vector(vector, rows)
+        if rows is None or len(rows) > len(cached_rows):
+            return None
+        positions = np.searchsorted(cached_rows, rows)
+        if len(rows) and (positions[-1] >= len(cached_rows) or not np.array_equal(cached_rows[positions], rows)):
+            return None
+        return take_vector(vector, positions)
+
+    def _keep(self, key: int, rows: Optional[np.ndarray]) -> bool:
+        """Whether a new result replaces the kept one: only if it covers more rows."""
+        cached = self.shared.get(key)
+        return cached is None or rows is None or (cached[0] is not None and len(rows) > len(cached[0]))
+
+    def evaluate(self, index: int, rows: Optional[np.ndarray]) -> Vector:
+        """Result of rule ``index`` on ``rows`` (sorted positions, or None for all rows)."""
+        shared_keys = self.program.shared_keys
+        values: Dict[int, Vector] = {}
+
+        def value(node: Node) -> Vector:
+            key = id(node)
+            if key in values:
+                return values[key]
+            vector = self._reuse(key, rows) if key in shared_keys else None
+            if vector is None:
+                if node.op == "column":
+                    vector = self.columns[node.value]
+                    vector = vector if rows is None else take_vector(vector, rows)
+                elif node.is_constant:
+                    vector = node.constant()
+                else:
+                    vector = evaluate_node(node, [value(arg) for arg in node.args])
+                if key in shared_keys and self._keep(key, rows):
+                    self.shared[key] = (rows, vector)
+            values[key] = vector
+            return vector
+
+        return value(self.program.roots[index])
+
+    def release(self, position: int) -> None:
+        for key in self.releases.get(position, ()):
+            self.shared.pop(key, None)
+
+
+class RuleProgram:
+    """A rule pack compiled into one expression graph.
+
+    Conditions are hash-consed into a single graph, so a predicate shared
+    by many rules runs once per chunk. Without short-circuiting each rule's
+    result is packed into a hit bitmap and the first hit of every row and
+    its number of hits are derived with bitwise operations on the bitmaps.
+    With it, a rule only runs on the rows whose first rule it could still
+    be, so rules can run in any order and still give the first hit in pack
+    order.
+    """
+
+    def __init__(self, rules: List[Tuple[str, str]], program: ExpressionProgram, rule_columns: bool,
+                 short_circuit: bool = False):
+        self.names = [name for name, _ in rules]
+        self.conditions = [condition for _, condition in rules]
+        self.program = program
+        self.rule_columns = rule_columns
+        self.short_circuit = short_circuit
+        self.roots = [node for _, node in program.outputs]
+        self.input_columns = program.input_columns
+        self.dictionary = np.array(sorted(self.names) or [""])
+        # Dictionary code of each rule, in pack order
+        self.codes = np.searchsorted(self.dictionary, self.names).astype(code_dtype(len(self.dictionary)))
+        self.rule_nodes = [reachable_nodes([root]) for root in self.roots]
+        users: Dict[int, int] = {}
+        for nodes in self.rule_nodes:
+            for node in nodes:
+                if not node.is_constant:
+                    users[id(node)] = users.get(id(node), 0) + 1
+        self.shared_keys = {key for key, count in users.items() if count > 1}
+        self.shared_nodes = [[id(node) for node in nodes if id(node) in self.shared_keys] for nodes in self.rule_nodes]
+        self.schema = {**program.input_schema, RULE_COLUMN: "str"}
+        if not short_circuit:
+            self.schema[RULE_HITS_COLUMN] = "int"
+            if rule_columns:
+                self.schema.update({name: "bool" for name in self.names})
+
+    def describe(self) -> Dict[str, int]:
+        """Graph size, and the number of operations the rules would need if evaluated independently."""
+        return {"rules": len(self.names), "nodes": self.program.describe()["nodes"],
+                "independent_nodes": sum(len(nodes) for nodes in self.rule_nodes),
+                "constants_folded": self.program.folded}
+
+    def node_counts(self) -> List[int]:
+        return [len(nodes) for nodes in self.rule_nodes]
+
+    def apply(self, chunk: Chunk, order: Optional[List[int]] = None) -> Tuple[Chunk, Dict[str, List[float]]]:
+        """The chunk with its outcome columns, and ``[rows evaluated, hits, first hits, seconds]`` per rule.
+
+        ``order`` is the evaluation order as pack positions; it only
+        matters when short-circuiting.
+        """
+        order = list(range(len(self.names))) if order is None else order
+        if self.short_circuit:
+            first_rule, counts, extra = self._short_circuit(chunk, order)
+        else:
+            first_rule, counts, extra = self._bitmaps(chunk, order)
+        num_rows = chunk.num_rows
+        columns, nulls = dict(chunk.columns), dict(chunk.nulls)
+        codes = self.codes[np.maximum(first_rule, 0)] if len(self.codes) else np.zeros(num_rows, dtype=np.uint8)
+        columns[RULE_COLUMN] = DictionaryArray(codes, self.dictionary)
+        nulls[RULE_COLUMN] = first_rule < 0
+        for name, values in extra.items():
+            columns[name] = values
+            nulls.pop(name, None)
+        return Chunk(columns, chunk.row_offset, nulls, dict(chunk.invalid)), counts
+
+    def _bitmaps(self, chunk: Chunk, order: List[int]):
+        num_rows = chunk.num_rows
+        evaluation = _Evaluation(self, chunk, order)
+        bitmaps: List[Optional[np.ndarray]] = [None] * len(self.names)
+        counts = {}
+        for position, index in enumerate(order):
+            started = time.perf_counter()
+            bitmaps[index] = hit_bitmap(evaluation.evaluate(index, None), num_rows)
+            evaluation.release(position)
+            counts[self.names[index]] = [num_rows, popcount(bitmaps[index]), 0, time.perf_counter() - started]
+        claimed = np.zeros((num_rows + 7) // 8, dtype=np.uint8)
+        planes: List[np.ndarray] = []
+        first_rule = np.full(num_rows, -1, dtype=np.int32)
+        for index, (name, bitmap) in enumerate(zip(self.names, bitmaps)):
+            first = bitmap & ~claimed
+            claimed |= bitmap
+            add_to_counter(planes, bitmap)
+            first_hits = popcount(first)
+            if first_hits:
+                first_rule[np.unpackbits(first, count=num_rows).view(bool)] = index
+            counts[name][2] = first_hits
+        hits = np.zeros(num_rows, dtype=np.int64)
+        for bit, plane in enumerate(planes):
+            hits += np.unpackbits(plane, count=num_rows).astype(np.int64) << bit
+        extra = {RULE_HITS_COLUMN: hits}
+        if self.rule_columns:
+            extra.update({name: np.unpackbits(bitmap, count=num_rows).view(bool)
+                          for name, bitmap in zip(self.names, bitmaps)})
+        return first_rule, counts, extra
+
+    def _short_circuit(self, chunk: Chunk, order: List[int]):
+        num_rows = chunk.num_rows
+        evaluation = _Evaluation(self, chunk, order)
+        # Pack position of the first rule each row hit among the rules run so far
+        best = np.full(num_rows, len(self.names), dtype=np.int32)
+        counts = {}
+        for position, index in enumerate(order):
+            started = time.perf_counter()
+            open_rows = np.flatnonzero(best > index)
+            hits = 0
+            if len(open_rows):
+                rows = None if len(open_rows) == num_rows else open_rows
+                hit = np.broadcast_to(_hits(evaluation.evaluate(index, rows)), (len(open_rows),))
+                best[open_rows[hit]] = index
+                hits = int(np.count_nonzero(hit))
+            evaluation.release(position)
+            counts[self.names[index]] = [len(open_rows), hits, 0, time.perf_counter() - started]
+        first_rule = np.where(best < len(self.names), best, -1)
+        for index, first_hits in enumerate(np.bincount(first_rule[first_rule >= 0], minlength=len(self.names))):
+            counts[self.names[index]][2] = int(first_hits)
+        return first_rule, counts, {}
+
+
+def compile_rules(rules: List[Tuple[str, str]], schema: Dict[str, str], variables: Dict[str, Any],
+                  rule_columns: bool = False, short_circuit: bool = False) -> RuleProgram:
+    """Compile ``(name, condition)`` pairs against ``schema``; the expression graph is cached by compile_program."""
+    shadowed = sorted(name for name, _ in rules if name in schema)
+    if shadowed:
+        raise ValueError(f"rule names {shadowed} are also column names")
+    program = compile_program(rules, [], schema, variables)
+    for name, node in program.outputs:
+        if node.type not in ("bool", "null"):
+            raise ValueError(f"rule '{name}' must be a condition, got {node.type}")
+    return RuleProgram(rules, program, rule_columns, short_circuit)
+
+
+class RuleStats:
+    """Evaluation cost and hit rate of every rule, accumulated over runs in a JSON file.
+
+    Rules are keyed by name and a hash of their condition, so an edited rule
+    starts afresh. Totals decay by ``RULE_STATS_DECAY`` per run so that the
+    order follows changes in the data.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, float]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f).get("rules", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Ignoring unreadable rule statistics {path}: {e}")
+
+    @staticmethod
+    def key(name: str, condition: str) -> str:
+        return f"{name}:{hashlib.sha256(condition.encode()).hexdigest()[:16]}"
+
+    def order(self, program: RuleProgram) -> List[int]:
+        """Pack positions sorted by expected seconds per row removed: cost per row over hit rate.
+
+        Rules without statistics are costed by their number of operations at
+        the average cost per operation of the known rules. Rules that had no
+        rows left to evaluate in earlier runs go last.
+        """
+        known = [self.entries.get(self.key(name, condition)) for name, condition in
+                 zip(program.names, program.conditions)]
+        node_counts = program.node_counts()
+        per_node = [entry["seconds"] / entry["rows"] / count for entry, count in zip(known, node_counts)
+                    if entry and entry["rows"] > 0]
+        node_seconds = sum(per_node) / len(per_node) if per_node else 1.0
+
+        def rank(index: int) -> float:
+            entry = known[index]
+            if entry and entry["rows"] <= 0:
+                return float("inf")
+            if entry:
+                cost, selectivity = entry["seconds"] / entry["rows"], entry["hits"] / entry["rows"]
+            else:
+                cost, selectivity = node_counts[index] * node_seconds, _DEFAULT_SELECTIVITY
+            return cost / max(selectivity, 1e-9)
+
+        return sorted(range(len(program.names)), key=lambda index: (rank(index), index))
+
+    def update(self, program: RuleProgram, totals: Dict[str, List[float]]) -> None:
+        seen = set()
+        for name, condition in zip(program.names, program.conditions):
+            key = self.key(name, condition)
+            seen.add(key)
+            rows, hits, _, seconds = totals[name]
+            previous = self.entries.get(key, {"rows": 0.0, "hits": 0.0, "seconds": 0.0, "runs": 0})
+            self.entries[key] = {"rows": previous["rows"] * RULE_STATS_DECAY + rows,
+                                 "hits": previous["hits"] * RULE_STATS_DECAY + hits,
+                                 "seconds": previous["seconds"] * RULE_STATS_DECAY + seconds,
+                                 "runs": previous["runs"] + 1}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"rules": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+
+def rule_stats_path(root: str, control: str, row_set: str) -> str:
+    """Statistics file of one control's rules for one row set under ``root``."""
+    return os.path.join(root, "rule_stats", f"{re.sub(r'[^A-Za-z0-9_.-]', '_', control)}_{row_set}.json")
+
+
+def _stats_lock(path: str) -> threading.Lock:
+    with _stats_locks_guard:
+        return _stats_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def rules_chunk_file(rules: List[Tuple[str, str]], schema: Dict[str, str], variables: Dict[str, Any],
+                     rule_columns: bool, short_circuit: bool, order: List[int], path: str, row_offset: int,
+                     output_path: str) -> Tuple[int, Dict[str, List[float]]]:
+    """Pool entry point: classify one chunk file; returns its row count and per-rule counts."""
+    program = compile_rules(rules, schema, variables, rule_columns, short_circuit)
+    chunk, counts = program.apply(read_chunk_file(path, row_offset), order)
+    write_chunk_file(output_path, chunk)
+    return chunk.num_rows, counts
+
+
+def apply_rules(dataset: Dataset, specs: List[RuleSpec], variables: Dict[str, Any], output_path: str,
+                rule_columns: bool = False, short_circuit: bool = False, stats_path: Optional[str] = None,
+                max_workers: int = WORKER_PROCESSES) -> Tuple[Dataset, Dict[str, Any]]:
+    """Classify every row of ``dataset`` by the rule pack; returns the annotated dataset and rule statistics.
+
+    With ``stats_path``, per-rule cost and hit rates of earlier runs order
+    the rules when short-circuiting, and this run's figures are added.
+    """
+    started = time.perf_counter()
+    rules = [(spec.name, spec.condition) for spec in specs]
+    program = compile_rules(rules, dataset.schema, variables, rule_columns, short_circuit)
+    lock = _stats_lock(stats_path) if stats_path else None
+    if lock:
+        with lock:
+            order = RuleStats(stats_path).order(program) if short_circuit else list(range(len(rules)))
+    else:
+        order = list(range(len(rules)))
+    writer = DatasetWriter(output_path, program.schema)
+    totals = {name: [0, 0, 0, 0.0] for name in program.names}
+
+    def count(counts: Dict[str, List[float]]) -> None:
+        for name, values in counts.items():
+            totals[name] = [total + value for total, value in zip(totals[name], values)]
+
+    if len(dataset.chunks) <= 1 or max_workers <= 1 or dataset.num_rows < RULES_PARALLEL_MIN_ROWS:
+        for chunk in dataset.iter_chunks():
+            annotated, counts = program.apply(chunk, order)
+            writer.write(annotated)
+            count(counts)
+    else:
+        pool = get_process_pool()
+        futures = []
+        for index, entry in enumerate(dataset.chunks):
+            file_name = f"chunk_{index:06d}.npz"
+            futures.append((file_name, pool.submit(rules_chunk_file, rules, dataset.schema, variables, rule_columns,
+                                                   short_circuit, order, os.path.join(dataset.path, entry["file"]),
+                                                   entry["row_offset"], os.path.join(output_path, file_name))))
+        for file_name, future in futures:
+            num_rows, counts = future.result()
+            writer.add_chunk_file(file_name, num_rows)
+            count(counts)
+    result = writer.close({"source": dataset.path})
+    if lock:
+        with lock:
+            rule_stats = RuleStats(stats_path)
+            rule_stats.update(program, totals)
+            rule_stats.save()
+    stats = {**program.describe(), "rows": result.num_rows, "short_circuit": short_circuit,
+             "order": [program.names[index] for index in order],
+             "rows_hit": sum(int(first_hits) for _, _, first_hits, _ in totals.values()),
+             "hits": {name: {"rows_evaluated": int(rows), "hits": int(hits), "first_hits": int(first_hits),
+                             "seconds": round(seconds, 4)}
+                      for name, (rows, hits, first_hits, seconds) in totals.items()}}
+    logger.info(f"📏 Applied {len(rules)} rules ({stats['nodes']} operations, {stats['independent_nodes']} if evaluated "
+                f"one by one) to {result.num_rows} rows: {stats['rows_hit']} hit in "
+                f"{(time.perf_counter() - started):.2f} s")
+    return result, stats
@@ -0,0 +1,146 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LEASES_DIR = "leases"
+# Released indexes stay mapped for reuse by the next chunk or run until this many are idle
+SHARED_INDEX_MAX_IDLE = int(os.environ.get("SHARED_INDEX_MAX_IDLE", "8"))
+
+
+class _Attachment:
+    __slots__ = ("value", "refs")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.refs = 0
+
+
+def _lease_path(path: str) -> str:
+    return os.path.join(path, LEASES_DIR, str(os.getpid()))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedIndexRegistry:
+    """Read-only index directories attached by this process, with reference counts.
+
+    ``loader`` opens an index directory with memory-mapped arrays, so every
+    process that attaches the same directory shares one copy of its pages in
+    the OS page cache instead of holding a private copy. While attached, the
+    process holds a lease file in the directory so ``cleanup_index_cache``
+    never removes an index that is in use; the lease goes when the last
+    reference is released and the idle mapping is evicted.
+    """
+
+    def __init__(self, loader: Callable[[str], Any], max_idle: int = SHARED_INDEX_MAX_IDLE):
+        self.loader = loader
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._attached: Dict[str, _Attachment] = {}
+        self._idle: "OrderedDict[str, None]" = OrderedDict()
+
+    def acquire(self, path: str) -> Any:
+        with self._lock:
+            attachment = self._attached.get(path)
+            if attachment is None:
+                os.makedirs(os.path.join(path, LEASES_DIR), exist_ok=True)
+                open(_lease_path(path), "w").close()
+                attachment = self._attached[path] = _Attachment(self.loader(path))
+            attachment.refs += 1
+            self._idle.pop(path, None)
+        # The directory mtime records when the index was last used, for cache cleanup
+        os.utime(path)
+        return attachment.value
+
+    def is_attached(self, path: str) -> bool:
+        with self._lock:
+            return path in self._attached
+
+    def release(self, path: str) -> None:
+        with self._lock:
+            attachment = self._attached.get(path)
+            if attachment is None:
+                return
+            attachment.refs -= 1
+            if attachment.refs > 0:
+                return
+            self._idle[path] = None
+            while len(self._idle) > self.max_idle:
+                self._detach(self._idle.popitem(last=False)[0])
+
+    def _detach(self, path: str) -> None:
+        # Dropping the last reference to the arrays unmaps them
+        self._attached.pop(path, None)
+        try:
+            os.remove(_lease_path(path))
+        except FileNotFoundError:
+            pass
+
+    def detach_idle(self) -> int:
+        with self._lock:
+            paths = list(self._idle)
+            self._idle.clear()
+            for path in paths:
+                self._detach(path)
+            return len(paths)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"attached": len(self._attached), "idle": len(self._idle),
+                    "references": sum(attachment.refs for attachment in self._attached.values())}
+
+
+def live_leases(path: str) -> List[int]:
+    """Pids holding a lease on an index directory; leases of dead processes are removed."""
+    leases_dir = os.path.join(path, LEASES_DIR)
+    if not os.path.isdir(leases_dir):
+        return []
+    alive = []
+    for name in os.listdir(leases_dir):
+        if not name.isdigit():
+            continue
+        if _pid_alive(int(name)):
+            alive.append(int(name))
+        else:
+            try:
+                os.remove(os.path.join(leases_dir, name))
+            except FileNotFoundError:
+                pass
+    return alive
+
+
+def cleanup_index_cache(cache_dir: str, max_age_seconds: float, now: Optional[float] = None) -> int:
+    """Remove index directories unused for ``max_age_seconds`` that no live process has attached."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    now = time.time() if now is None else now
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not os.path.isdir(path):
+            continue
+        try:
+            last_used = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if now - last_used < max_age_seconds or live_leases(path):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logger.info(f"🧹 Removed {removed} unused indexes from {cache_dir}")
+    return removed
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import uuid
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import breaks
+from breaks import BREAK_STORE_INDEX, EVENT_DTYPE, HISTORY_DIR, BreakHistory, BreakStore, roll_breaks
+from columnar import Chunk, DatasetWriter
+
+KEY_SCHEMA = {"id": "int"}
+DAY = date(2024, 1, 2)
+
+
+def roll(tmp_path, run_date, ids, store="store"):
+    tag = uuid.uuid4().hex
+    writer = DatasetWriter(str(tmp_path / "input" / tag / "src_only"), KEY_SCHEMA)
+    writer.write(Chunk({"id": np.asarray(ids, dtype=np.int64)}, 0))
+    return roll_breaks({"src_only": writer.close({})}, {"src_only": None}, ["id"], {}, str(tmp_path / store),
+                       run_date, str(tmp_path / "output" / tag), [])
+
+
+def open_after(tmp_path, run_date, store="store"):
+    """Open breaks of the store after ``run_date`` as {hash: open date}."""
+    state = BreakStore(str(tmp_path / store), KEY_SCHEMA).open_breaks(run_date + timedelta(days=1))
+    return dict(zip(state.hashes.tolist(), state.opened.astype(str).tolist()))
+
+
+def rows_by_id(dataset, *columns):
+    chunk = dataset.read_all()
+    return {key: tuple(str(chunk.columns[column][row]) for column in columns)
+            for row, key in enumerate(chunk.columns["id"].tolist())}
+
+
+def test_breaks_open_then_carry_their_open_date(tmp_path):
+    results, stats = roll(tmp_path, DAY, [1, 2, 3])
+    assert stats["opened"] == 3 and stats["open"] == 3
+    assert set(rows_by_id(results["src_only"], "break_status").values()) == {("new",)}
+
+    results, stats = roll(tmp_path, DAY + timedelta(days=1), [2, 3, 4])
+    assert rows_by_id(results["src_only"], "break_status", "break_opened", "break_age_days") == {
+        2: ("carried", "2024-01-02", "1"), 3: ("carried", "2024-01-02", "1"), 4: ("new", "2024-01-03", "0")}
+    assert stats["opened"] == 1 and stats["open"] == 3
+
+
+def test_breaks_missing_from_a_run_close(tmp_path):
+    roll(tmp_path, DAY, [1, 2, 3])
+    results, stats = roll(tmp_path, DAY + timedelta(days=2), [3])
+    assert stats["closed"] == 2 and stats["open"] == 1
+    assert rows_by_id(results["closed"], "break_opened", "break_closed", "break_age_days") == {
+        1: ("2024-01-02", "2024-01-04", "2"), 2: ("2024-01-02", "2024-01-04", "2")}
+    assert list(open_after(tmp_path, DAY + timedelta(days=2)).values()) == ["2024-01-02"]
+
+
+def test_rerun_of_the_latest_date_replaces_its_run(tmp_path):
+    roll(tmp_path, DAY, [1, 2, 3])
+    roll(tmp_path, DAY + timedelta(days=1), [2, 3, 4])
+    results, stats = roll(tmp_path, DAY + timedelta(days=1), [2, 5])
+    # Compared with the state before the rerun date, not with the run it replaces
+    assert stats["previously_open"] == 3 and stats["closed"] == 2 and stats["opened"] == 1
+    assert stats["store"]["delta_runs"] == 2
+    assert rows_by_id(results["src_only"], "break_status") == {2: ("carried",), 5: ("new",)}
+    assert sorted(open_after(tmp_path, DAY + timedelta(days=1)).values()) == ["2024-01-02", "2024-01-03"]
+
+
+def test_rolling_before_the_latest_date_is_rejected(tmp_path):
+    roll(tmp_path, DAY, [1, 2, 3])
+    roll(tmp_path, DAY + timedelta(days=1), [2, 3, 4])
+    index = (tmp_path / "store" / BREAK_STORE_INDEX).read_text()
+    history = (tmp_path / "store" / "history" / "history.json").read_text()
+    with pytest.raises(ValueError, match="only that date can be rerun"):
+        roll(tmp_path, DAY, [1])
+    assert (tmp_path / "store" / BREAK_STORE_INDEX).read_text() == index
+    assert (tmp_path / "store" / "history" / "history.json").read_text() == history
+
+
+def test_compaction_keeps_the_open_breaks(tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    # Twelve daily runs; the third and seventh, each compacted into the base but for itself, are rerun
+    run_dates = [DAY + timedelta(days=day) for day in range(12)]
+    run_dates = sorted(run_dates + [run_dates[2], run_dates[6]])
+    for run_date in run_dates:
+        ids = rng.choice(40, 25, replace=False)
+        monkeypatch.setattr(breaks, "BREAK_COMPACT_RUNS", 2)
+        _, compacted_stats = roll(tmp_path, run_date, ids, "compacted")
+        monkeypatch.setattr(breaks, "BREAK_COMPACT_RUNS", 1000)
+        _, stats = roll(tmp_path, run_date, ids, "deltas")
+        assert open_after(tmp_path, run_date, "compacted") == open_after(tmp_path, run_date, "deltas")
+        assert {key: compacted_stats[key] for key in ("opened", "closed", "open")} == \
+            {key: stats[key] for key in ("opened", "closed", "open")}
+    index = json.loads((tmp_path / "compacted" / BREAK_STORE_INDEX).read_text())
+    assert index["base"] is not None and len(index["deltas"]) <= 2
+    assert sorted(path.name for path in (tmp_path / "compacted").glob("*.npz")) == \
+        sorted(entry["file"] for entry in [index["base"], *index["deltas"]])
+
+
+def test_history_replays_the_store_state_of_every_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(breaks, "BREAK_HISTORY_SNAPSHOT_RUNS", 3)
+    rng = np.random.default_rng(5)
+    run_dates = [DAY + timedelta(days=day) for day in range(10)]
+    run_dates = sorted(run_dates + [run_dates[5]])
+    expected = {}
+    for run_date in run_dates:
+        roll(tmp_path, run_date, rng.choice(60, 30, replace=False))
+        # A rerun replaces what its date recorded
+        expected[run_date] = open_after(tmp_path, run_date)
+
+    history = BreakHistory(str(tmp_path / "store"))
+    assert len(history.snapshots) > 1
+    for run_date, state in expected.items():
+        hashes, opened = history.open_on(run_date)
+        assert dict(zip(hashes.tolist(), opened.astype("datetime64[D]").astype(str).tolist())) == state
+    # The rerun truncated the log back to before its date: one batch per date and nothing past the last
+    assert [batch["run_date"] for batch in history.batches] == [run_date.isoformat() for run_date in expected]
+    last = history.batches[-1]
+    assert os.path.getsize(history.events_path) == (last["offset"] + last["count"]) * EVENT_DTYPE.itemsize
+
+
+def test_history_started_on_an_existing_store_keeps_baseline_keys(tmp_path):
+    roll(tmp_path, DAY, [1, 2, 3])
+    roll(tmp_path, DAY + timedelta(days=1), [2, 3, 4])
+    shutil.rmtree(tmp_path / "store" / HISTORY_DIR)
+    roll(tmp_path, DAY + timedelta(days=2), [3, 4, 5])
+
+    history = BreakHistory(str(tmp_path / "store"))
+    assert history.snapshots[0]["keys"] and history.snapshots[0]["run_date"] == "2024-01-03"
+    rows = history.open_rows(DAY + timedelta(days=2), 10)["rows"]
+    assert sorted((row["id"], row["break_opened"]) for row in rows) == [
+        (3, "2024-01-02"), (4, "2024-01-03"), (5, "2024-01-04")]
+    events = history.event_rows(DAY + timedelta(days=2), DAY + timedelta(days=2), None, 10)
+    assert events["closed"] == 1 and events["opened"] == 1
+    assert {row["event"]: row["id"] for row in events["rows"]} == {"closed": 2, "opened": 5}
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from columnar import Chunk, DatasetWriter, DictionaryArray
+from combine import combine_datasets
+from config_loader import CombineSpec
+from workers import shutdown_process_pool
+
+
+def teardown_module():
+    shutdown_process_pool()
+
+
+def write_dataset(path, ids, null_keys):
+    # Every value derives from the key, so rows sharing a key are interchangeable whichever of them pairs
+    writer = DatasetWriter(path, None)
+    for part in np.array_split(ids, 6):
+        writer.write(Chunk({"id": np.char.zfill(part.astype(str), 6),
+                            "ccy": DictionaryArray.encode(np.array(["USD", "EUR"])[part % 2]), "amt": part * 1.5},
+                           0, {"amt": part % 7 == 0, "id": null_keys & (part % 997 == 0)}))
+    return writer.close({})
+
+
+def row_sets(datasets):
+    return {name: sorted(map(tuple, dataset.read_all().to_rows()), key=str) for name, dataset in datasets.items()}
+
+
+@pytest.mark.parametrize("presorted, strategy", [(True, "streaming_merge"), (False, "grace_hash")])
+def test_out_of_core_join_matches_in_memory_hash_join(tmp_path, presorted, strategy):
+    rng = np.random.default_rng(7)
+    # Overlapping key ranges, with a key duplicated on the tgt side
+    sides = {"src": np.arange(0, 20000), "tgt": np.sort(np.concatenate([np.arange(10000, 30000), np.full(5, 15000)]))}
+    spilled, shuffled = {}, {}
+    for side, ids in sides.items():
+        # Null keys would make sorted inputs unsortable, so only the grace hash join gets them
+        spilled[side] = write_dataset(str(tmp_path / side), ids if presorted else rng.permutation(ids), not presorted)
+        shuffled[side] = write_dataset(str(tmp_path / f"{side}_shuffled"), rng.permutation(ids), not presorted)
+
+    expected, expected_stats = combine_datasets(shuffled["src"], shuffled["tgt"], CombineSpec(), ["id"],
+                                                str(tmp_path / "hash"), max_workers=1)
+    actual, actual_stats = combine_datasets(spilled["src"], spilled["tgt"], CombineSpec(memory_budget_mb=1), ["id"],
+                                            str(tmp_path / "spilled"))
+
+    assert expected_stats["strategy"] == "hash" and not expected_stats["spilled"]
+    assert actual_stats["strategy"] == strategy and actual_stats["spilled"]
+    assert actual_stats["null_key_rows"] == expected_stats["null_key_rows"]
+    assert row_sets(actual) == row_sets(expected)
+    assert not os.path.exists(tmp_path / "spilled" / "_spill")
@@ -0,0 +1,41 @@
+import numpy as np
+
+from columnar import Chunk, DictionaryArray
+from config_loader import MatchRule
+import matching
+from matching import assign_pairs, match_residues
+
+
+def test_assign_pairs_pairs_exact_ties_in_bulk(monkeypatch):
+    # 300 amounts with 100 src and 100 tgt rows each; every same-amount pair scores 0
+    amounts = np.repeat(np.arange(300), 100)
+    first = np.searchsorted(amounts, amounts, "left")
+    counts = np.searchsorted(amounts, amounts, "right") - first
+    src_rows = np.repeat(np.arange(len(amounts)), counts)
+    tgt_rows = np.concatenate([np.arange(start, start + count) for start, count in zip(first, counts)])
+    group_min = matching._group_min
+    calls = []
+    monkeypatch.setattr(matching, "_group_min", lambda *args: calls.append(args) or group_min(*args))
+    src, tgt = assign_pairs(src_rows, tgt_rows, np.zeros(len(src_rows)))
+    # Every tie block pairs off in the first round (two _group_min calls), the n-th src with the n-th tgt,
+    # where pairing one tie per round took 100 rounds
+    assert len(calls) == 2
+    assert sorted(zip(src.tolist(), tgt.tolist())) == [(row, row) for row in range(len(amounts))]
+
+
+def test_assign_pairs_prefers_closer_matches():
+    src, tgt = assign_pairs(np.array([0, 0, 1]), np.array([0, 1, 0]), np.array([0.5, 0.0, 0.1]))
+    assert sorted(zip(src.tolist(), tgt.tolist())) == [(0, 1), (1, 0)]
+
+
+def test_match_residues_with_duplicate_amounts():
+    amounts = np.repeat(np.round(np.arange(100) * 10.0, 2), 60)
+    src = Chunk({"ccy": DictionaryArray.encode(np.array(["USD"] * len(amounts))), "amt": amounts}, 0)
+    tgt = Chunk({"ccy": DictionaryArray.encode(np.array(["USD"] * (len(amounts) - 100))),
+                 "amt": amounts[:-100] + 0.01}, 0)
+    rule = MatchRule(name="amount", fields=[{"column": "ccy"}, {"column": "amt", "tolerance": 0.01}])
+    matches, stats = match_residues(src, tgt, [rule])
+    _, matched_src, matched_tgt = matches[0]
+    assert stats["amount"]["matched_rows"] == len(tgt.columns["amt"])
+    assert len(np.unique(matched_src)) == len(matched_src)
+    assert np.allclose(src.columns["amt"][matched_src], tgt.columns["amt"][matched_tgt] - 0.01)
@@ -0,0 +1,60 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# Set while a node runs on a thread; stopping or resetting the node sets the event
+_cancel_flag: ContextVar[Optional[threading.Event]] = ContextVar("cancel_flag", default=None)
+
+
+class RunCancelled(Exception):
+    """The node run was stopped or reset; raised at the next chunk boundary."""
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Process pool shared by the CPU-heavy stages.
+
+    Workers are spawned rather than forked because the API process runs
+    threads (the event loop and ``asyncio.to_thread`` handlers).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"⚙️ Started process pool with {WORKER_PROCESSES} workers")
+        return _pool
+
+
+def shutdown_process_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+@contextmanager
+def cancellable(flag: Optional[threading.Event]) -> Iterator[None]:
+    """Make ``check_cancelled`` raise on this thread once ``flag`` is set."""
+    token = _cancel_flag.set(flag)
+    try:
+        yield
+    finally:
+        _cancel_flag.reset(token)
+
+
+def check_cancelled() -> None:
+    """Called between chunks; a worker thread cannot be interrupted, so it stops itself here."""
+    flag = _cancel_flag.get()
+    if flag is not None and flag.is_set():
+        raise RunCancelled("node run was cancelled")
@@ -1412,6 +1412,7 @@ export default function CompletenessControl({ instanceId }: { instanceId?: strin
                 nodeId,
                 parameters: params,
                 previousOutputs,
+                instanceId: instanceId || 'default',
                 timestamp: new Date().toISOString()
             };
             const response = await ApiService.startCalculation(request);
@@ -28,6 +28,7 @@ export interface CalculationInput {
     nodeId: string;
     parameters: RunParameters;
     previousOutputs?: { [nodeId: string]: any };
+    instanceId?: string;
     num1?: number;
     num2?: number;
     num3?: number;